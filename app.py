@@ -7,159 +7,40 @@ detailed estimates of average household spending with bootstrap variance estimat
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pyreadstat
-from pathlib import Path
 import json
+import os
+import re
+import time
+import uuid
 import warnings
+from datasets import DEFAULT_YEAR, DatasetRegistry
+from instrumentation import StageLog, profile_path, profiled, profiling_enabled
+from job_queue import JobManager
+from shs_metadata import (
+    VALUE_LABELS, CODE_LABELS, FILTER_VARIABLES, FILTER_LABELS, SPENDING_CATEGORIES, SPENDING_DESCRIPTIONS,
+    ITEMS_FOR_TC001_BALANCE, PARENT_TOTALS_TO_EXCLUDE
+)
+from release_rules import MIN_RECORDS, flag_legend, flag_table, parent_positions
+from shs_engine import (
+    SIGNIFICANCE_Z, FilterIndex, compare_groups, confidence_intervals, difference_tests, variable_exists
+)
 warnings.filterwarnings('ignore')
 
+# Estimate columns of the income range table (blanked together when a row is suppressed)
+INCOME_RANGE_ESTIMATES = ['Mean Dollars Per Year', 'Variance', 'Standard Error', 'Coefficient of Variation',
+                          'Participation Rate (%)', 'Participation SE (%)', 'Mean per Reporting Household',
+                          'Reporting Mean SE']
+
+# Percentiles offered in the percentile mode
+PERCENTILE_OPTIONS = [10, 25, 50, 75, 90, 95]
+
 # Set page config
 st.set_page_config(
-    page_title="Survey of Household Spending 2019 - Spending Estimates",
+    page_title="Survey of Household Spending - Spending Estimates",
     page_icon="💰",
     layout="wide"
 )
 
-# Data paths
-DATA_DIR = Path("SHS_EDM_2019/Data/SAS")
-MAIN_FILE = DATA_DIR / "pumf_shs2019.sas7bdat"
-BSW_FILE = DATA_DIR / "pumf_shs2019_bsw.sas7bdat"
-
-# Value label mappings for filter variables
-VALUE_LABELS = {
-    'PROV': {
-        "10": "Newfoundland and Labrador",
-        "11": "Prince Edward Island",
-        "12": "Nova Scotia",
-        "13": "New Brunswick",
-        "24": "Quebec",
-        "35": "Ontario",
-        "46": "Manitoba",
-        "47": "Saskatchewan",
-        "48": "Alberta",
-        "59": "British Columbia",
-        "63": "Territorial capitals"
-    },
-    'HHTYPE6': {
-        "1": "One person household",
-        "2": "Couple without children",
-        "3": "Couple with children",
-        "4": "Couple with other related or unrelated persons",
-        "5": "Lone parent family with no additional persons",
-        "6": "Other household with related or unrelated persons"
-    },
-    'HHSIZE': {
-        "1": "1",
-        "2": "2",
-        "3": "3",
-        "4": "4 or more"
-    },
-    'P0TO4YN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'P5TO15YN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'P16TO29YN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'P30TO64YN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'P65TO74YN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'P75PLUSYN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'RP_AGEGRP': {
-        "01": "Less than 30 years",
-        "02": "30 to 39 years",
-        "03": "40 to 54 years",
-        "04": "55 to 64 years",
-        "05": "65 to 74 years",
-        "06": "75 years and over"
-    },
-    'RP_GENDER': {
-        "1": "Male",
-        "2": "Female"
-    },
-    'RP_MARSTAT': {
-        "1": "Married or common-law",
-        "2": "Single, never married",
-        "3": "Separated, widowed or divorced"
-    },
-    'RP_EDUC': {
-        "1": "Less than high school diploma or its equivalent",
-        "2": "High school diploma, high school equivalency certificate, or not stated",
-        "3": "Certificate or diploma from a trades school, college, CEGEP or other non-university educational institution",
-        "4": "University certificate or diploma",
-        "9": "Masked records (Prince Edward Island and the territorial capitals)"
-    },
-    'SPOUSEYN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'SP_AGEGRP': {
-        "01": "Less than 30 years",
-        "02": "30 to 39 years",
-        "03": "40 to 54 years",
-        "04": "55 to 64 years",
-        "05": "65 to 74 years",
-        "06": "75 years and over",
-        "96": "No spouse"
-    },
-    'SP_GENDER': {
-        "1": "Male",
-        "2": "Female",
-        "6": "No spouse"
-    },
-    'SP_EDUC': {
-        "1": "Less than high school diploma or its equivalent",
-        "2": "High school diploma, high school equivalency certificate, or not stated",
-        "3": "Certificate or diploma from a trades school, college, CEGEP or other non-university educational institution",
-        "4": "University certificate or diploma",
-        "6": "No spouse",
-        "9": "Masked records (Prince Edward Island and the territorial capitals)"
-    },
-    'DWELTYP': {
-        "1": "Single detached",
-        "2": "Double, row, terrace or duplex",
-        "3": "Apartment or other"
-    },
-    'TENURE': {
-        "1": "Owned with mortgage",
-        "2": "Owned without mortgage",
-        "3": "Rented"
-    },
-    'NUMBEDR': {
-        "1": "1",
-        "2": "2",
-        "3": "3",
-        "4": "4 or more"
-    },
-    'VEHICLEYN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'RECVEHYN': {
-        "1": "Yes",
-        "2": "No"
-    },
-    'HH_MAJINCSRC': {
-        "1": "Earnings (employment income)",
-        "2": "Investment income",
-        "3": "Government transfer payments",
-        "4": "Other income"
-    }
-}
-
 def format_value(var_name, value):
     """Format a value using its label if available"""
     if var_name in VALUE_LABELS:
@@ -167,446 +48,24 @@ def format_value(var_name, value):
         str_val = str(value).strip()
         if str_val in VALUE_LABELS[var_name]:
             return VALUE_LABELS[var_name][str_val]
+        # Filter columns loaded as integer codes (1 for "01")
+        try:
+            return CODE_LABELS[var_name].get(int(float(str_val)), str(value))
+        except ValueError:
+            pass
     return str(value)
 
-# Parent/aggregate variables that should be excluded from category totals (to avoid double-counting)
-# These are totals that include their subcategories
-PARENT_TOTALS = {
-    "FD001",  # Food expenditures (parent of all FD variables)
-    "FD003",  # Food purchased from stores (parent of store food items)
-    "FD990",  # Food purchased from restaurants (parent of FD991)
-    "FD991",  # Restaurant meals (parent of FD992-FD995)
-    "FD100",  # Bakery products (parent of FD101-FD108, FD112)
-    "FD200",  # Cereal grains and cereal products (parent of FD201-FD212)
-    "FD300",  # Fruit, fruit preparations and nuts (parent of FD301-FD316, FD330-FD382)
-    "FD400",  # Vegetables and vegetable preparations (parent of FD401-FD412, FD418, FD421, FD440-FD479)
-    "FD500",  # Dairy products and eggs (parent of FD501-FD505, FD520-FD525, FD540-FD541, FD550-FD555, FD570-FD572)
-    "FD600",  # Meat (parent of FD601-FD607, FD650-FD660)
-    "FD700",  # Fish and seafood (parent of FD701-FD706, FD720-FD724, FD730-FD732)
-    "FD800",  # Non-alcoholic beverages and other food products (parent of FD801-FD802, FD806, FD814-FD815, FD821, FD827-FD829, FD833-FD889)
-    "CS030",  # Communications (parent of CS003, CS004, CS005, etc.)
-    "HF001",  # Household furnishings and equipment (parent of HF002)
-    "HE001",  # Household equipment (parent of HE002, HE010, etc.)
-    "HC001",  # Health care (parent of HC002, HC022, etc.)
-    "HO001",  # Household operations (parent of HO002, HO003, etc.)
-    "PC001",  # Personal care (parent of PC002, PC020)
-    "RE001",  # Recreation (parent of RE002, RE003, etc.)
-    "RO001",  # Reading materials (parent of RO002, RO003, etc.)
-    "RV001",  # Recreational vehicles (parent of RV010, RV020)
-    "SH001",  # Shelter (parent of SH002, SH003, etc.)
-    "SH002",  # Shelter (another parent total)
-    "TR001",  # Transportation (parent of TR002, TR003, etc.)
-    "TR002",  # Transportation (another parent total)
-    "ME001",  # Miscellaneous expenditures (parent of ME039, ME040)
-    "TA018",  # Tobacco products, alcoholic beverages and cannabis (parent of TA005, TA006, TA007, TA008, TA990)
-    "TC001",  # Total current consumption (parent of all consumption)
-    "TE001"   # Total expenditure (parent of all expenditure)
-}
-
-# Spending category mappings (organized by major category prefix)
-# Excludes parent totals to avoid double-counting
-SPENDING_CATEGORIES = {
-    "Child Care": ["CC001"],
-    "Clothing": ["CL014", "CL015", "CL016", "CL017", "CL023", "CL026", "CL029", "CL030", "CL990"],
-    "Communications": ["CS003", "CS004", "CS005", "CS007", "CS008", "CS020", "CS021"],  # Excluded CS030 (parent)
-    "Education": ["ED002", "ED003", "ED030"],
-    "Personal Insurance": ["EP011"],
-    "Food": [
-        # Excluded parent totals: FD001, FD003, FD990, FD991, FD100, FD200, FD300, FD400, FD500, FD600, FD700, FD800
-        "FD1001", "FD1002", "FD1003", "FD1004", "FD101", "FD102", "FD103",
-        "FD104", "FD105", "FD106", "FD107", "FD108", "FD112", "FD201", "FD202", "FD203",
-        "FD204", "FD205", "FD206", "FD207", "FD208", "FD209", "FD212", "FD301", "FD302",
-        "FD303", "FD304", "FD305", "FD308", "FD309", "FD315", "FD316", "FD330", "FD331", "FD350",
-        "FD380", "FD381", "FD382", "FD401", "FD402", "FD403", "FD404", "FD405", "FD406",
-        "FD407", "FD408", "FD409", "FD410", "FD411", "FD412", "FD418", "FD421", "FD440", "FD441",
-        "FD442", "FD447", "FD470", "FD471", "FD478", "FD479", "FD501", "FD502", "FD503",
-        "FD504", "FD505", "FD520", "FD521", "FD522", "FD525", "FD540", "FD541", "FD550", "FD551",
-        "FD555", "FD570", "FD571", "FD572", "FD601", "FD602", "FD603", "FD604", "FD607",
-        "FD650", "FD651", "FD660", "FD701", "FD705", "FD706", "FD720", "FD721", "FD722",
-        "FD723", "FD724", "FD730", "FD731", "FD732", "FD801", "FD802", "FD806", "FD814",
-        "FD815", "FD821", "FD827", "FD828", "FD829", "FD833", "FD834", "FD835", "FD836", "FD837",
-        "FD838", "FD839", "FD840", "FD841", "FD842", "FD843", "FD844", "FD845", "FD846", "FD847",
-        "FD850", "FD851", "FD852", "FD853", "FD854", "FD855", "FD857", "FD870", "FD871", "FD872",
-        "FD873", "FD874", "FD875", "FD879", "FD880", "FD881", "FD882", "FD883", "FD884", "FD885",
-        "FD889", "FD992", "FD993", "FD994", "FD995"  # Restaurant subcategories (excluded FD990, FD991)
-    ],
-    "Games of Chance": ["GC001"],
-    "Health Care": ["HC002", "HC022", "HC025", "HC061"],  # Excluded HC001 (parent total)
-    "Household Equipment": ["HE002", "HE010", "HE017", "HE020"],  # Excluded HE001 (parent total)
-    "Household Furnishings": ["HF002"],  # Excluded HF001 (parent total)
-    "Household Operations": ["HO002", "HO003", "HO004", "HO005", "HO006", "HO010", "HO014", "HO018", "HO022"],  # Excluded HO001 (parent total)
-    "Miscellaneous": ["ME039", "ME040"],  # Excluded ME001 (parent total)
-    "Gifts and Contributions": ["MG001"],
-    "Personal Care": ["PC002", "PC020"],  # Excluded PC001 (parent total)
-    "Recreation": [
-        # Excluded RE001 (parent total)
-        "RE002", "RE003", "RE006", "RE007", "RE010", "RE016", "RE020", "RE022", "RE032",
-        "RE040", "RE041", "RE052", "RE060", "RE061", "RE062", "RE063", "RE066", "RE067", "RE074",
-        "RE090", "RE120", "RE124", "RE127", "RE140", "RE990"
-    ],
-    "Reading Materials": ["RO002", "RO003", "RO004", "RO005", "RO010"],  # Excluded RO001 (parent total)
-    "Recreational Vehicles": ["RV010", "RV020"],  # Excluded RV001 (parent total)
-    "Shelter": [
-        # Excluded SH001, SH002 (parent totals)
-        "SH003", "SH004", "SH010", "SH011", "SH015", "SH016", "SH019", "SH030",
-        "SH031", "SH032", "SH033", "SH034", "SH040", "SH041", "SH042", "SH044", "SH046", "SH047",
-        "SH050", "SH060", "SH061", "SH062", "SH082", "SH990", "SH991", "SH992"
-    ],
-    "Tobacco and Alcohol": ["TA005", "TA006", "TA007", "TA008", "TA990"],  # Excluded TA018 (parent total)
-    "Transportation": [
-        # Excluded TR001, TR002 (parent totals)
-        "TR003", "TR004", "TR008", "TR010", "TR020", "TR021", "TR022", "TR030",
-        "TR031", "TR033", "TR034", "TR036", "TR038", "TR039", "TR070", "TR071", "TR085"
-    ],
-    "Income Taxes": ["TX010"]
-}
-
-# Spending variable descriptions (from SAS labels)
-SPENDING_DESCRIPTIONS = {
-    "CC001": "Child care",
-    "CL014": "Laundromats, dry-cleaning and laundry services",
-    "CL015": "Services for clothing, footwear and jewellery",
-    "CL016": "Clothing services",
-    "CL017": "Clothing material, yarn, thread and other notions",
-    "CL023": "Children's wear (under 14 years)",
-    "CL026": "Men's and boys' wear (14 years and over)",
-    "CL029": "Women's and girls' wear (14 years and over)",
-    "CL030": "Clothing and accessories",
-    "CL990": "Accessories, watches, jewellery and athletic footwear",
-    "CS003": "Telephone",
-    "CS004": "Landline telephone services",
-    "CS005": "Cell phone and pager services",
-    "CS007": "Internet access services",
-    "CS008": "Digital services",
-    "CS020": "Postal, courier, delivery and other communication services",
-    "CS021": "Telephones and equipment",
-    "CS030": "Communications",
-    "ED002": "Education",
-    "ED003": "Tuition fees",
-    "ED030": "Textbooks and school supplies",
-    "EP011": "Personal insurance payments and pension contributions",
-    "FD001": "Food expenditures",
-    "FD003": "Food purchased from stores",
-    "FD100": "Bakery products",
-    "FD1001": "Frozen side dishes and other frozen prepared food",
-    "FD1002": "Other ready-to-serve prepared food",
-    "FD1003": "Cod, flounder, sole and haddock (fresh or frozen, uncooked)",
-    "FD1004": "Other oils and fats",
-    "FD101": "Bread and unsweetened rolls and buns",
-    "FD102": "Bread",
-    "FD103": "Unsweetened rolls and buns",
-    "FD104": "Cookies and crackers",
-    "FD105": "Cookies and sweet biscuits",
-    "FD106": "Crackers and crisp breads",
-    "FD107": "Other bakery products",
-    "FD108": "Other bakery products (except frozen)",
-    "FD112": "Frozen bakery products",
-    "FD200": "Cereal grains and cereal products",
-    "FD201": "Rice and rice mixes",
-    "FD202": "Rice",
-    "FD203": "Rice mixes",
-    "FD204": "Pasta products",
-    "FD205": "Pasta (fresh or dry)",
-    "FD206": "Pasta (canned)",
-    "FD207": "Pasta mixes",
-    "FD208": "Other cereal grains and cereal products",
-    "FD209": "Flour and flour-based mixes",
-    "FD212": "Breakfast cereal and other grain products (except infant)",
-    "FD300": "Fruit, fruit preparations and nuts",
-    "FD301": "Fresh fruit",
-    "FD302": "Apples (fresh)",
-    "FD303": "Bananas and plantains (fresh)",
-    "FD304": "Grapes (fresh)",
-    "FD305": "Peaches and nectarines (fresh)",
-    "FD308": "Pears (fresh)",
-    "FD309": "Berries (fresh)",
-    "FD315": "Citrus fruit (fresh)",
-    "FD316": "Other fruit (fresh)",
-    "FD330": "Preserved fruit and fruit preparations",
-    "FD331": "Fruit juice",
-    "FD350": "Other preserved fruit and fruit preparations",
-    "FD380": "Nuts and seeds",
-    "FD381": "Peanuts (shelled or unshelled)",
-    "FD382": "Other nuts and seeds",
-    "FD400": "Vegetables and vegetable preparations",
-    "FD401": "Fresh vegetables",
-    "FD402": "Potatoes (except sweet potatoes)",
-    "FD403": "Tomatoes (fresh)",
-    "FD404": "Lettuce (fresh)",
-    "FD405": "Cabbage (fresh)",
-    "FD406": "Carrots (fresh)",
-    "FD407": "Onions (fresh)",
-    "FD408": "Celery (fresh)",
-    "FD409": "Cucumber (fresh)",
-    "FD410": "Mushrooms (fresh)",
-    "FD411": "Broccoli (fresh)",
-    "FD412": "Other vegetables (fresh)",
-    "FD418": "Peppers (fresh)",
-    "FD421": "Fresh herbs",
-    "FD440": "Frozen and dried vegetables",
-    "FD441": "Potato products (frozen)",
-    "FD442": "Other frozen vegetables",
-    "FD447": "Dried vegetables and legumes",
-    "FD470": "Canned vegetables and other vegetable preparations",
-    "FD471": "Canned or bottled vegetables",
-    "FD478": "Ready-to-serve or ready-to-cook prepared salads and side dishes, fruit or vegetable based",
-    "FD479": "Vegetable juice (canned or bottled)",
-    "FD500": "Dairy products and eggs",
-    "FD501": "Cheese",
-    "FD502": "Cheddar cheese",
-    "FD503": "Mozzarella cheese",
-    "FD504": "Processed cheese",
-    "FD505": "Other cheeses",
-    "FD520": "Milk",
-    "FD521": "Fluid whole milk",
-    "FD522": "Fluid low-fat milk",
-    "FD525": "Skim and other fluid milk",
-    "FD540": "Butter",
-    "FD541": "Ice cream and ice milk (including novelties)",
-    "FD550": "Other dairy products",
-    "FD551": "Other processed milk products",
-    "FD555": "Other processed dairy products",
-    "FD570": "Eggs and other egg products",
-    "FD571": "Eggs",
-    "FD572": "Other egg products",
-    "FD600": "Meat",
-    "FD601": "Meat (except processed meat)",
-    "FD602": "Beef",
-    "FD603": "Pork",
-    "FD604": "Poultry",
-    "FD607": "Other meat and poultry",
-    "FD650": "Processed meat",
-    "FD651": "Bacon and ham",
-    "FD660": "Other processed meat",
-    "FD700": "Fish and seafood",
-    "FD701": "Fresh or frozen fish",
-    "FD705": "Salmon (fresh or frozen, uncooked)",
-    "FD706": "Other fish (fresh or frozen, uncooked)",
-    "FD720": "Canned fish or other preserved fish",
-    "FD721": "Tuna (canned)",
-    "FD722": "Salmon (canned)",
-    "FD723": "Other fish (canned or bottled)",
-    "FD724": "Cured fish",
-    "FD730": "Seafood and other marine products",
-    "FD731": "Shrimp and prawns",
-    "FD732": "Other seafood and marine products",
-    "FD800": "Non-alcoholic beverages and other food products",
-    "FD801": "Non-alcoholic beverages and beverage mixes",
-    "FD802": "Coffee and tea",
-    "FD806": "Non-alcoholic beverages",
-    "FD814": "Sugar and confectionery",
-    "FD815": "Sugar, syrups and sugar substitutes",
-    "FD821": "Candies and chocolates",
-    "FD827": "Margarine, oils and fats (excluding butter)",
-    "FD828": "Margarine",
-    "FD829": "Cooking and salad oils",
-    "FD833": "Condiments, spices and vinegars",
-    "FD834": "Mayonnaise, salad dressings and dips",
-    "FD835": "Pasta and pizza sauces (canned, bottled or dried)",
-    "FD836": "Other sauces and gravies (canned, bottled or dried)",
-    "FD837": "Dried herbs and spices",
-    "FD838": "Ketchup",
-    "FD839": "Other condiments (including vinegar)",
-    "FD840": "Pickled vegetables (including olives)",
-    "FD841": "Infant food",
-    "FD842": "Infant formula",
-    "FD843": "Infant cereals and biscuits",
-    "FD844": "Canned or bottled infant food",
-    "FD845": "Frozen prepared food",
-    "FD846": "Frozen dinners and entrees",
-    "FD847": "Frozen pizza",
-    "FD850": "Soup (except infant soup)",
-    "FD851": "Soup (chilled, frozen, canned or bottled)",
-    "FD852": "Soup (dried)",
-    "FD853": "Ready-to-serve prepared food",
-    "FD854": "Dinners and entrees (except frozen)",
-    "FD855": "Pizza (except frozen)",
-    "FD857": "Fish portions (pre-cooked and frozen)",
-    "FD870": "Other food preparations",
-    "FD871": "Peanut butter and other nut butters",
-    "FD872": "Honey",
-    "FD873": "Flavoured drink powders, crystals and syrups",
-    "FD874": "Non-dairy frozen ice treats",
-    "FD875": "Dessert powders",
-    "FD879": "Food seasonings (including table salt)",
-    "FD880": "Other materials for food preparation",
-    "FD881": "Tofu",
-    "FD882": "Other canned, bottled or dried meals",
-    "FD883": "Snack food",
-    "FD884": "Potato-based snack foods",
-    "FD885": "Other snack foods",
-    "FD889": "Other infant food (including frozen)",
-    "FD990": "Food purchased from restaurants",
-    "FD991": "Restaurant meals",
-    "FD992": "Restaurant dinners",
-    "FD993": "Restaurant lunches",
-    "FD994": "Restaurant breakfasts",
-    "FD995": "Restaurant snacks and beverages",
-    "GC001": "Games of chance",
-    "HC001": "Health care",
-    "HC002": "Direct costs to household",
-    "HC022": "Private health insurance plan premiums",
-    "HC025": "Accident or disability insurance premiums",
-    "HC061": "Private health and dental plan premiums",
-    "HE001": "Household equipment",
-    "HE002": "Household appliances",
-    "HE010": "Other household equipment",
-    "HE017": "Maintenance, rental, repairs and services related to household furnishings and equipment",
-    "HE020": "Services related to household furnishings and equipment",
-    "HF001": "Household furnishings and equipment",
-    "HF002": "Household furnishings",
-    "HO001": "Household operations",
-    "HO002": "Domestic and other custodial services (excluding child care)",
-    "HO003": "Pet expenses",
-    "HO004": "Pet food",
-    "HO005": "Purchase of pets and pet-related goods",
-    "HO006": "Veterinarian and other services",
-    "HO010": "Household cleaning supplies and equipment",
-    "HO014": "Paper, plastic and foil supplies",
-    "HO018": "Garden supplies and services",
-    "HO022": "Other household supplies",
-    "ME001": "Miscellaneous expenditures",
-    "ME039": "Financial services",
-    "ME040": "Other miscellaneous goods and services",
-    "MG001": "Gifts of money, support payments and charitable contributions",
-    "PC001": "Personal care",
-    "PC002": "Personal care products",
-    "PC020": "Personal care services",
-    "RE001": "Recreation",
-    "RE002": "Recreational equipment and related services",
-    "RE003": "Sports, athletic and recreation equipment",
-    "RE006": "Video game systems and accessories (excluding for computers)",
-    "RE007": "Art and craft materials",
-    "RE010": "Computer equipment and supplies",
-    "RE016": "Photographic goods and services",
-    "RE020": "Photographic services",
-    "RE022": "Collectors' items (e.g. stamps, coins)",
-    "RE032": "Other recreational equipment",
-    "RE040": "Home entertainment equipment and services",
-    "RE041": "Home entertainment equipment",
-    "RE052": "Home entertainment services",
-    "RE060": "Recreational services",
-    "RE061": "Entertainment",
-    "RE062": "Movie theatres",
-    "RE063": "Live sporting and performing arts events",
-    "RE066": "Admission fees to museums, zoos, and other sites",
-    "RE067": "Television and satellite radio services (including installation, service and pay TV charges)",
-    "RE074": "Package trips",
-    "RE090": "Use of recreational facilities and fees for other recreational activities",
-    "RE120": "Camcorders, cameras, parts, accessories and related equipment",
-    "RE124": "Sports, athletic and recreational equipment and related services",
-    "RE127": "Rental, maintenance and repairs of sports, athletic and recreational equipment",
-    "RE140": "Other recreational services",
-    "RE990": "Outdoor play equipment and children's toys",
-    "RO001": "Reading materials and other printed matter",
-    "RO002": "Newspapers",
-    "RO003": "Magazines and periodicals",
-    "RO004": "Books and E-Books (excluding school books)",
-    "RO005": "Maps, sheet music and other printed matter",
-    "RO010": "Services related to reading materials (e.g. photocopying, library fees)",
-    "RV001": "Recreational vehicles and associated services",
-    "RV010": "Operation of recreational vehicles",
-    "RV020": "Purchase of recreational vehicles",
-    "SH001": "Shelter",
-    "SH002": "Principal accommodation",
-    "SH003": "Rented living quarters",
-    "SH004": "Rent",
-    "SH010": "Owned living quarters",
-    "SH011": "Mortgage paid",
-    "SH015": "Homeowners' insurance premiums",
-    "SH016": "Other expenditures for owned living quarters",
-    "SH019": "Mortgage insurance premiums",
-    "SH030": "Water, fuel and electricity for principal accommodation",
-    "SH031": "Water and sewage",
-    "SH032": "Electricity",
-    "SH033": "Natural gas",
-    "SH034": "Other fuel",
-    "SH040": "Other accommodation",
-    "SH041": "Owned secondary residences",
-    "SH042": "Mortgage paid",
-    "SH044": "Insurance premiums",
-    "SH046": "Other expenses for owned secondary residences",
-    "SH047": "Other owned properties",
-    "SH050": "Accommodation away from home",
-    "SH060": "Communication and home security services (e.g. landline telephone, television, satellite radio and Internet)",
-    "SH061": "Property and school taxes, water and sewage charges",
-    "SH062": "Electricity and fuel (e.g. natural gas and wood)",
-    "SH082": "Repairs and maintenance",
-    "SH990": "Other expenses for rented living quarters",
-    "SH991": "Condominium fees, property taxes and school taxes",
-    "SH992": "All other expenses for the owned living quarters",
-    "TA005": "Alcoholic beverages",
-    "TA006": "Alcoholic beverages served on licensed premises and in restaurants",
-    "TA007": "Alcoholic beverages purchased from stores",
-    "TA008": "Self-made alcoholic beverages",
-    "TA018": "Tobacco products, alcoholic beverages and cannabis for non-medical use",
-    "TA990": "Tobacco products, smokers' supplies and cannabis for non-medical use",
-    "TR001": "Transportation",
-    "TR002": "Private transportation",
-    "TR003": "Private use automobiles, vans and trucks",
-    "TR004": "Purchase of automobiles, vans and trucks",
-    "TR008": "Accessories for automobiles, vans and trucks",
-    "TR010": "Fees for leased automobiles, vans and trucks",
-    "TR020": "Rented automobiles, vans and trucks",
-    "TR021": "Fees for rented vehicles (including insurance and mileage)",
-    "TR022": "Other expenses for rented automobiles, vans and trucks",
-    "TR030": "Automobile, van and truck operations",
-    "TR031": "Registration fees (including insurance if part of registration)",
-    "TR033": "Tires, batteries, and other parts and supplies for vehicles",
-    "TR034": "Maintenance and repairs of vehicles",
-    "TR036": "Gas and other fuels (all vehicles and tools)",
-    "TR038": "Parking (excluding parking fees included in rent and traffic and parking tickets)",
-    "TR039": "Drivers' licences and tests, and driving lessons",
-    "TR070": "Public transportation",
-    "TR071": "Vehicle operation, security and communication services",
-    "TR085": "Public and private vehicle insurance premiums",
-    "TX010": "Income taxes",
-    "TC001": "Total current consumption",
-    "TE001": "Total expenditure"
-}
-
-# Get all spending variables
-ALL_SPENDING_VARS = []
-for category, vars_list in SPENDING_CATEGORIES.items():
-    ALL_SPENDING_VARS.extend(vars_list)
-ALL_SPENDING_VARS = sorted(set(ALL_SPENDING_VARS))
-
-# Items to include - only the 19 specified expenditure categories
-# These are Level 2 categories plus totals that should balance with TC001
-ITEMS_FOR_TC001_BALANCE = {
-    # Totals
-    "TE001",   # Total expenditure
-    "TC001",   # Total current consumption
-    
-    # Level 2 expenditure categories
-    "FD001",   # Food expenditures
-    "SH001",   # Shelter
-    "HO001",   # Household operations
-    "HF001",   # Household furnishings and equipment
-    "CL030",   # Clothing and accessories
-    "TR001",   # Transportation
-    "HC001",   # Health care
-    "PC001",   # Personal care
-    "RE001",   # Recreation
-    "ED002",   # Education
-    "RO001",   # Reading materials and other printed matter
-    "TA018",   # Tobacco products, alcoholic beverages and cannabis for non-medical use
-    "GC001",   # Games of chance
-    "ME001",   # Miscellaneous expenditures
-    "TX010",   # Income taxes
-    "EP011",   # Personal insurance payments and pension contributions
-    "MG001"    # Gifts of money, support payments and charitable contributions
-}
-
-# No parent totals to exclude - we're using Level 2 categories directly
-PARENT_TOTALS_TO_EXCLUDE = set()
+@st.cache_resource
+def get_dataset_registry():
+    """Survey years available to the app; opened datasets are shared by all sessions"""
+    return DatasetRegistry()
 
 # Load hierarchy structure
 @st.cache_data
-def load_hierarchy():
+def load_hierarchy(year=DEFAULT_YEAR):
     """Load the hierarchy structure from JSON file"""
     try:
-        hierarchy_file = Path("hierarchy_structure.json")
+        hierarchy_file = get_dataset_registry().spec(year).hierarchy_file
         if hierarchy_file.exists():
             with open(hierarchy_file, 'r') as f:
                 return json.load(f)
@@ -615,138 +74,48 @@ def load_hierarchy():
         st.warning(f"Could not load hierarchy structure: {e}")
         return None
 
-@st.cache_data
-def load_data():
-    """Load the main dataset"""
+def load_data(year=DEFAULT_YEAR):
+    """Load the main dataset (memory-mapped from the year's columnar cache once it exists, once per cache)"""
     try:
-        # Try reading with pyreadstat first
-        df, meta = pyreadstat.read_sas7bdat(str(MAIN_FILE))
-        return df, meta
+        return get_dataset_registry().main_frame(year), None
     except Exception as e1:
         st.error(f"Error loading main data file: {e1}")
         return None, None
 
-@st.cache_data
-def load_bootstrap_weights():
-    """Load the bootstrap weights dataset"""
-    try:
-        df_bsw, meta_bsw = pyreadstat.read_sas7bdat(str(BSW_FILE))
-        return df_bsw, meta_bsw
-    except Exception as e1:
-        st.error(f"Error loading bootstrap weights file: {e1}")
-        return None, None
+def open_dataset(job, year):
+    """Open a year's dataset with its bootstrap weights (runs as a background job)"""
+    job.report(0.0, f"Loading the {year} bootstrap weights...")
+    return get_dataset_registry().open(year)
 
-def get_bootstrap_weights(df, df_bsw):
-    """Get all bootstrap weight column names and merge with main data"""
-    if df_bsw is None:
-        return df, []
-    
-    # Merge bootstrap weights with main data on CaseID (handle case differences)
-    # Main file uses 'CaseID', bootstrap file uses 'caseid'
-    if 'CaseID' in df.columns:
-        if 'caseid' in df_bsw.columns:
-            df = df.merge(df_bsw, left_on='CaseID', right_on='caseid', how='left')
-        elif 'CaseID' in df_bsw.columns:
-            df = df.merge(df_bsw, left_on='CaseID', right_on='CaseID', how='left')
-    
-    # Get all BSW columns
-    bsw_cols = [col for col in df.columns if col.startswith('BSW')]
-    # Sort numerically by the number after BSW
-    def sort_key(col):
-        try:
-            return int(col.replace('BSW', ''))
-        except:
-            return 0
-    return df, sorted(bsw_cols, key=sort_key)
-
-def get_variable_value(df, var):
-    """Get the variable value, handling _C and _D versions.
-    If both _C and _D exist, sum them. Otherwise use the available version."""
-    var_c = var + '_C'
-    var_d = var + '_D'
-    
-    has_c = var_c in df.columns
-    has_d = var_d in df.columns
-    
-    if has_c and has_d:
-        # Both exist, sum them
-        return df[var_c].fillna(0) + df[var_d].fillna(0)
-    elif has_c:
-        # Only _C exists
-        return df[var_c]
-    elif has_d:
-        # Only _D exists
-        return df[var_d]
-    elif var in df.columns:
-        # Base variable exists (no _C or _D)
-        return df[var]
-    else:
-        # Variable doesn't exist
-        return pd.Series([np.nan] * len(df), index=df.index)
+@st.cache_resource
+def get_filter_index(year):
+    """Filter index of a year's main columns, for counting records before its replicate engine is open"""
+    return FilterIndex(load_data(year)[0])
 
-def calculate_weighted_mean(df, var, weight_col='WeightD'):
-    """Calculate weighted mean for a variable, handling _C and _D versions"""
-    # Get the variable value (handling _C and _D)
-    var_values = get_variable_value(df, var)
-    
-    # Filter out missing values
-    mask = var_values.notna() & (df[weight_col] > 0)
-    if mask.sum() == 0:
-        return np.nan
-    
-    weighted_sum = (var_values.loc[mask] * df.loc[mask, weight_col]).sum()
-    total_weight = df.loc[mask, weight_col].sum()
-    
-    if total_weight == 0:
-        return np.nan
-    
-    return weighted_sum / total_weight
+@st.cache_resource
+def get_dataset_jobs():
+    """Latest open job per survey year, shared by all sessions"""
+    return {}
 
-def calculate_bootstrap_variance(df, var, weight_col='WeightD', bootstrap_cols=None):
-    """Calculate bootstrap variance using bootstrap weights, handling _C and _D versions"""
-    if bootstrap_cols is None or len(bootstrap_cols) == 0:
-        return np.nan
-    
-    # Get variable values (handling _C and _D)
-    var_values = get_variable_value(df, var)
-    
-    # Calculate estimate with main weight
-    mask = var_values.notna() & (df[weight_col] > 0)
-    if mask.sum() == 0:
-        return np.nan
-    
-    weighted_sum = (var_values.loc[mask] * df.loc[mask, weight_col]).sum()
-    total_weight = df.loc[mask, weight_col].sum()
-    
-    if total_weight == 0:
-        return np.nan
-    
-    main_estimate = weighted_sum / total_weight
-    
-    if np.isnan(main_estimate):
-        return np.nan
-    
-    # Calculate estimates with each bootstrap weight
-    bootstrap_estimates = []
-    for bs_col in bootstrap_cols:
-        if bs_col in df.columns:
-            bs_mask = var_values.notna() & (df[bs_col] > 0)
-            if bs_mask.sum() > 0:
-                bs_weighted_sum = (var_values.loc[bs_mask] * df.loc[bs_mask, bs_col]).sum()
-                bs_total_weight = df.loc[bs_mask, bs_col].sum()
-                if bs_total_weight > 0:
-                    bs_estimate = bs_weighted_sum / bs_total_weight
-                    if not np.isnan(bs_estimate):
-                        bootstrap_estimates.append(bs_estimate)
-    
-    if len(bootstrap_estimates) == 0:
-        return np.nan
-    
-    # Bootstrap variance formula: sum((estimate_b - estimate_full)^2) / B
-    bootstrap_estimates = np.array(bootstrap_estimates)
-    variance = np.mean((bootstrap_estimates - main_estimate) ** 2)
-    
-    return variance
+def get_dataset_job(year, retry=False):
+    """Job opening a year's dataset; submitted again if the year has been closed since, or if it
+    failed and retry is set (a failed job is kept so its error can be shown)"""
+    jobs = get_dataset_jobs()
+    job = jobs.get(year)
+    # Keep the Job itself: the manager may prune finished jobs
+    if (job is None or job.status == 'cancelled' or (retry and job.status == 'failed')
+            or (job.status == 'done' and get_dataset_registry().get(year) is None)):
+        job_manager = get_job_manager()
+        job = jobs[year] = job_manager.get(job_manager.submit('open_dataset', open_dataset, year, heavy=False))
+    return job
+
+@st.fragment(run_every=1.0)
+def wait_for_bootstrap_weights(job):
+    """Progress note that reruns the whole app once the bootstrap weights are loaded"""
+    if job.finished:
+        st.rerun()
+    st.info("Loading bootstrap weights in the background. You can choose attributes now; "
+            "the Calculate buttons are enabled when loading finishes.")
 
 def filter_data(df, filters, income_range=None):
     """Apply filters to the dataset"""
@@ -782,6 +151,43 @@ def format_option_label(var_name, value):
     label = format_value(var_name, value)
     return f"{label} ({value})" if label != str(value) else str(value)
 
+@st.cache_data
+def load_filter_options(year=DEFAULT_YEAR):
+    """Option values, labels and record counts for every filter widget, plus the income bounds.
+
+    Computed once per process and survey year from the loaded data, so script
+    reruns render the widgets without scanning any column."""
+    df, _ = load_data(year)
+    if df is None:
+        return {}
+    options = {}
+    for var, column in FILTER_VARIABLES.items():
+        values = get_unique_values(df, column)
+        counts = df[column].value_counts() if column in df.columns else {}
+        options[column] = {
+            'values': values,
+            'labels': {value: format_option_label(var, value) for value in values},
+            'counts': {value: int(counts.get(value, 0)) for value in values}
+        }
+    if 'HH_TotInc' in df.columns:
+        options['income_bounds'] = (float(df['HH_TotInc'].min()), float(df['HH_TotInc'].max()))
+    return options
+
+@st.cache_data
+def load_spending_code_options(year=DEFAULT_YEAR):
+    """Spending codes present in a year's data, in hierarchy order (the balance codes without a hierarchy)"""
+    df, _ = load_data(year)
+    if df is None:
+        return []
+    hierarchy_data = load_hierarchy(year)
+    candidates = hierarchy_data.get('var_to_node', {}) if hierarchy_data else ITEMS_FOR_TC001_BALANCE
+    return get_hierarchy_ordered_vars([var for var in candidates if variable_exists(df, var)], hierarchy_data)
+
+def option_formatter(filter_options, column):
+    """format_func for a filter widget: the precomputed label and the option's record count"""
+    option = filter_options[column]
+    return lambda value: f"{option['labels'][value]} · {option['counts'][value]:,} records"
+
 def organize_hierarchical_results(results_df, hierarchy_data):
     """Organize results by hierarchy level with proper indentation"""
     if hierarchy_data is None:
@@ -793,14 +199,18 @@ def organize_hierarchical_results(results_df, hierarchy_data):
     # Build ordered list based on hierarchy file order (by level, then by hierarchy position)
     # Create a mapping of var_code to results
     results_dict = {}
-    for _, row in results_df.iterrows():
+    for row in results_df.to_dict('records'):
         var_code = row['Spending Code']
         results_dict[var_code] = {
             'var_code': var_code,
             'mean': row['Mean Dollars Per Year'],
             'variance': row['Variance'],
             'std_error': row['Standard Error'],
-            'cv': row['Coefficient of Variation']
+            'cv': row['Coefficient of Variation'],
+            'participation': row.get('Participation Rate (%)', np.nan),
+            'participation_se': row.get('Participation SE (%)', np.nan),
+            'reporter_mean': row.get('Mean per Reporting Household', np.nan),
+            'reporter_mean_se': row.get('Reporting Mean SE', np.nan)
         }
     
     # Get all variables in hierarchy order (by level, maintaining file order)
@@ -818,7 +228,11 @@ def organize_hierarchical_results(results_df, hierarchy_data):
                     'mean': results_dict[var_code]['mean'],
                     'variance': results_dict[var_code]['variance'],
                     'std_error': results_dict[var_code]['std_error'],
-                    'cv': results_dict[var_code]['cv']
+                    'cv': results_dict[var_code]['cv'],
+                    'participation': results_dict[var_code]['participation'],
+                    'participation_se': results_dict[var_code]['participation_se'],
+                    'reporter_mean': results_dict[var_code]['reporter_mean'],
+                    'reporter_mean_se': results_dict[var_code]['reporter_mean_se']
                 })
     
     return hierarchical_results, var_to_node
@@ -844,41 +258,1000 @@ def build_hierarchical_display(hierarchical_results, var_to_node):
             'Mean Dollars Per Year': item['mean'],
             'Variance': item['variance'],
             'Standard Error': item['std_error'],
-            'Coefficient of Variation': item['cv']
+            'Coefficient of Variation': item['cv'],
+            'Participation Rate (%)': item['participation'],
+            'Participation SE (%)': item['participation_se'],
+            'Mean per Reporting Household': item['reporter_mean'],
+            'Reporting Mean SE': item['reporter_mean_se']
         })
     
     return pd.DataFrame(display_rows)
 
+def income_range_table(results_df, hierarchy_data, n_records=None, suppress=False):
+    """Income range results in hierarchy order (as calculated without a hierarchy) with a Quality flag column.
+
+    Complementary suppression follows the hierarchy when there is one."""
+    hierarchical_results, var_to_node = organize_hierarchical_results(results_df, hierarchy_data)
+    if hierarchical_results:
+        table = build_hierarchical_display(hierarchical_results, var_to_node).drop(columns=['Level'])
+        parents = parent_positions(table['Spending Code'].tolist(), hierarchy_data)
+    else:
+        display_cols = ['Spending Code', 'Spending Description', 'Spending Category'] + INCOME_RANGE_ESTIMATES
+        table = results_df[[c for c in display_cols if c in results_df.columns]]
+        parents = None
+    value_cols = [col for col in INCOME_RANGE_ESTIMATES if col in table.columns]
+    return flag_table(table, [('Quality', 'Coefficient of Variation', value_cols, n_records)], suppress, parents)
+
+def income_group_table(pivot_df, group_names, group_records, hierarchy_data, suppress=False):
+    """Income group pivot with a Quality column after each group's CV (group_records: records per group, then total)
+
+    Complementary suppression follows the hierarchy down each group and the Total across each row."""
+    records = group_records or [None] * (len(group_names) + 1)
+    specs = [(f'{name} Quality', f'{name} CV (%)', [f'{name} Avg ($)', f'{name} CV (%)'], n)
+             for name, n in zip(list(group_names) + ['Total'], records)]
+    parents = parent_positions(pivot_df['Spending Code'].tolist(), hierarchy_data)
+    return flag_table(pivot_df, specs, suppress, parents, total=len(group_names))
+
+def crosstab_parents(crosstab_df):
+    """Row margin and column margin positions of each crosstab cell (-1 for a margin's own), for flag_table"""
+    position = {cell: i for i, cell in enumerate(zip(crosstab_df['Row'], crosstab_df['Column']))}
+    rows, cols = crosstab_df['Row'].tolist(), crosstab_df['Column'].tolist()
+    return [
+        np.array([position[(row, "All")] if col != "All" else -1 for row, col in zip(rows, cols)], dtype=np.intp),
+        np.array([position[("All", col)] if row != "All" else -1 for row, col in zip(rows, cols)], dtype=np.intp)
+    ]
+
+def show_flag_legend(suppress):
+    st.caption("**Quality:** " + " · ".join(f"{flag} {meaning}" if flag else meaning
+                                            for flag, meaning in flag_legend(suppress)))
+
+@st.cache_resource
+def get_job_manager():
+    """Process-wide job queue shared by all sessions (caps concurrent heavy jobs per host)"""
+    return JobManager(
+        max_workers=int(os.environ.get('SHS_JOB_WORKERS', 4)),
+        max_heavy_jobs=int(os.environ.get('SHS_MAX_HEAVY_JOBS', 2))
+    )
+
+def get_available_spending_vars(df):
+    """Spending codes in the TC001 balance set that exist in the data (in any form)"""
+    available_spending_vars = [
+        var for var in ITEMS_FOR_TC001_BALANCE
+        if variable_exists(df, var)
+    ]
+    # Exclude parent totals to avoid double-counting (should be empty set, but keeping for safety)
+    return [var for var in available_spending_vars if var not in PARENT_TOTALS_TO_EXCLUDE]
+
+def get_hierarchy_ordered_vars(available_spending_vars, hierarchy_data):
+    """Order variables by hierarchy level, keeping file order within a level"""
+    if not hierarchy_data:
+        # Fallback: use the order from ITEMS_FOR_TC001_BALANCE
+        return [var for var in ITEMS_FOR_TC001_BALANCE if var in available_spending_vars]
+    ordered_vars = []
+    level_vars = hierarchy_data.get('level_vars', {})
+    for level in sorted(level_vars.keys()):
+        for var_code in level_vars[level]:
+            if var_code in available_spending_vars:
+                ordered_vars.append(var_code)
+    return ordered_vars
+
+def get_level_indent(var, hierarchy_data):
+    """Hierarchy level of a variable and its display indentation"""
+    level = 0
+    if hierarchy_data:
+        node = hierarchy_data.get('var_to_node', {}).get(var, {})
+        level = int(node.get('level', 0)) if node.get('level') is not None else 0
+    # Level 0 and 1 = no indent, Level 2+ = 2 spaces
+    return level, ("  " if level >= 2 else "")
+
+def run_income_range_calculation(job, engine, filters, income_range, hierarchy_data):
+    """Income range mode: Phase 1 spending estimates, Phase 2 Level 2 totals, income and consumption"""
+    df = engine.df
+    stages = StageLog(job.id, kind=job.kind)
+    with stages.stage('filter', rows=len(df)):
+        mask = engine.index.domain_mask(filters, income_range)
+    n_domain = int(mask.sum())
+
+    # Phase 1: Calculate individual spending estimates (70% of progress)
+    job.report(0.0, "Phase 1 of 2: Calculating individual spending estimates...")
+    available_spending_vars = get_available_spending_vars(df)
+    if len(available_spending_vars) == 0:
+        raise ValueError("No spending variables found in the dataset.")
+
+    # Pre-build category lookup dictionary for faster lookups
+    var_to_category = {}
+    for cat, vars_list in SPENDING_CATEGORIES.items():
+        for var in vars_list:
+            var_to_category[var] = cat
+
+    with stages.stage('phase1', rows=n_domain):
+        estimates = engine.estimate(available_spending_vars, mask, participation=True)
+        results = []
+        for i, var in enumerate(available_spending_vars):
+            results.append({
+                'Spending Code': var,
+                'Spending Description': SPENDING_DESCRIPTIONS.get(var, "Spending description not available"),
+                'Spending Category': var_to_category.get(var, "Other"),
+                'Mean Dollars Per Year': estimates['mean'][i],
+                'Variance': estimates['variance'][i],
+                'Standard Error': estimates['std_error'][i],
+                'Coefficient of Variation': estimates['cv'][i],
+                'Participation Rate (%)': estimates['participation'][i] * 100,
+                'Participation SE (%)': estimates['participation_se'][i] * 100,
+                'Mean per Reporting Household': estimates['reporter_mean'][i],
+                'Reporting Mean SE': estimates['reporter_mean_se'][i]
+            })
+
+    # Phase 2: Calculate Level 2 category totals (30% of progress)
+    job.report(0.7, "Phase 2 of 2: Calculating Level 2 category totals...")
+    with stages.stage('phase2', rows=n_domain):
+        level2_totals = []
+        if hierarchy_data:
+            var_to_node = hierarchy_data.get('var_to_node', {})
+            level2_vars = hierarchy_data.get('level_vars', {}).get('2', [])
+
+            def get_all_descendants(var_code):
+                """Recursively get all descendant variable codes"""
+                descendants = []
+                for child in var_to_node.get(var_code, {}).get('children', []):
+                    if child in available_spending_vars and variable_exists(df, child):
+                        descendants.append(child)
+                        descendants.extend(get_all_descendants(child))
+                return descendants
+
+            # One value column per Level 2 variable: the sum of its descendants if it has any,
+            # otherwise the variable itself (handles _C and _D)
+            level2_codes = []
+            level2_columns = []
+            for level2_var in level2_vars:
+                if not variable_exists(df, level2_var):
+                    continue
+                descendants = get_all_descendants(level2_var)
+                if len(descendants) > 0:
+                    level2_columns.append(np.nansum(engine.values(descendants), axis=1))
+                elif level2_var in available_spending_vars:
+                    level2_columns.append(engine.values([level2_var])[:, 0])
+                else:
+                    continue
+                level2_codes.append(level2_var)
+
+            if level2_codes:
+                level2_estimates = engine.estimate_domain(np.column_stack(level2_columns), mask)
+                for i, level2_var in enumerate(level2_codes):
+                    node = var_to_node.get(level2_var, {})
+                    level2_totals.append({
+                        'Spending Code': level2_var,
+                        'Spending Description': SPENDING_DESCRIPTIONS.get(level2_var, node.get('description', level2_var)),
+                        'Mean Dollars Per Year': level2_estimates['mean'][i],
+                        'Variance': level2_estimates['variance'][i],
+                        'Standard Error': level2_estimates['std_error'][i],
+                        'Coefficient of Variation': level2_estimates['cv'][i]
+                    })
+
+    # Average household income and current consumption (TC001 handles _C and _D versions)
+    job.report(0.9, "Calculating average household income and current consumption...")
+    with stages.stage('averages', rows=n_domain):
+        averages = engine.estimate(['HH_TotInc', 'TC001'], mask)
+
+    return {
+        'results': pd.DataFrame(results),
+        'level2_totals': pd.DataFrame(level2_totals) if level2_totals else None,
+        'avg_household_income': averages['mean'][0],
+        'avg_income_se': averages['std_error'][0],
+        'avg_current_consumption': averages['mean'][1],
+        'avg_consumption_se': averages['std_error'][1],
+        'domain_records': n_domain,
+        'calculation_stages': stages.stages
+    }
+
+def income_grouping(n_groups, banded=False, equivalised=False):
+    """Title and short column names of a set of income groups (Q1-Q5, D1-D10, B1... for dollar bands)"""
+    if banded:
+        title, prefix = "Income Band", 'B'
+    else:
+        title, prefix = {5: ("Income Quintile", 'Q'), 10: ("Income Decile", 'D')}.get(n_groups, ("Income Group", 'G'))
+    if equivalised:
+        title = f"Equivalised {title}"
+    return title, [f"{prefix}{g}" for g in range(1, n_groups + 1)]
+
+def income_group_ranges(boundaries):
+    """Income range of each group, given the upper boundaries of all groups but the last"""
+    ranges = [f"≤ ${boundaries[0]:,.0f}"]
+    ranges += [f"${low:,.0f} - ${high:,.0f}" for low, high in zip(boundaries[:-1], boundaries[1:])]
+    ranges.append(f"> ${boundaries[-1]:,.0f}")
+    return ranges
+
+def income_group_boundary_rows(group_boundaries, group_title):
+    """("Quintile 1 (Lowest)", income range) and so on for each group"""
+    word = group_title.split()[-1]
+    ranges = income_group_ranges(group_boundaries)
+    rows = []
+    for g, income_range_text in enumerate(ranges):
+        suffix = " (Lowest)" if g == 0 else " (Highest)" if g == len(ranges) - 1 else ""
+        rows.append((f"{word} {g + 1}{suffix}", income_range_text))
+    return rows
+
+def parse_income_bands(text):
+    """Band limits from text such as "25,000, 50000, $75k" (raises ValueError).
+
+    Commas between digit groups ("25,000") are thousands separators; other commas,
+    semicolons and spaces separate limits. Limits must be positive and strictly increasing."""
+    text = re.sub(r'(?<=\d),(?=\d{3}(?!\d))', '', text)
+    limits = []
+    for part in re.split(r'[,;\s]+', text.strip()):
+        part = part.replace('$', '').lower()
+        if not part:
+            continue
+        multiplier = 1000 if part.endswith('k') else 1
+        try:
+            limits.append(float(part.rstrip('k')) * multiplier)
+        except ValueError:
+            raise ValueError(f"'{part}' is not a dollar amount") from None
+    if not limits:
+        raise ValueError("Enter at least one band limit.")
+    if min(limits) <= 0:
+        raise ValueError("Band limits must be positive.")
+    if any(high <= low for low, high in zip(limits[:-1], limits[1:])):
+        raise ValueError("Band limits must be strictly increasing.")
+    return limits
+
+def run_income_group_calculation(job, engine, filters, hierarchy_data, n_groups=5, boundaries=None,
+                                 equivalence_elasticity=None):
+    """Income group mode: estimates per weighted income quantile (or dollar band) of the filtered sample
+    plus a Total column.
+
+    With equivalence_elasticity, households are grouped by income / household size ** elasticity."""
+    df = engine.df
+    if 'HH_TotInc' not in df.columns:
+        raise ValueError("Household total income (HH_TotInc) not found in the dataset.")
+
+    # For income groups, ignore income range filter (use all filtered data)
+    job.report(0.0, "Assigning income groups...")
+    stages = StageLog(job.id, kind=job.kind)
+    with stages.stage('filter', rows=len(df)):
+        mask = engine.index.domain_mask(filters, None)
+    with stages.stage('income_group_assignment', rows=int(mask.sum())):
+        income = None if equivalence_elasticity is None else engine.equivalised_income(equivalence_elasticity)
+        group_boundaries, group_labels = engine.income_group_labels(mask, n_groups, boundaries, income)
+    if group_boundaries is None:
+        raise ValueError("No valid income data found in the filtered sample.")
+    title, names = income_grouping(len(group_boundaries) + 1, banded=boundaries is not None,
+                                   equivalised=equivalence_elasticity is not None)
+
+    available_spending_vars = [
+        var for var in ITEMS_FOR_TC001_BALANCE
+        if variable_exists(df, var)
+    ]
+    if not available_spending_vars:
+        return None
+
+    job.report(0.1, f"Calculating estimates for each {title.lower()}...")
+    n_grouped = int((group_labels >= 0).sum())
+    with stages.stage('income_group_estimation', rows=n_grouped):
+        estimates = engine.estimate_groups(available_spending_vars, group_labels, len(names))
+    group_results = []
+    for i, var in enumerate(available_spending_vars):
+        for g, name in enumerate(names):
+            if estimates['n_records'][g] == 0:
+                continue
+            group_results.append({
+                'Spending Code': var,
+                'Spending Description': SPENDING_DESCRIPTIONS.get(var, var),
+                title: name,
+                'Average ($)': round(estimates['mean'][g, i], 2),
+                'Coefficient of Variation (%)': round(estimates['cv'][g, i], 2)
+            })
+
+    # Total (all groups combined) for each variable
+    job.report(0.8, "Calculating totals across income groups...")
+    with stages.stage('income_group_totals', rows=n_grouped):
+        totals = engine.estimate(available_spending_vars, group_labels >= 0)
+
+    # Create pivot table: rows = spending categories, columns = income groups + Total
+    # Use same ordering and indentation as regular output
+    pivot_data = []
+    for var in get_hierarchy_ordered_vars(available_spending_vars, hierarchy_data):
+        level, indent = get_level_indent(var, hierarchy_data)
+        i = available_spending_vars.index(var)
+        row = {
+            'Spending Code': var,
+            'Spending Description': f"{indent}{SPENDING_DESCRIPTIONS.get(var, var)}",
+            'Level': level  # Store level for sorting
+        }
+        for g, name in enumerate(names):
+            empty = estimates['n_records'][g] == 0
+            row[f'{name} Avg ($)'] = np.nan if empty else estimates['mean'][g, i]
+            row[f'{name} CV (%)'] = np.nan if empty else estimates['cv'][g, i]
+        row['Total Avg ($)'] = totals['mean'][i]
+        row['Total CV (%)'] = totals['cv'][i]
+        pivot_data.append(row)
+
+    pivot_df = pd.DataFrame(pivot_data)
+    for col in pivot_df.columns:
+        if 'Avg' in col or 'CV' in col:
+            pivot_df[col] = pd.to_numeric(pivot_df[col], errors='coerce').round(2)
+
+    # Intervals and group differences come from the replicate estimates already computed above
+    with stages.stage('income_group_intervals', rows=n_grouped):
+        intervals = confidence_intervals(estimates)
+        total_intervals = confidence_intervals(totals)
+        pairs = [(g, g - 1) for g in range(1, len(names))]
+        if len(names) > 2:
+            pairs.append((len(names) - 1, 0))
+        tests = difference_tests(estimates, pairs)
+    records = list(estimates['n_records']) + [n_grouped]
+    interval_rows = []
+    test_rows = []
+    for var in get_hierarchy_ordered_vars(available_spending_vars, hierarchy_data):
+        _, indent = get_level_indent(var, hierarchy_data)
+        i = available_spending_vars.index(var)
+        description = f"{indent}{SPENDING_DESCRIPTIONS.get(var, var)}"
+        for g, name in enumerate(list(names) + ['Total']):
+            source, bounds, k = (totals, total_intervals, (i,)) if name == 'Total' else (estimates, intervals, (g, i))
+            interval_rows.append({
+                'Spending Code': var,
+                'Spending Description': description,
+                title: name,
+                'Records': int(records[g]),
+                'Average ($)': source['mean'][k],
+                'Standard Error ($)': source['std_error'][k],
+                'Coefficient of Variation (%)': source['cv'][k],
+                'Normal 95% CI Lower ($)': bounds['normal_lower'][k],
+                'Normal 95% CI Upper ($)': bounds['normal_upper'][k],
+                'Bootstrap 95% CI Lower ($)': bounds['percentile_lower'][k],
+                'Bootstrap 95% CI Upper ($)': bounds['percentile_upper'][k]
+            })
+        for p, (g, other) in enumerate(pairs):
+            difference = tests['difference'][p, i]
+            test_rows.append({
+                'Spending Code': var,
+                'Spending Description': description,
+                'Comparison': f"{names[g]} - {names[other]}",
+                'Difference ($)': difference,
+                'Difference SE ($)': tests['difference_se'][p, i],
+                'z': tests['z'][p, i],
+                'Significant': "" if np.isnan(difference) else ("Yes" if tests['significant'][p, i] else "No")
+            })
+    interval_df = pd.DataFrame(interval_rows)
+    test_df = pd.DataFrame(test_rows)
+    for table in (interval_df, test_df):
+        for col in table.columns:
+            if col.endswith(('($)', '(%)')) or col == 'z':
+                table[col] = pd.to_numeric(table[col], errors='coerce').round(2)
+
+    return {
+        'group_results': pd.DataFrame(group_results),
+        'group_pivot_df': pivot_df,
+        'group_boundaries': [float(b) for b in group_boundaries],
+        'group_names': names,
+        'group_title': title,
+        'group_elasticity': equivalence_elasticity,
+        'group_records': [int(n) for n in records],
+        'group_intervals_df': interval_df,
+        'group_tests_df': test_df,
+        'n_vars': len(available_spending_vars),
+        'calculation_stages': stages.stages
+    }
+
+def run_comparison_calculation(job, engine, filters, income_range, column, groups, group_names, hierarchy_data):
+    """Comparison mode: domains given by values of one filter column, estimated in one grouped pass,
+    with each domain's difference and ratio against the first (reference) domain"""
+    df = engine.df
+    stages = StageLog(job.id, kind=job.kind)
+    # The compared column defines the domains, so its own sidebar selection is not applied
+    domain_filters = {col: value for col, value in filters.items() if col != column}
+    with stages.stage('filter', rows=len(df)):
+        mask = engine.index.domain_mask(domain_filters, income_range)
+        labels = engine.index.group_labels(column, groups, mask)
+
+    available_spending_vars = get_hierarchy_ordered_vars(
+        [var for var in ITEMS_FOR_TC001_BALANCE if variable_exists(df, var)], hierarchy_data
+    )
+    if len(available_spending_vars) == 0:
+        raise ValueError("No spending variables found in the dataset.")
+
+    job.report(0.1, f"Calculating estimates for {len(groups)} domains...")
+    with stages.stage('comparison_estimation', rows=int((labels >= 0).sum())):
+        estimates = engine.estimate_groups(available_spending_vars, labels, len(groups))
+        contrasts = compare_groups(estimates, reference=0)
+
+    reference = group_names[0]
+    rows = []
+    for i, var in enumerate(available_spending_vars):
+        level, indent = get_level_indent(var, hierarchy_data)
+        row = {
+            'Spending Code': var,
+            'Spending Description': f"{indent}{SPENDING_DESCRIPTIONS.get(var, var)}"
+        }
+        for g, name in enumerate(group_names):
+            row[f'{name} Avg ($)'] = estimates['mean'][g, i]
+            row[f'{name} SE ($)'] = estimates['std_error'][g, i]
+            row[f'{name} CV (%)'] = estimates['cv'][g, i]
+        for g, name in enumerate(group_names[1:], 1):
+            difference = contrasts['difference'][g, i]
+            row[f'{name} - {reference} ($)'] = difference
+            row[f'{name} - {reference} SE ($)'] = contrasts['difference_se'][g, i]
+            row[f'{name} / {reference}'] = contrasts['ratio'][g, i]
+            row[f'{name} / {reference} SE'] = contrasts['ratio_se'][g, i]
+            row[f'{name} vs {reference} significant'] = (
+                "" if np.isnan(difference) else ("Yes" if contrasts['significant'][g, i] else "No")
+            )
+        rows.append(row)
+
+    comparison_df = pd.DataFrame(rows)
+    ratio_cols = [f'{name} / {reference}{suffix}' for name in group_names[1:] for suffix in ('', ' SE')]
+    for col in comparison_df.columns:
+        if col in ratio_cols:
+            comparison_df[col] = pd.to_numeric(comparison_df[col], errors='coerce').round(4)
+        elif col.endswith(('($)', '(%)')):
+            comparison_df[col] = pd.to_numeric(comparison_df[col], errors='coerce').round(2)
+
+    return {
+        'comparison_df': comparison_df,
+        'comparison_groups': [(name, int(n)) for name, n in zip(group_names, estimates['n_records'])],
+        'calculation_stages': stages.stages
+    }
+
+def run_crosstab_calculation(job, engine, filters, income_range, code, row_col, row_groups, row_names,
+                             col_col, col_groups, col_names):
+    """Crosstab mode: one spending code in every cell of a row x column table, with row and column margins.
+
+    Cells are estimated in one grouped pass over a cell-id vector; the margins take one pass each."""
+    stages = StageLog(job.id, kind=job.kind)
+    with stages.stage('filter', rows=len(engine.df)):
+        mask = engine.index.domain_mask(filters, income_range)
+        cells, rows, cols = engine.index.cross_labels(row_col, row_groups, col_col, col_groups, mask)
+    n_rows, n_cols = len(row_groups), len(col_groups)
+
+    job.report(0.1, f"Calculating estimates for {n_rows * n_cols} cells...")
+    values = engine.values([code])
+    with stages.stage('crosstab_estimation', rows=int((cells >= 0).sum())):
+        cell_estimates = engine.estimate_values(values, cells, n_rows * n_cols)
+        row_estimates = engine.estimate_values(values, rows, n_rows)
+        col_estimates = engine.estimate_values(values, cols, n_cols)
+        total = engine.estimate_domain(values, cells >= 0)
+
+    def table_row(row_name, col_name, estimates, g):
+        return {
+            'Row': row_name,
+            'Column': col_name,
+            'Records': int(estimates['n_records'][g]),
+            'Average ($)': estimates['mean'][g, 0],
+            'Standard Error ($)': estimates['std_error'][g, 0],
+            'Coefficient of Variation (%)': estimates['cv'][g, 0]
+        }
+
+    table = []
+    for r, row_name in enumerate(row_names):
+        for c, col_name in enumerate(col_names):
+            table.append(table_row(row_name, col_name, cell_estimates, r * n_cols + c))
+        table.append(table_row(row_name, "All", row_estimates, r))
+    for c, col_name in enumerate(col_names):
+        table.append(table_row("All", col_name, col_estimates, c))
+    table.append({
+        'Row': "All",
+        'Column': "All",
+        'Records': int(total['n_records']),
+        'Average ($)': total['mean'][0],
+        'Standard Error ($)': total['std_error'][0],
+        'Coefficient of Variation (%)': total['cv'][0]
+    })
+
+    crosstab_df = pd.DataFrame(table)
+    for col in ('Average ($)', 'Standard Error ($)', 'Coefficient of Variation (%)'):
+        crosstab_df[col] = crosstab_df[col].round(2)
+
+    return {
+        'crosstab_df': crosstab_df,
+        'crosstab_layout': {
+            'code': code,
+            'row_col': row_col,
+            'col_col': col_col,
+            'row_names': list(row_names) + ["All"],
+            'col_names': list(col_names) + ["All"]
+        },
+        'calculation_stages': stages.stages
+    }
+
+def run_percentile_calculation(job, engine, filters, income_range, codes, percentiles):
+    """Percentile mode: weighted percentiles (P50 = median) of the chosen codes over the filtered domain,
+    with bootstrap SEs, next to each code's mean"""
+    stages = StageLog(job.id, kind=job.kind)
+    with stages.stage('filter', rows=len(engine.df)):
+        mask = engine.index.domain_mask(filters, income_range)
+
+    job.report(0.1, f"Calculating {len(percentiles)} percentiles for {len(codes)} spending codes...")
+    with stages.stage('percentile_estimation', rows=int(mask.sum())):
+        quantiles = engine.estimate_quantiles(codes, [p / 100 for p in percentiles], mask)
+        means = engine.estimate(codes, mask)
+
+    rows = []
+    for i, code in enumerate(codes):
+        row = {
+            'Spending Code': code,
+            'Spending Description': SPENDING_DESCRIPTIONS.get(code, code),
+            'Records': int(quantiles['n_records'][i]),
+            'Average ($)': means['mean'][i]
+        }
+        for k, p in enumerate(percentiles):
+            row[f'P{p} ($)'] = quantiles['quantile'][i, k]
+            row[f'P{p} SE ($)'] = quantiles['std_error'][i, k]
+            row[f'P{p} CV (%)'] = quantiles['cv'][i, k]
+        rows.append(row)
+
+    percentile_df = pd.DataFrame(rows)
+    for col in percentile_df.columns:
+        if col.endswith(('($)', '(%)')):
+            percentile_df[col] = pd.to_numeric(percentile_df[col], errors='coerce').round(2)
+
+    return {
+        'percentile_df': percentile_df,
+        'percentiles': list(percentiles),
+        'calculation_stages': stages.stages
+    }
+
+def run_per_person_calculation(job, engine, filters, income_range, hierarchy_data):
+    """Per person mode: spending per household, per person and per adult equivalent (square-root scale).
+
+    The per person and per adult equivalent figures are ratio estimators (sum of spending over sum of
+    household size, or of its square root) from the same replicate pass as the household means."""
+    df = engine.df
+    stages = StageLog(job.id, kind=job.kind)
+    with stages.stage('filter', rows=len(df)):
+        mask = engine.index.domain_mask(filters, income_range)
+
+    available_spending_vars = get_hierarchy_ordered_vars(
+        [var for var in ITEMS_FOR_TC001_BALANCE if variable_exists(df, var)], hierarchy_data
+    )
+    if len(available_spending_vars) == 0:
+        raise ValueError("No spending variables found in the dataset.")
+
+    job.report(0.1, "Calculating spending per household, per person and per adult equivalent...")
+    with stages.stage('per_person_estimation', rows=int(mask.sum())):
+        size = engine.household_size()
+        adult_equivalents = engine.adult_equivalents()
+        # Household size and adult equivalents ride along as two more columns for their averages
+        values = np.column_stack([engine.values(available_spending_vars), size, adult_equivalents])
+        estimates = engine.estimate_domain(values, mask, denominators={'per_person': size,
+                                                                       'per_adult_equivalent': adult_equivalents})
+
+    rows = []
+    for i, var in enumerate(available_spending_vars):
+        level, indent = get_level_indent(var, hierarchy_data)
+        rows.append({
+            'Spending Code': var,
+            'Spending Description': f"{indent}{SPENDING_DESCRIPTIONS.get(var, var)}",
+            'Per Household ($)': estimates['mean'][i],
+            'Per Household SE ($)': estimates['std_error'][i],
+            'Per Household CV (%)': estimates['cv'][i],
+            'Per Person ($)': estimates['per_person'][i],
+            'Per Person SE ($)': estimates['per_person_se'][i],
+            'Per Person CV (%)': estimates['per_person_cv'][i],
+            'Per Adult Equivalent ($)': estimates['per_adult_equivalent'][i],
+            'Per Adult Equivalent SE ($)': estimates['per_adult_equivalent_se'][i],
+            'Per Adult Equivalent CV (%)': estimates['per_adult_equivalent_cv'][i]
+        })
+
+    per_person_df = pd.DataFrame(rows)
+    for col in per_person_df.columns:
+        if col.endswith(('($)', '(%)')):
+            per_person_df[col] = pd.to_numeric(per_person_df[col], errors='coerce').round(2)
+
+    n_vars = len(available_spending_vars)
+    return {
+        'per_person_df': per_person_df,
+        'per_person_summary': {
+            'records': int(estimates['n_records']),
+            'household_size': float(estimates['mean'][n_vars]),
+            'household_size_se': float(estimates['std_error'][n_vars]),
+            'adult_equivalents': float(estimates['mean'][n_vars + 1])
+        },
+        'calculation_stages': stages.stages
+    }
+
+def income_sweep_edges(low, high, width):
+    """Band edges from low to high in steps of width; the last band is narrower if width does not divide
+    the range (raises ValueError)"""
+    if width <= 0:
+        raise ValueError("The band width must be positive.")
+    if high <= low:
+        raise ValueError("The upper income must be above the lower income.")
+    # Whole number of bands (rounded first, so float widths cannot add a sliver band)
+    n_bands = int(np.ceil(round((high - low) / width, 9)))
+    edges = low + width * np.arange(n_bands + 1, dtype=np.float64)
+    edges[-1] = high
+    return [float(edge) for edge in edges]
+
+def income_sweep_chart(sweep_df):
+    """Altair chart of average spending (line) and its normal 95% CI (band) against band midpoint, per code"""
+    import altair as alt
+    data = sweep_df.assign(**{
+        'Income ($)': (sweep_df['Income From ($)'] + sweep_df['Income To ($)']) / 2,
+        'Code': sweep_df['Spending Code'] + " - " + sweep_df['Spending Description'].str.strip()
+    }).dropna(subset=['Average ($)'])
+    base = alt.Chart(data).encode(
+        x=alt.X('Income ($):Q', title="Household total income ($)"),
+        color=alt.Color('Code:N', title="Spending code")
+    )
+    band = base.mark_area(opacity=0.2).encode(
+        y=alt.Y('Normal 95% CI Lower ($):Q', title="Average spending ($)"), y2='Normal 95% CI Upper ($):Q'
+    )
+    line = base.mark_line(point=True).encode(
+        y='Average ($):Q',
+        tooltip=['Code', 'Income From ($)', 'Income To ($)', 'Average ($)', 'Standard Error ($)', 'Records']
+    )
+    return band + line
+
+def run_income_sweep_calculation(job, engine, filters, codes, edges):
+    """Income sweep mode: means of the chosen codes in each income band, all bands in one grouped pass.
+
+    Records are assigned to bands with one searchsorted; the sidebar income range is replaced by the bands."""
+    stages = StageLog(job.id, kind=job.kind)
+    n_bands = len(edges) - 1
+    with stages.stage('filter', rows=len(engine.df)):
+        labels = engine.income_band_labels(engine.index.domain_mask(filters), edges)
+
+    job.report(0.1, f"Calculating {len(codes)} spending codes across {n_bands} income bands...")
+    with stages.stage('income_sweep_estimation', rows=int((labels >= 0).sum())):
+        estimates = engine.estimate_groups(codes, labels, n_bands)
+        intervals = confidence_intervals(estimates)
+
+    rows = []
+    for i, code in enumerate(codes):
+        for g in range(n_bands):
+            rows.append({
+                'Spending Code': code,
+                'Spending Description': SPENDING_DESCRIPTIONS.get(code, code),
+                'Income From ($)': edges[g],
+                'Income To ($)': edges[g + 1],
+                'Records': int(estimates['n_records'][g]),
+                'Average ($)': estimates['mean'][g, i],
+                'Standard Error ($)': estimates['std_error'][g, i],
+                'Coefficient of Variation (%)': estimates['cv'][g, i],
+                'Normal 95% CI Lower ($)': intervals['normal_lower'][g, i],
+                'Normal 95% CI Upper ($)': intervals['normal_upper'][g, i],
+                'Bootstrap 95% CI Lower ($)': intervals['percentile_lower'][g, i],
+                'Bootstrap 95% CI Upper ($)': intervals['percentile_upper'][g, i]
+            })
+
+    sweep_df = pd.DataFrame(rows)
+    for col in sweep_df.columns:
+        if col.endswith(('($)', '(%)')):
+            sweep_df[col] = pd.to_numeric(sweep_df[col], errors='coerce').round(2)
+
+    return {
+        'sweep_df': sweep_df,
+        'sweep_edges': [float(edge) for edge in edges],
+        'calculation_stages': stages.stages
+    }
+
+def build_income_range_workbook(filters, income_range, filtered_count, results_df, hierarchy_data,
+                                year=DEFAULT_YEAR, domain_records=None, suppress=False):
+    """Formatted Excel workbook (bytes) with the filter criteria and the hierarchical spending estimates.
+
+    domain_records (the sample size behind the estimates) adds the small-cell flag; suppress blanks F and x rows."""
+    from io import BytesIO
+    from openpyxl import load_workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from openpyxl.utils import get_column_letter
+    
+    output = BytesIO()
+    
+    # Create single sheet with all sections
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        # Create empty dataframe to start
+        all_data = []
+        
+        # TOP SECTION: Source and Filters
+        all_data.append([f"Survey of Household Spending {year} - Spending Estimates"])
+        all_data.append([""])
+        all_data.append(["Source:"])
+        all_data.append([f"Statistics Canada. Survey of Household Spending, {year}. " +
+                        "Public Use Microdata File. Statistics Canada Catalogue no. 62M0004X. " +
+                        "This does not constitute an endorsement by Statistics Canada of this product."])
+        all_data.append([""])
+        all_data.append(["Generated:", pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")])
+        all_data.append([""])
+        all_data.extend(filter_criteria_rows(filters, income_range, filtered_count, year))
+        
+        all_data.append([""])
+        all_data.append([""])
+        
+        all_data.append(["Quality Flags:"])
+        all_data.extend([list(row) for row in flag_legend(suppress)])
+        
+        all_data.append([""])
+        all_data.append([""])
+        
+        # BOTTOM SECTION: Expenditure Categories (hierarchy order when available)
+        table = income_range_table(results_df, hierarchy_data, domain_records, suppress)
+        table = table.drop(columns=['Spending Category'], errors='ignore')
+        numeric_cols = [col for col in INCOME_RANGE_ESTIMATES if col in table.columns]
+        table[numeric_cols] = table[numeric_cols].round(2)
+        all_data.append(["By Expenditure Category"])
+        all_data.append([{'Coefficient of Variation': 'Coefficient of Variation (%)'}.get(col, col)
+                         for col in table.columns])
+        all_data.extend(table.astype(object).where(table.notna(), "").values.tolist())
+        
+        # Convert to DataFrame and write
+        export_df = pd.DataFrame(all_data)
+        export_df.to_excel(writer, sheet_name='Spending Estimates', index=False, header=False)
+    
+    # Format the Excel file
+    output.seek(0)
+    wb = load_workbook(output)
+    ws = wb['Spending Estimates']
+    
+    # Set print area and page setup
+    max_row = ws.max_row
+    max_col = ws.max_column
+    ws.print_area = f'A1:{get_column_letter(max_col)}{max_row}'
+    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 0
+    
+    # Style headers and important rows
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF", size=11)
+    title_font = Font(bold=True, size=12)
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    
+    # Format title row
+    ws['A1'].font = title_font
+    ws.merge_cells(f'A1:{get_column_letter(max_col)}1')
+    
+    # Format section headers
+    for row_idx, row in enumerate(ws.iter_rows(min_row=1, max_row=max_row), 1):
+        cell_value = str(row[0].value) if row[0].value else ""
+        
+        # Format section headers
+        is_header = any(keyword in cell_value for keyword in ["Source:", "Filter Criteria:", "Quality Flags:",
+                                                     "By Expenditure Category", "Spending Category Breakdown", "Individual Spending Code Breakdown", "TOTAL", "Household Total Income Range:"])
+        if is_header:
+            for cell in row:
+                cell.font = Font(bold=True, size=11)
+                cell.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+    
+    # Auto-adjust column widths
+    for col in ws.columns:
+        max_length = 0
+        col_letter = get_column_letter(col[0].column)
+        for cell in col:
+            try:
+                if cell.value:
+                    max_length = max(max_length, len(str(cell.value)))
+            except:
+                pass
+        adjusted_width = min(max_length + 2, 50)
+        ws.column_dimensions[col_letter].width = adjusted_width
+    
+    # Save formatted workbook
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    excel_data = output.read()
+    return excel_data
+
+def build_income_group_workbook(filters, income_range, filtered_count, group_boundaries, pivot_df,
+                                group_title="Income Quintile", equivalence_elasticity=None, year=DEFAULT_YEAR,
+                                suppress=None, intervals_df=None, tests_df=None):
+    """Formatted Excel workbook (bytes) with the filter criteria, income group boundaries and spending by group.
+
+    For a pivot flagged by income_group_table, suppress (True or False) adds the quality flag legend.
+    intervals_df and tests_df (from run_income_group_calculation) are written below the main table."""
+    boundary_rows = [[group_title.split()[-1], "Income Range"]]
+    boundary_rows += [list(row) for row in income_group_boundary_rows(group_boundaries, group_title)]
+    if equivalence_elasticity is not None:
+        boundary_rows.append(["Equivalised income:", f"household income ÷ household size^{equivalence_elasticity:g}"])
+    sections = [(f"{group_title} Boundaries:", boundary_rows)]
+    if suppress is not None:
+        sections.append(("Quality Flags:", [list(row) for row in flag_legend(suppress)]))
+    extra_tables = []
+    if intervals_df is not None:
+        extra_tables.append(("Confidence Intervals (95%)", intervals_df))
+    if tests_df is not None:
+        extra_tables.append((f"Differences Between {group_title}s", tests_df))
+    return build_table_workbook(
+        filters, income_range, filtered_count, f"Spending by {group_title}",
+        pivot_df.drop(columns=['Level'], errors='ignore'),
+        sections=sections, year=year,
+        title=f"Spending Estimates by {group_title}", sheet_name=f"{group_title.split()[-1]} Results",
+        extra_tables=extra_tables
+    )
+
+def filter_criteria_rows(filters, income_range, filtered_count, year=DEFAULT_YEAR):
+    """Workbook rows with each filter's selection and options, the income range and the record count
+
+    The options come from the cached load_filter_options mapping, so no column is scanned per build."""
+    filter_options = load_filter_options(year)
+    rows = [["Filter Criteria:"], ["Variable", "Selected Value", "All Available Options"]]
+    for var, label in FILTER_LABELS.items():
+        options = filter_options.get(FILTER_VARIABLES[var], {}).get('values', [])
+        if not options:
+            continue
+        selected = filters.get(FILTER_VARIABLES[var])
+        if selected is None or (isinstance(selected, list) and len(selected) == 0):
+            selected_display = "All"
+        else:
+            selected = selected if isinstance(selected, list) else [selected]
+            selected_display = "; ".join(f"{format_value(var, val)} ({val})" for val in selected)
+        options_list = [f"{format_value(var, val)} ({val})" for val in options]
+        options_str = "; ".join(options_list[:10])
+        if len(options_list) > 10:
+            options_str += f"; ... ({len(options_list)} total options)"
+        rows.append([label, selected_display, options_str])
+    if income_range is not None:
+        rows.append(["Household Total Income Range:", f"${income_range[0]:,.0f} to ${income_range[1]:,.0f}"])
+    rows.append([""])
+    rows.append(["Number of Records Matching Criteria:", filtered_count])
+    return rows
+
+def build_table_workbook(filters, income_range, filtered_count, table_title, table_df, sections=(),
+                         year=DEFAULT_YEAR, title=None, sheet_name=None, extra_tables=()):
+    """Formatted Excel workbook (bytes) with the filter criteria, extra (heading, rows) sections and one table.
+
+    extra_tables are (title, DataFrame) pairs written below the table. title (for the first row) and
+    sheet_name default to table_title."""
+    from io import BytesIO
+    from openpyxl import load_workbook
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.utils import get_column_letter
+    
+    title = title or table_title
+    sheet_name = (sheet_name or table_title)[:31]
+    all_data = [
+        [f"Survey of Household Spending {year} - {title}"],
+        [""],
+        ["Source:"],
+        [f"Statistics Canada. Survey of Household Spending, {year}. " +
+         "Public Use Microdata File. Statistics Canada Catalogue no. 62M0004X. " +
+         "This does not constitute an endorsement by Statistics Canada of this product."],
+        [""],
+        ["Generated:", pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")],
+        [""]
+    ]
+    all_data.extend(filter_criteria_rows(filters, income_range, filtered_count, year))
+    for heading, rows in sections:
+        all_data.append([""])
+        all_data.append([heading])
+        all_data.extend(rows)
+    all_data.append([""])
+    all_data.append([""])
+    for heading, table in [(table_title, table_df)] + list(extra_tables):
+        if heading != table_title:
+            all_data.append([""])
+        all_data.append([heading])
+        all_data.append(list(table.columns))
+        all_data.extend(table.astype(object).where(table.notna(), "").values.tolist())
+    
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        pd.DataFrame(all_data).to_excel(writer, sheet_name=sheet_name, index=False, header=False)
+    
+    # Same layout and styling as the income range and quintile workbooks
+    output.seek(0)
+    wb = load_workbook(output)
+    ws = wb[sheet_name]
+    max_row = ws.max_row
+    max_col = ws.max_column
+    ws.print_area = f'A1:{get_column_letter(max_col)}{max_row}'
+    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 0
+    ws['A1'].font = Font(bold=True, size=12)
+    ws.merge_cells(f'A1:{get_column_letter(max_col)}1')
+    
+    headings = {"Source:", "Filter Criteria:", "Household Total Income Range:", table_title}
+    headings.update(heading for heading, _ in sections)
+    headings.update(heading for heading, _ in extra_tables)
+    for row in ws.iter_rows(min_row=2, max_row=max_row):
+        if row[0].value in headings:
+            for cell in row:
+                cell.font = Font(bold=True, size=11)
+                cell.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+    
+    for col in ws.columns:
+        max_length = max((len(str(cell.value)) for cell in col if cell.value), default=0)
+        ws.column_dimensions[get_column_letter(col[0].column)].width = min(max_length + 2, 50)
+    
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def get_perf_session():
+    """Short random ID that ties a browser session's performance log lines together"""
+    if 'perf_session' not in st.session_state:
+        st.session_state.perf_session = uuid.uuid4().hex[:12]
+    return st.session_state.perf_session
+
+def stage_table(stages):
+    """Stage records as a display table"""
+    columns = ['stage', 'wall_ms', 'cpu_ms', 'rows', 'rss_delta_mb', 'peak_rss_mb', 'alloc_peak_mb']
+    table = pd.DataFrame(stages)
+    return table[[c for c in columns if c in table.columns]].round(1)
+
+def show_performance_panel(perf):
+    """Optional sidebar expander with the stages of this page run and of the last calculation"""
+    if os.environ.get('SHS_PERF_PANEL', '1') == '0':
+        return
+    with st.sidebar.expander("Performance"):
+        st.caption(f"This page run: {perf.total_ms:,.0f} ms")
+        if perf.stages:
+            st.dataframe(stage_table(perf.stages), use_container_width=True, hide_index=True)
+        calculation_stages = st.session_state.get('calculation_stages')
+        if calculation_stages:
+            total_ms = sum(record['wall_ms'] for record in calculation_stages)
+            st.caption(f"Last calculation: {total_ms:,.0f} ms")
+            st.dataframe(stage_table(calculation_stages), use_container_width=True, hide_index=True)
+
 def main():
-    st.title("💰 Survey of Household Spending 2019 - Spending Estimates Application")
+    perf = StageLog('script', session=get_perf_session())
+    try:
+        run_app(perf)
+    finally:
+        show_performance_panel(perf)
+
+def reset_calculation():
+    """Drop the results (and any running calculation) of the previously selected survey year"""
+    st.session_state.active_job_id = None
+    st.session_state.calculation_mode = None
+
+def run_app(perf):
+    registry = get_dataset_registry()
+    years = registry.years()
+    year = DEFAULT_YEAR if DEFAULT_YEAR in years else years[-1]
+    if len(years) > 1:
+        year = st.sidebar.selectbox("Survey year", years, index=years.index(year), key='survey_year',
+                                    on_change=reset_calculation)
+    
+    st.title(f"💰 Survey of Household Spending {year} - Spending Estimates Application")
     st.markdown("""
     This application allows you to select demographic attributes and get detailed estimates 
     of average household spending (in dollars per year) with bootstrap variance estimates.
     """)
     
     # Load data and hierarchy
-    with st.spinner("Loading data..."):
-        df, meta = load_data()
-        df_bsw, meta_bsw = load_bootstrap_weights()
-        hierarchy_data = load_hierarchy()
+    # The year's dataset opens in the background (bootstrap weights included); until it is
+    # open, the main columns are enough to show the filters and record counts
+    with st.spinner("Loading data..."), perf.stage('load') as record:
+        dataset = registry.get(year)
+        if dataset is not None:
+            df, bootstrap_cols = dataset.df, dataset.bootstrap_cols
+        else:
+            df, meta = load_data(year)
+            bootstrap_cols = []
+        hierarchy_data = load_hierarchy(year)
+        record['rows'] = len(df) if df is not None else 0
     
     if df is None:
         st.error("Failed to load data. Please check that the data files are in the correct location.")
         return
     
-    # Merge bootstrap weights
-    df, bootstrap_cols = get_bootstrap_weights(df, df_bsw)
-    
     st.success(f"Data loaded successfully! {len(df):,} records.")
-    if len(bootstrap_cols) > 0:
+    if dataset is not None:
         st.info(f"Bootstrap weights loaded: {len(bootstrap_cols)} weights available.")
+    else:
+        dataset_job = get_dataset_job(year)
+        if dataset_job.status == 'failed':
+            st.error(f"Error loading bootstrap weights file: {dataset_job.error}")
+            if st.button("Retry loading bootstrap weights"):
+                get_dataset_job(year, retry=True)
+                st.rerun()
+        else:
+            wait_for_bootstrap_weights(dataset_job)
     if hierarchy_data:
         st.info(f"Hierarchy structure loaded: {len(hierarchy_data.get('var_to_node', {}))} variables.")
     
     # Filters at the top of the page
     st.header("📊 Select Attributes")
     
-    # Get unique values for filter variables
+    # Widget options, labels and counts are precomputed once per process
+    filter_options = load_filter_options(year)
     filters = {}
     income_range = None  # Initialize income range
     
@@ -888,68 +1261,67 @@ def main():
     # LEFT COLUMN: Geography, Household Characteristics
     with col1:
         st.subheader("Geography")
-        provinces = get_unique_values(df, 'Prov')
+        provinces = filter_options['Prov']['values']
         if provinces:
             selected_provinces = st.multiselect(
                 "Province",
                 options=provinces,
-                format_func=lambda x: format_option_label('PROV', x),
+                format_func=option_formatter(filter_options, 'Prov'),
                 help="Select one or more provinces. Leave empty to include all."
             )
             if len(selected_provinces) > 0:
                 filters['Prov'] = selected_provinces
         
         st.subheader("Household Characteristics")
-        hh_types = get_unique_values(df, 'HHType6')
+        hh_types = filter_options['HHType6']['values']
         if hh_types:
             selected_hhtype = st.multiselect(
                 "Household type",
                 options=hh_types,
-                format_func=lambda x: format_option_label('HHTYPE6', x),
+                format_func=option_formatter(filter_options, 'HHType6'),
                 help="Select one or more household types. Leave empty to include all."
             )
             if len(selected_hhtype) > 0:
                 filters['HHType6'] = selected_hhtype
         
-        hh_sizes = get_unique_values(df, 'HHSize')
+        hh_sizes = filter_options['HHSize']['values']
         if hh_sizes:
             selected_hhsize = st.multiselect(
                 "Household size",
                 options=hh_sizes,
-                format_func=lambda x: format_option_label('HHSIZE', x),
+                format_func=option_formatter(filter_options, 'HHSize'),
                 help="Select one or more household sizes. Leave empty to include all."
             )
             if len(selected_hhsize) > 0:
                 filters['HHSize'] = selected_hhsize
         
-        dwelling_types = get_unique_values(df, 'DwellTyp')
+        dwelling_types = filter_options['DwellTyp']['values']
         if dwelling_types:
             selected_dwell = st.multiselect(
                 "Type of dwelling",
                 options=dwelling_types,
-                format_func=lambda x: format_option_label('DWELTYP', x),
+                format_func=option_formatter(filter_options, 'DwellTyp'),
                 help="Select one or more dwelling types. Leave empty to include all."
             )
             if len(selected_dwell) > 0:
                 filters['DwellTyp'] = selected_dwell
         
-        tenure = get_unique_values(df, 'Tenure')
+        tenure = filter_options['Tenure']['values']
         if tenure:
             selected_tenure = st.multiselect(
                 "Dwelling tenure",
                 options=tenure,
-                format_func=lambda x: format_option_label('TENURE', x),
+                format_func=option_formatter(filter_options, 'Tenure'),
                 help="Select one or more tenure types. Leave empty to include all."
             )
             if len(selected_tenure) > 0:
                 filters['Tenure'] = selected_tenure
         
         # Household Total Income Range Slider
-        if 'HH_TotInc' in df.columns:
+        if 'income_bounds' in filter_options:
             st.markdown("---")
             st.subheader("Household Total Income Range")
-            income_min = float(df['HH_TotInc'].min())
-            income_max = float(df['HH_TotInc'].max())
+            income_min, income_max = filter_options['income_bounds']
             # Default to full range (no filtering by default)
             income_default_min = income_min
             income_default_max = income_max
@@ -969,57 +1341,57 @@ def main():
     # MIDDLE COLUMN: Reference Person Demographics
     with col2:
         st.subheader("Reference Person Demographics")
-        rp_age = get_unique_values(df, 'RP_AgeGrp')
+        rp_age = filter_options['RP_AgeGrp']['values']
         if rp_age:
             selected_rp_age = st.multiselect(
                 "Reference person - Age group",
                 options=rp_age,
-                format_func=lambda x: format_option_label('RP_AGEGRP', x),
+                format_func=option_formatter(filter_options, 'RP_AgeGrp'),
                 help="Select one or more age groups. Leave empty to include all."
             )
             if len(selected_rp_age) > 0:
                 filters['RP_AgeGrp'] = selected_rp_age
         
-        rp_gender = get_unique_values(df, 'RP_Gender')
+        rp_gender = filter_options['RP_Gender']['values']
         if rp_gender:
             selected_rp_gender = st.multiselect(
                 "Reference person - Gender",
                 options=rp_gender,
-                format_func=lambda x: format_option_label('RP_GENDER', x),
+                format_func=option_formatter(filter_options, 'RP_Gender'),
                 help="Select one or more gender categories. Leave empty to include all."
             )
             if len(selected_rp_gender) > 0:
                 filters['RP_Gender'] = selected_rp_gender
         
-        rp_marstat = get_unique_values(df, 'RP_MarStat')
+        rp_marstat = filter_options['RP_MarStat']['values']
         if rp_marstat:
             selected_rp_marstat = st.multiselect(
                 "Reference person - Marital status",
                 options=rp_marstat,
-                format_func=lambda x: format_option_label('RP_MARSTAT', x),
+                format_func=option_formatter(filter_options, 'RP_MarStat'),
                 help="Select one or more marital statuses. Leave empty to include all."
             )
             if len(selected_rp_marstat) > 0:
                 filters['RP_MarStat'] = selected_rp_marstat
         
-        rp_educ = get_unique_values(df, 'RP_Educ')
+        rp_educ = filter_options['RP_Educ']['values']
         if rp_educ:
             selected_rp_educ = st.multiselect(
                 "Reference person - Education",
                 options=rp_educ,
-                format_func=lambda x: format_option_label('RP_EDUC', x),
+                format_func=option_formatter(filter_options, 'RP_Educ'),
                 help="Select one or more education levels. Leave empty to include all."
             )
             if len(selected_rp_educ) > 0:
                 filters['RP_Educ'] = selected_rp_educ
         
         st.subheader("Income")
-        hh_majinc = get_unique_values(df, 'HH_MajIncSrc')
+        hh_majinc = filter_options['HH_MajIncSrc']['values']
         if hh_majinc:
             selected_inc = st.multiselect(
                 "Household - Major source of income",
                 options=hh_majinc,
-                format_func=lambda x: format_option_label('HH_MAJINCSRC', x),
+                format_func=option_formatter(filter_options, 'HH_MajIncSrc'),
                 help="Select one or more income sources. Leave empty to include all."
             )
             if len(selected_inc) > 0:
@@ -1029,58 +1401,58 @@ def main():
     with col3:
         st.subheader("Spouse Information")
         # Check if SPOUSEYN exists, otherwise infer from SP_AgeGrp (if it has "96" = No spouse)
-        sp_age = get_unique_values(df, 'SP_AgeGrp')
+        sp_age = filter_options['SP_AgeGrp']['values']
         if sp_age:
             selected_sp_age = st.multiselect(
                 "Spouse - Age group",
                 options=sp_age,
-                format_func=lambda x: format_option_label('SP_AGEGRP', x),
+                format_func=option_formatter(filter_options, 'SP_AgeGrp'),
                 help="Select one or more age groups. Leave empty to include all."
             )
             if len(selected_sp_age) > 0:
                 filters['SP_AgeGrp'] = selected_sp_age
         
-        sp_educ = get_unique_values(df, 'SP_Educ')
+        sp_educ = filter_options['SP_Educ']['values']
         if sp_educ:
             selected_sp_educ = st.multiselect(
                 "Spouse - Education",
                 options=sp_educ,
-                format_func=lambda x: format_option_label('SP_EDUC', x),
+                format_func=option_formatter(filter_options, 'SP_Educ'),
                 help="Select one or more education levels. Leave empty to include all."
             )
             if len(selected_sp_educ) > 0:
                 filters['SP_Educ'] = selected_sp_educ
         
         st.subheader("Children in Household")
-        p0to4 = get_unique_values(df, 'P0to4YN')
+        p0to4 = filter_options['P0to4YN']['values']
         if p0to4:
             selected_p0to4 = st.multiselect(
                 "Presence of persons aged 0 to 4 years",
                 options=p0to4,
-                format_func=lambda x: format_option_label('P0TO4YN', x),
+                format_func=option_formatter(filter_options, 'P0to4YN'),
                 help="Select one or more options. Leave empty to include all."
             )
             if len(selected_p0to4) > 0:
                 filters['P0to4YN'] = selected_p0to4
         
-        p5to15 = get_unique_values(df, 'P5to15YN')
+        p5to15 = filter_options['P5to15YN']['values']
         if p5to15:
             selected_p5to15 = st.multiselect(
                 "Presence of persons aged 5 to 15 years",
                 options=p5to15,
-                format_func=lambda x: format_option_label('P5TO15YN', x),
+                format_func=option_formatter(filter_options, 'P5to15YN'),
                 help="Select one or more options. Leave empty to include all."
             )
             if len(selected_p5to15) > 0:
                 filters['P5to15YN'] = selected_p5to15
         
         st.subheader("Vehicles")
-        vehicle_yn = get_unique_values(df, 'VehicleYN')
+        vehicle_yn = filter_options['VehicleYN']['values']
         if vehicle_yn:
             selected_vehicle = st.multiselect(
                 "Owned, leased or operated a vehicle",
                 options=vehicle_yn,
-                format_func=lambda x: format_option_label('VEHICLEYN', x),
+                format_func=option_formatter(filter_options, 'VehicleYN'),
                 help="Select one or more options. Leave empty to include all."
             )
             if len(selected_vehicle) > 0:
@@ -1091,8 +1463,9 @@ def main():
     st.session_state.income_range = income_range
     
     # Calculate and display matching records count in real-time
-    filtered_df = filter_data(df, filters, income_range=st.session_state.income_range)
-    filtered_count = len(filtered_df)
+    with perf.stage('filter', rows=len(df)):
+        index = dataset.engine.index if dataset is not None else get_filter_index(year)
+        filtered_count = int(index.domain_mask(filters, st.session_state.income_range).sum())
     
     # Display matching records count box
     if filtered_count == 0:
@@ -1106,680 +1479,284 @@ def main():
     # Main content area
     st.header("📈 Spending Estimates")
     
-    if len(filtered_df) == 0:
+    if filtered_count == 0:
         return
     
-    # Binary choice: Two buttons side by side
+    # Domains for the comparison mode: two or more values of one filter variable
+    column_variables = {column: var for var, column in FILTER_VARIABLES.items()}
+    comparable_columns = [column for column in column_variables if len(filter_options[column]['values']) > 1]
+    comparison_groups = []
+    with st.expander("Domain comparison settings"):
+        comparison_column = st.selectbox(
+            "Compare by",
+            options=comparable_columns,
+            format_func=lambda column: FILTER_LABELS[column_variables[column]],
+            key='comparison_column'
+        )
+        if comparison_column is not None:
+            comparison_groups = st.multiselect(
+                "Domains to compare (the first one is the reference)",
+                options=filter_options[comparison_column]['values'],
+                format_func=option_formatter(filter_options, comparison_column),
+                key=f'comparison_groups_{comparison_column}'
+            )
+        st.caption("The other attributes and the income range apply to every domain; "
+                   "the selection for the compared attribute itself is replaced by these domains.")
+    
+    # Cross-tabulation: one spending code by two attributes (the sidebar selections limit each to its chosen values)
+    with st.expander("Cross-tabulation settings"):
+        crosstab_rows = st.selectbox(
+            "Rows",
+            options=comparable_columns,
+            index=comparable_columns.index('RP_AgeGrp') if 'RP_AgeGrp' in comparable_columns else 0,
+            format_func=lambda column: FILTER_LABELS[column_variables[column]],
+            key='crosstab_rows'
+        )
+        column_choices = [column for column in comparable_columns if column != crosstab_rows]
+        crosstab_columns = st.selectbox(
+            "Columns",
+            options=column_choices,
+            index=column_choices.index('Tenure') if 'Tenure' in column_choices else 0,
+            format_func=lambda column: FILTER_LABELS[column_variables[column]],
+            key='crosstab_columns'
+        )
+        spending_codes = load_spending_code_options(year)
+        crosstab_code = st.selectbox(
+            "Spending code",
+            options=spending_codes,
+            index=spending_codes.index('TC001') if 'TC001' in spending_codes else 0,
+            format_func=lambda code: f"{code} - {SPENDING_DESCRIPTIONS.get(code, code)}",
+            key='crosstab_code'
+        )
+    
+    # Percentiles: weighted medians and other percentiles of a few spending codes
+    with st.expander("Percentile settings"):
+        percentile_codes = st.multiselect(
+            "Spending codes",
+            options=spending_codes,
+            default=[code for code in ('TC001', 'SH001') if code in spending_codes],
+            format_func=lambda code: f"{code} - {SPENDING_DESCRIPTIONS.get(code, code)}",
+            key='percentile_codes'
+        )
+        percentiles = st.multiselect("Percentiles", options=PERCENTILE_OPTIONS, default=[50, 90],
+                                     format_func=lambda p: f"P{p}" + (" (median)" if p == 50 else ""),
+                                     key='percentile_levels')
+        st.caption("Households with the code missing are left out. Zero spending counts, so the median of a "
+                   "code most households do not buy is $0.")
+    
+    # Income groups: weighted quintiles or deciles of the filtered sample, or dollar bands
+    income_grouping_choice = "Quintiles"
+    band_limits = None
+    equivalence_elasticity = None
+    with st.expander("Income group settings"):
+        income_grouping_choice = st.radio("Income groups", ["Quintiles", "Deciles", "Custom income bands"],
+                                          horizontal=True, key='income_grouping')
+        if income_grouping_choice == "Custom income bands":
+            band_text = st.text_input("Upper limits of the bands ($, in increasing order, separated by commas)",
+                                      value="25000, 50000, 75000, 100000, 150000", key='income_band_limits')
+            try:
+                band_limits = parse_income_bands(band_text)
+                st.caption(" · ".join(income_group_ranges(band_limits)))
+            except ValueError as e:
+                st.error(f"Invalid band limits: {e}")
+        equivalence_elasticity = None
+        if st.checkbox("Rank households by equivalised income", key='equivalise_income',
+                       help="Adjusts income for household size before the groups are formed."):
+            equivalence_elasticity = st.slider(
+                "Equivalence scale: income ÷ household size to the power", min_value=0.0, max_value=1.0,
+                value=0.5, step=0.05, key='equivalence_elasticity',
+                help="0.5 is the square-root scale, 1 is income per person and 0 leaves income unadjusted. "
+                     "Household size is top-coded at 4 in the PUMF."
+            )
+    
+    # Income sweep: spending curve over a grid of dollar income bands
+    sweep_edges = None
+    with st.expander("Income sweep settings"):
+        sweep_codes = st.multiselect(
+            "Spending codes",
+            options=spending_codes,
+            default=[code for code in ('TC001', 'FD001', 'SH001', 'TR001') if code in spending_codes],
+            format_func=lambda code: f"{code} - {SPENDING_DESCRIPTIONS.get(code, code)}",
+            key='sweep_codes'
+        )
+        sweep_col1, sweep_col2, sweep_col3 = st.columns(3)
+        sweep_low = sweep_col1.number_input("From ($)", min_value=0, value=0, step=10000, key='sweep_low')
+        sweep_high = sweep_col2.number_input("To ($)", min_value=0, value=250000, step=10000, key='sweep_high')
+        sweep_width = sweep_col3.number_input("Band width ($)", min_value=1000, value=10000, step=1000,
+                                              key='sweep_width')
+        try:
+            sweep_edges = income_sweep_edges(sweep_low, sweep_high, sweep_width)
+            st.caption(f"{len(sweep_edges) - 1} bands. The bands replace the sidebar income range; "
+                       f"the other selections apply.")
+        except ValueError as e:
+            st.error(f"Invalid income sweep: {e}")
+    
+    # Calculation modes: buttons side by side
     st.markdown("**Select Calculation Mode:**")
-    col1, col2 = st.columns(2)
+    col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
     
     with col1:
-        calculate_income_range = st.button("Calculate by Income Range", type="primary", use_container_width=True)
+        calculate_income_range = st.button("Calculate by Income Range", type="primary", use_container_width=True,
+                                           disabled=dataset is None)
     
     with col2:
-        calculate_quintile = st.button("Calculate by Quintile", type="primary", use_container_width=True)
+        income_group_label = {"Quintiles": "Calculate by Quintile", "Deciles": "Calculate by Decile",
+                              "Custom income bands": "Calculate by Income Band"}[income_grouping_choice]
+        calculate_income_group = st.button(income_group_label, type="primary", use_container_width=True,
+                                           key='calculate_income_group',
+                                           disabled=dataset is None or (income_grouping_choice == "Custom income bands"
+                                                                        and band_limits is None))
+    
+    with col3:
+        calculate_comparison = st.button("Compare Domains", type="primary", use_container_width=True,
+                                         disabled=dataset is None or len(comparison_groups) < 2,
+                                         help="Choose two or more domains under Domain comparison settings.")
+    
+    with col4:
+        calculate_crosstab = st.button("Cross-tabulate", type="primary", use_container_width=True,
+                                       disabled=dataset is None or crosstab_rows is None or crosstab_columns is None
+                                       or crosstab_code is None,
+                                       help="Choose the rows, columns and spending code under Cross-tabulation settings.")
+    
+    with col5:
+        calculate_percentiles = st.button("Percentiles", type="primary", use_container_width=True,
+                                          disabled=dataset is None or not percentile_codes or not percentiles,
+                                          help="Choose the spending codes and percentiles under Percentile settings.")
+    
+    with col6:
+        calculate_per_person = st.button("Per Person", type="primary", use_container_width=True,
+                                         disabled=dataset is None or 'HHSize' not in df.columns,
+                                         help="Spending per household, per person and per adult equivalent.")
+    
+    with col7:
+        calculate_sweep = st.button("Income Sweep", type="primary", use_container_width=True,
+                                    disabled=dataset is None or not sweep_codes or sweep_edges is None,
+                                    help="Choose the spending codes and income bands under Income sweep settings.")
     
     st.markdown("---")
     
-    # Calculate estimates based on which button was clicked
-    if calculate_income_range:
+    # Submit the calculation for the clicked button as a background job
+    job_manager = get_job_manager()
+    if (calculate_income_range or calculate_income_group or calculate_comparison or calculate_crosstab
+            or calculate_percentiles or calculate_per_person or calculate_sweep):
         if len(bootstrap_cols) == 0:
             st.error("No bootstrap weights found in the dataset. Cannot calculate variance estimates.")
             return
-        
-        # Ensure we're using the filtered data with income range
-        filtered_df = filter_data(df, st.session_state.filters, income_range=st.session_state.income_range)
-        
-        st.info(f"Using {len(bootstrap_cols)} bootstrap weights for variance estimation.")
-        
-        # Overall progress tracking
-        overall_progress_bar = st.progress(0)
-        overall_status_text = st.empty()
-        
-        # Phase 1: Calculate individual spending estimates (70% of progress)
-        overall_status_text.text("Phase 1 of 2: Calculating individual spending estimates...")
-        results = []
-        
-        # Get spending variables that exist in the data AND are in the TC001 balance set
-        # Check ITEMS_FOR_TC001_BALANCE directly (not filtered through ALL_SPENDING_VARS)
-        # Handle _C and _D versions: check if base variable or _C/_D versions exist
-        def variable_exists(df, var):
-            """Check if variable exists in any form (base, _C, or _D)"""
-            return (var in df.columns or 
-                   (var + '_C') in df.columns or 
-                   (var + '_D') in df.columns)
-        
-        # Check all items in ITEMS_FOR_TC001_BALANCE directly
-        available_spending_vars = [
-            var for var in ITEMS_FOR_TC001_BALANCE
-            if variable_exists(filtered_df, var)
-        ]
-        
-        # Exclude parent totals to avoid double-counting (should be empty set, but keeping for safety)
-        available_spending_vars = [
-            var for var in available_spending_vars 
-            if var not in PARENT_TOTALS_TO_EXCLUDE
-        ]
-        
-        if len(available_spending_vars) == 0:
-            st.error("No spending variables found in the dataset.")
-            overall_progress_bar.empty()
-            overall_status_text.empty()
-            return
-        
-        # Pre-build category lookup dictionary for faster lookups
-        var_to_category = {}
-        for cat, vars_list in SPENDING_CATEGORIES.items():
-            for var in vars_list:
-                var_to_category[var] = cat
-        
-        # Calculate for each spending variable (optimized with vectorized operations where possible)
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        total_vars = len(available_spending_vars)
-        
-        for idx, var in enumerate(available_spending_vars):
-            status_text.text(f"Processing {var} ({idx + 1}/{total_vars})...")
-            
-            mean_est = calculate_weighted_mean(filtered_df, var)
-            variance = calculate_bootstrap_variance(filtered_df, var, bootstrap_cols=bootstrap_cols)
-            std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
-            
-            # Find category (using pre-built lookup)
-            category = var_to_category.get(var, "Other")
-            
-            # Get spending description
-            spending_desc = SPENDING_DESCRIPTIONS.get(var, "Spending description not available")
-            
-            results.append({
-                'Spending Code': var,
-                'Spending Description': spending_desc,
-                'Spending Category': category,
-                'Mean Dollars Per Year': mean_est,
-                'Variance': variance,
-                'Standard Error': std_error,
-                'Coefficient of Variation': (std_error / mean_est * 100) if not np.isnan(mean_est) and mean_est != 0 else np.nan
-            })
-            
-            # Update both progress bars
-            progress_bar.progress((idx + 1) / total_vars)
-            overall_progress_bar.progress(0.7 * (idx + 1) / total_vars)
-        
-        st.session_state.results = pd.DataFrame(results)
-        st.session_state.hierarchy_data = hierarchy_data  # Store hierarchy for later use
-        progress_bar.empty()
-        status_text.empty()
-        
-        # Phase 2: Calculate Level 2 category totals (30% of progress)
-        overall_status_text.text("Phase 2 of 2: Calculating Level 2 category totals...")
-        level2_totals = []
-        
-        if hierarchy_data:
-            var_to_node = hierarchy_data.get('var_to_node', {})
-            level_vars = hierarchy_data.get('level_vars', {})
-            
-            # Get Level 2 variables (main expenditure categories)
-            level2_vars = level_vars.get('2', [])
-            
-            for level2_var in level2_vars:
-                if not variable_exists(filtered_df, level2_var):
-                    continue
-                
-                # Get all descendants of this Level 2 variable
-                def get_all_descendants(var_code, var_to_node):
-                    """Recursively get all descendant variable codes"""
-                    descendants = []
-                    node = var_to_node.get(var_code, {})
-                    children = node.get('children', [])
-                    for child in children:
-                        if child in available_spending_vars and variable_exists(filtered_df, child):
-                            descendants.append(child)
-                            # Recursively get descendants of children
-                            descendants.extend(get_all_descendants(child, var_to_node))
-                    return descendants
-                
-                descendants = get_all_descendants(level2_var, var_to_node)
-                
-                # If we have descendants, sum them; otherwise use the Level 2 variable itself
-                if len(descendants) > 0:
-                    # Sum all descendants (handling _C and _D versions)
-                    descendant_values = []
-                    for desc_var in descendants:
-                        desc_values = get_variable_value(filtered_df, desc_var)
-                        descendant_values.append(desc_values)
-                    
-                    if descendant_values:
-                        filtered_df['_LEVEL2_SUM'] = pd.concat(descendant_values, axis=1).sum(axis=1)
-                        mean_est = calculate_weighted_mean(filtered_df, '_LEVEL2_SUM')
-                        variance = calculate_bootstrap_variance(filtered_df, '_LEVEL2_SUM', bootstrap_cols=bootstrap_cols)
-                    else:
-                        continue
-                else:
-                    # Use the Level 2 variable directly if it exists in results (handles _C and _D)
-                    if level2_var in available_spending_vars:
-                        mean_est = calculate_weighted_mean(filtered_df, level2_var)
-                        variance = calculate_bootstrap_variance(filtered_df, level2_var, bootstrap_cols=bootstrap_cols)
-                    else:
-                        continue
-                
-                std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
-                
-                node = var_to_node.get(level2_var, {})
-                description = SPENDING_DESCRIPTIONS.get(level2_var, node.get('description', level2_var))
-                
-                level2_totals.append({
-                    'Spending Code': level2_var,
-                    'Spending Description': description,
-                    'Mean Dollars Per Year': mean_est,
-                    'Variance': variance,
-                    'Standard Error': std_error,
-                    'Coefficient of Variation': (std_error / mean_est * 100) if not np.isnan(mean_est) and mean_est != 0 else np.nan
-                })
-        
-        st.session_state.level2_totals = pd.DataFrame(level2_totals) if level2_totals else None
-        overall_progress_bar.progress(1.0)
-        
-        # Calculate average household income and current consumption
-        avg_household_income = calculate_weighted_mean(filtered_df, 'HH_TotInc')
-        avg_income_variance = calculate_bootstrap_variance(filtered_df, 'HH_TotInc', bootstrap_cols=bootstrap_cols)
-        avg_income_se = np.sqrt(avg_income_variance) if not np.isnan(avg_income_variance) else np.nan
-        
-        # Calculate TC001 (Total Current Consumption) - handles _C and _D versions
-        tc001_values = get_variable_value(filtered_df, 'TC001')
-        if tc001_values.notna().any():
-            avg_current_consumption = calculate_weighted_mean(filtered_df, 'TC001')
-            avg_consumption_variance = calculate_bootstrap_variance(filtered_df, 'TC001', bootstrap_cols=bootstrap_cols)
-            avg_consumption_se = np.sqrt(avg_consumption_variance) if not np.isnan(avg_consumption_variance) else np.nan
+        engine = dataset.engine
+        filters_now = dict(st.session_state.filters)
+        if calculate_income_range:
+            kind, calculation = 'income_range', run_income_range_calculation
+            args = (engine, filters_now, st.session_state.income_range, hierarchy_data)
+        elif calculate_income_group:
+            kind, calculation = 'income_group', run_income_group_calculation
+            n_groups = 10 if income_grouping_choice == "Deciles" else 5
+            args = (engine, filters_now, hierarchy_data, n_groups, band_limits, equivalence_elasticity)
+        elif calculate_comparison:
+            kind, calculation = 'comparison', run_comparison_calculation
+            group_names = [format_value(column_variables[comparison_column], value) for value in comparison_groups]
+            args = (engine, filters_now, st.session_state.income_range, comparison_column,
+                    list(comparison_groups), group_names, hierarchy_data)
+        elif calculate_per_person:
+            kind, calculation = 'per_person', run_per_person_calculation
+            args = (engine, filters_now, st.session_state.income_range, hierarchy_data)
+        elif calculate_sweep:
+            kind, calculation = 'income_sweep', run_income_sweep_calculation
+            args = (engine, filters_now, list(sweep_codes), sweep_edges)
+        elif calculate_percentiles:
+            kind, calculation = 'percentile', run_percentile_calculation
+            args = (engine, filters_now, st.session_state.income_range, list(percentile_codes), sorted(percentiles))
         else:
-            avg_current_consumption = np.nan
-            avg_consumption_se = np.nan
-        
-        st.session_state.avg_household_income = avg_household_income
-        st.session_state.avg_income_se = avg_income_se
-        st.session_state.avg_current_consumption = avg_current_consumption
-        st.session_state.avg_consumption_se = avg_consumption_se
+            kind, calculation = 'crosstab', run_crosstab_calculation
+            dimensions = []
+            for column in (crosstab_rows, crosstab_columns):
+                groups = filters_now.get(column) or filter_options[column]['values']
+                dimensions += [column, list(groups), [format_value(column_variables[column], value) for value in groups]]
+            args = (engine, filters_now, st.session_state.income_range, crosstab_code, *dimensions)
+        if profiling_enabled(st.query_params):
+            # Opt-in: wrap this one calculation in cProfile and the stack sampler
+            path_stem = profile_path(kind, st.session_state.filters,
+                                     st.session_state.income_range if kind not in ('income_group', 'income_sweep')
+                                     else None)
+            calculation = profiled(calculation, path_stem)
+            st.toast(f"Profiling this calculation to {path_stem}.prof and {path_stem}.collapsed")
+        st.session_state.active_job_id = job_manager.submit(kind, calculation, *args)
+    
+    # Poll the active job: show progress while it runs, pick up its result when it finishes.
+    # The job keeps running if the user changes a widget in the meantime.
+    active_job = job_manager.get(st.session_state.get('active_job_id'))
+    if active_job is not None:
+        if not active_job.finished:
+            st.info(f"Using {len(bootstrap_cols)} bootstrap weights for variance estimation.")
+            st.progress(active_job.progress)
+            st.text(active_job.message or "Waiting for a free calculation worker...")
+            if st.button("Cancel calculation"):
+                job_manager.cancel(active_job.id)
+            time.sleep(0.5)
+            st.rerun()
         
-        overall_progress_bar.progress(1.0)
-        overall_progress_bar.empty()
-        overall_status_text.empty()
-        st.success("Calculations complete!")
-        # Store calculation mode in session state
-        st.session_state['calculation_mode'] = "income_range"
-    
-    if calculate_quintile:
-        if len(bootstrap_cols) == 0:
-            st.error("No bootstrap weights found in the dataset. Cannot calculate variance estimates.")
-        else:
-            # For quintile calculation, ignore income range filter (use all filtered data)
-            # Income quintiles will be calculated from the filtered sample
-            filtered_df = filter_data(df, st.session_state.filters, income_range=None)
-            
-            # Store calculation mode in session state
-            st.session_state['calculation_mode'] = "quintile"
-            
-            if 'HH_TotInc' not in filtered_df.columns:
-                st.error("Household total income (HH_TotInc) not found in the dataset.")
+        st.session_state.active_job_id = None
+        if active_job.status == 'failed':
+            st.error(active_job.error)
+        elif active_job.status == 'cancelled':
+            st.warning("Calculation cancelled.")
+        elif active_job.kind == 'income_range':
+            for key, value in active_job.result.items():
+                st.session_state[key] = value
+            st.session_state.hierarchy_data = hierarchy_data  # Store hierarchy for later use
+            st.session_state['calculation_mode'] = "income_range"
+            st.success("Calculations complete!")
+        elif active_job.kind == 'income_group':
+            st.session_state['calculation_mode'] = "income_group"
+            if active_job.result is None:
+                st.warning("No results calculated. Please check your data filters.")
             else:
-                # Remove any income range filter for quintile calculation (use full filtered sample)
-                quintile_df = filtered_df.copy()
-                
-                # Calculate income quintiles based on weighted percentiles
-                # Use weighted quantiles to determine quintile boundaries
-                income_col = 'HH_TotInc'
-                weight_col = 'WeightD'
-                
-                # Filter out missing income values
-                valid_income = quintile_df[income_col].notna() & (quintile_df[weight_col] > 0)
-                quintile_df = quintile_df[valid_income].copy()
-                
-                if len(quintile_df) == 0:
-                    st.error("No valid income data found in the filtered sample.")
-                else:
-                    # Calculate weighted percentiles for quintile boundaries
-                    # Sort by income
-                    sorted_df = quintile_df.sort_values(income_col).copy()
-                    sorted_df['cumsum_weight'] = sorted_df[weight_col].cumsum()
-                    total_weight = sorted_df[weight_col].sum()
-                    
-                    # Find quintile boundaries (20th, 40th, 60th, 80th percentiles)
-                    quintile_boundaries = []
-                    for percentile in [20, 40, 60, 80]:
-                        target_weight = total_weight * (percentile / 100)
-                        # Find the index where cumulative weight reaches or exceeds target
-                        mask = sorted_df['cumsum_weight'] >= target_weight
-                        if mask.any():
-                            boundary_idx = mask.idxmax()
-                            boundary_value = sorted_df.loc[boundary_idx, income_col]
-                            quintile_boundaries.append(boundary_value)
-                        else:
-                            # If target weight is beyond all data, use max income
-                            quintile_boundaries.append(sorted_df[income_col].max())
-                    
-                    # Assign quintiles
-                    def assign_quintile(income):
-                        if pd.isna(income):
-                            return None
-                        if income <= quintile_boundaries[0]:
-                            return 1
-                        elif income <= quintile_boundaries[1]:
-                            return 2
-                        elif income <= quintile_boundaries[2]:
-                            return 3
-                        elif income <= quintile_boundaries[3]:
-                            return 4
-                        else:
-                            return 5
-                    
-                    quintile_df['Income_Quintile'] = quintile_df[income_col].apply(assign_quintile)
-                    
-                    # Get available spending variables
-                    def variable_exists(df, var):
-                        """Check if variable exists in any form (base, _C, or _D)"""
-                        return (var in df.columns or 
-                               (var + '_C') in df.columns or 
-                               (var + '_D') in df.columns)
-                    
-                    available_spending_vars = [
-                        var for var in ITEMS_FOR_TC001_BALANCE
-                        if variable_exists(quintile_df, var)
-                    ]
-                    
-                    # Calculate statistics for each quintile and each spending category
-                    quintile_results = []
-                    
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    total_calculations = len(available_spending_vars) * 5
-                    current_calc = 0
-                    
-                    for var in available_spending_vars:
-                        var_desc = SPENDING_DESCRIPTIONS.get(var, var)
-                        
-                        for quintile in range(1, 6):
-                            current_calc += 1
-                            status_text.text(f"Processing {var} - Quintile {quintile} ({current_calc}/{total_calculations})...")
-                            progress_bar.progress(current_calc / total_calculations)
-                            
-                            # Filter to this quintile
-                            quintile_data = quintile_df[quintile_df['Income_Quintile'] == quintile]
-                            
-                            if len(quintile_data) == 0:
-                                continue
-                            
-                            # Calculate weighted mean
-                            mean_est = calculate_weighted_mean(quintile_data, var)
-                            
-                            # Calculate bootstrap variance
-                            variance = calculate_bootstrap_variance(quintile_data, var, bootstrap_cols=bootstrap_cols)
-                            std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
-                            
-                            # Calculate CV (Coefficient of Variation)
-                            cv = (std_error / mean_est * 100) if not np.isnan(mean_est) and mean_est != 0 else np.nan
-                            
-                            quintile_results.append({
-                                'Spending Code': var,
-                                'Spending Description': var_desc,
-                                'Income Quintile': quintile,
-                                'Average ($)': mean_est,
-                                'Coefficient of Variation (%)': cv
-                            })
-                    
-                    progress_bar.empty()
-                    status_text.empty()
-                    
-                    if quintile_results:
-                        quintile_df_results = pd.DataFrame(quintile_results)
-                        
-                        # Round numeric columns
-                        quintile_df_results['Average ($)'] = quintile_df_results['Average ($)'].round(2)
-                        quintile_df_results['Coefficient of Variation (%)'] = quintile_df_results['Coefficient of Variation (%)'].round(2)
-                        
-                        # Store in session state
-                        st.session_state.quintile_results = quintile_df_results
-                        
-                        # Calculate Total (all quintiles combined) for each variable
-                        total_results = []
-                        for var in available_spending_vars:
-                            # Calculate weighted mean for all quintiles combined
-                            total_mean = calculate_weighted_mean(quintile_df, var)
-                            total_variance = calculate_bootstrap_variance(quintile_df, var, bootstrap_cols=bootstrap_cols)
-                            total_std_error = np.sqrt(total_variance) if not np.isnan(total_variance) else np.nan
-                            total_cv = (total_std_error / total_mean * 100) if not np.isnan(total_mean) and total_mean != 0 else np.nan
-                            
-                            total_results.append({
-                                'var': var,
-                                'total_avg': total_mean,
-                                'total_cv': total_cv
-                            })
-                        
-                        total_dict = {r['var']: {'avg': r['total_avg'], 'cv': r['total_cv']} for r in total_results}
-                        
-                        # Order variables using the same hierarchy ordering as regular output
-                        ordered_vars = []
-                        if hierarchy_data:
-                            var_to_node = hierarchy_data.get('var_to_node', {})
-                            level_vars = hierarchy_data.get('level_vars', {})
-                            
-                            # Get variables in hierarchy order (by level, maintaining file order)
-                            for level in sorted(level_vars.keys()):
-                                vars_at_level = level_vars[level]
-                                for var_code in vars_at_level:
-                                    if var_code in available_spending_vars:
-                                        ordered_vars.append(var_code)
-                        else:
-                            # Fallback: use the order from ITEMS_FOR_TC001_BALANCE
-                            ordered_vars = [var for var in ITEMS_FOR_TC001_BALANCE if var in available_spending_vars]
-                        
-                        # Create pivot table: rows = spending categories, columns = quintiles + Total
-                        # Use same ordering and indentation as regular output
-                        pivot_data = []
-                        for var in ordered_vars:
-                            # Get level for indentation
-                            level = 0
-                            if hierarchy_data:
-                                var_to_node = hierarchy_data.get('var_to_node', {})
-                                node = var_to_node.get(var, {})
-                                level = int(node.get('level', 0)) if node.get('level') is not None else 0
-                            
-                            # Apply indentation: Level 0 and 1 = no indent, Level 2+ = 2 spaces
-                            # This matches the regular output format
-                            if level >= 2:
-                                indent = "  "  # 2 spaces for Level 2
-                            else:
-                                indent = ""  # No indent for Level 0 and 1
-                            var_desc = SPENDING_DESCRIPTIONS.get(var, var)
-                            
-                            row = {
-                                'Spending Code': var, 
-                                'Spending Description': f"{indent}{var_desc}",
-                                'Level': level  # Store level for sorting
-                            }
-                            
-                            # Add quintile columns
-                            for quintile in range(1, 6):
-                                quintile_data = quintile_df_results[
-                                    (quintile_df_results['Spending Code'] == var) & 
-                                    (quintile_df_results['Income Quintile'] == quintile)
-                                ]
-                                
-                                if len(quintile_data) > 0:
-                                    avg = quintile_data.iloc[0]['Average ($)']
-                                    cv = quintile_data.iloc[0]['Coefficient of Variation (%)']
-                                    row[f'Q{quintile} Avg ($)'] = avg
-                                    row[f'Q{quintile} CV (%)'] = cv
-                                else:
-                                    row[f'Q{quintile} Avg ($)'] = np.nan
-                                    row[f'Q{quintile} CV (%)'] = np.nan
-                            
-                            # Add Total column
-                            if var in total_dict:
-                                row['Total Avg ($)'] = total_dict[var]['avg']
-                                row['Total CV (%)'] = total_dict[var]['cv']
-                            else:
-                                row['Total Avg ($)'] = np.nan
-                                row['Total CV (%)'] = np.nan
-                            
-                            pivot_data.append(row)
-                        
-                        pivot_df = pd.DataFrame(pivot_data)
-                        # Round numeric columns
-                        for col in pivot_df.columns:
-                            if 'Avg' in col or 'CV' in col:
-                                pivot_df[col] = pd.to_numeric(pivot_df[col], errors='coerce').round(2)
-                        
-                        st.success(f"Calculated spending estimates for {len(available_spending_vars)} categories across 5 income quintiles.")
-                        
-                        # Store quintile pivot table in session state for display
-                        st.session_state.quintile_pivot_df = pivot_df
-                        st.session_state.quintile_boundaries = quintile_boundaries
-                        
-                        # Note: Results will be displayed in the display section below
-                        # Export quintile results to Excel
-                        st.subheader("📥 Export Quintile Results")
-                        try:
-                            from io import BytesIO
-                            from openpyxl import load_workbook
-                            from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-                            from openpyxl.utils import get_column_letter
-                            
-                            output = BytesIO()
-                            
-                            # Get all available filter variables and their options
-                            all_filter_vars = {
-                                'PROV': get_unique_values(df, 'Prov'),
-                                'HHTYPE6': get_unique_values(df, 'HHType6'),
-                                'HHSIZE': get_unique_values(df, 'HHSize'),
-                                'DWELTYP': get_unique_values(df, 'DwellTyp'),
-                                'TENURE': get_unique_values(df, 'Tenure'),
-                                'RP_AGEGRP': get_unique_values(df, 'RP_AgeGrp'),
-                                'RP_GENDER': get_unique_values(df, 'RP_Gender'),
-                                'RP_MARSTAT': get_unique_values(df, 'RP_MarStat'),
-                                'RP_EDUC': get_unique_values(df, 'RP_Educ'),
-                                'SP_AGEGRP': get_unique_values(df, 'SP_AgeGrp'),
-                                'SP_EDUC': get_unique_values(df, 'SP_Educ'),
-                                'P0TO4YN': get_unique_values(df, 'P0to4YN'),
-                                'P5TO15YN': get_unique_values(df, 'P5to15YN'),
-                                'VEHICLEYN': get_unique_values(df, 'VehicleYN'),
-                                'HH_MAJINCSRC': get_unique_values(df, 'HH_MajIncSrc')
-                            }
-                            
-                            # Create Excel file
-                            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                all_data = []
-                                
-                                # TOP SECTION: Source and Filters
-                                all_data.append(["Survey of Household Spending 2019 - Spending Estimates by Income Quintile"])
-                                all_data.append([""])
-                                all_data.append(["Source:"])
-                                all_data.append(["Statistics Canada. Survey of Household Spending, 2019. " +
-                                                "Public Use Microdata File. Statistics Canada Catalogue no. 62M0004X. " +
-                                                "This does not constitute an endorsement by Statistics Canada of this product."])
-                                all_data.append([""])
-                                all_data.append(["Generated:", pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")])
-                                all_data.append([""])
-                                all_data.append(["Filter Criteria:"])
-                                all_data.append(["Variable", "Selected Value", "All Available Options"])
-                                
-                                # Add filter information
-                                filter_labels = {
-                                    'PROV': 'Province',
-                                    'HHTYPE6': 'Household type',
-                                    'HHSIZE': 'Household size',
-                                    'DWELTYP': 'Type of dwelling',
-                                    'TENURE': 'Dwelling tenure',
-                                    'RP_AGEGRP': 'Reference person - Age group',
-                                    'RP_GENDER': 'Reference person - Gender',
-                                    'RP_MARSTAT': 'Reference person - Marital status',
-                                    'RP_EDUC': 'Reference person - Education',
-                                    'SP_AGEGRP': 'Spouse - Age group',
-                                    'SP_EDUC': 'Spouse - Education',
-                                    'P0TO4YN': 'Presence of persons aged 0 to 4 years',
-                                    'P5TO15YN': 'Presence of persons aged 5 to 15 years',
-                                    'VEHICLEYN': 'Owned, leased or operated a vehicle',
-                                    'HH_MAJINCSRC': 'Household - Major source of income'
-                                }
-                                
-                                var_name_map = {
-                                    'PROV': 'Prov',
-                                    'HHTYPE6': 'HHType6',
-                                    'HHSIZE': 'HHSize',
-                                    'DWELTYP': 'DwellTyp',
-                                    'TENURE': 'Tenure',
-                                    'RP_AGEGRP': 'RP_AgeGrp',
-                                    'RP_GENDER': 'RP_Gender',
-                                    'RP_MARSTAT': 'RP_MarStat',
-                                    'RP_EDUC': 'RP_Educ',
-                                    'SP_AGEGRP': 'SP_AgeGrp',
-                                    'SP_EDUC': 'SP_Educ',
-                                    'P0TO4YN': 'P0to4YN',
-                                    'P5TO15YN': 'P5to15YN',
-                                    'VEHICLEYN': 'VehicleYN',
-                                    'HH_MAJINCSRC': 'HH_MajIncSrc'
-                                }
-                                
-                                for var, label in filter_labels.items():
-                                    if var in all_filter_vars and all_filter_vars[var]:
-                                        actual_var = var_name_map.get(var, var)
-                                        selected_val = st.session_state.filters.get(actual_var, None)
-                                        if selected_val is not None:
-                                            if isinstance(selected_val, list):
-                                                if len(selected_val) > 0:
-                                                    selected_labels = []
-                                                    for val in selected_val:
-                                                        lbl = format_value(var, val)
-                                                        selected_labels.append(f"{lbl} ({val})")
-                                                    selected_display = "; ".join(selected_labels)
-                                                else:
-                                                    selected_display = "All"
-                                            else:
-                                                selected_label = format_value(var, selected_val)
-                                                selected_display = f"{selected_label} ({selected_val})"
-                                        else:
-                                            selected_display = "All"
-                                        
-                                        options_list = []
-                                        for val in sorted(all_filter_vars[var]):
-                                            opt_label = format_value(var, val)
-                                            options_list.append(f"{opt_label} ({val})")
-                                        options_str = "; ".join(options_list[:10])
-                                        if len(options_list) > 10:
-                                            options_str += f"; ... ({len(options_list)} total options)"
-                                        
-                                        all_data.append([label, selected_display, options_str])
-                                
-                                # Add income range filter if applied
-                                if st.session_state.get('income_range') is not None:
-                                    income_range = st.session_state.income_range
-                                    all_data.append(["Household Total Income Range:", f"${income_range[0]:,.0f} to ${income_range[1]:,.0f}"])
-                                
-                                all_data.append([""])
-                                all_data.append(["Number of Records Matching Criteria:", st.session_state.get('filtered_count', 'N/A')])
-                                
-                                # Add quintile boundaries
-                                all_data.append([""])
-                                all_data.append(["Income Quintile Boundaries:"])
-                                all_data.append(["Quintile", "Income Range"])
-                                all_data.append(["Quintile 1 (Lowest)", f"≤ ${quintile_boundaries[0]:,.0f}"])
-                                all_data.append(["Quintile 2", f"${quintile_boundaries[0]:,.0f} - ${quintile_boundaries[1]:,.0f}"])
-                                all_data.append(["Quintile 3", f"${quintile_boundaries[1]:,.0f} - ${quintile_boundaries[2]:,.0f}"])
-                                all_data.append(["Quintile 4", f"${quintile_boundaries[2]:,.0f} - ${quintile_boundaries[3]:,.0f}"])
-                                all_data.append(["Quintile 5 (Highest)", f"> ${quintile_boundaries[3]:,.0f}"])
-                                
-                                all_data.append([""])
-                                all_data.append([""])
-                                
-                                # BOTTOM SECTION: Quintile Results
-                                all_data.append(["Spending by Income Quintile"])
-                                
-                                # Create header row
-                                header_row = ["Spending Code", "Spending Description"]
-                                for q in range(1, 6):
-                                    header_row.append(f"Q{q} Avg ($)")
-                                    header_row.append(f"Q{q} CV (%)")
-                                header_row.append("Total Avg ($)")
-                                header_row.append("Total CV (%)")
-                                all_data.append(header_row)
-                                
-                                # Add data rows (using same ordering as display)
-                                for _, row in pivot_df.iterrows():
-                                    data_row = [
-                                        row['Spending Code'],
-                                        row['Spending Description']  # Already has indentation
-                                    ]
-                                    for q in range(1, 6):
-                                        avg_col = f'Q{q} Avg ($)'
-                                        cv_col = f'Q{q} CV (%)'
-                                        data_row.append(round(row[avg_col], 2) if pd.notna(row[avg_col]) else "")
-                                        data_row.append(round(row[cv_col], 2) if pd.notna(row[cv_col]) else "")
-                                    data_row.append(round(row['Total Avg ($)'], 2) if pd.notna(row['Total Avg ($)']) else "")
-                                    data_row.append(round(row['Total CV (%)'], 2) if pd.notna(row['Total CV (%)']) else "")
-                                    all_data.append(data_row)
-                                
-                                # Convert to DataFrame and write
-                                export_df = pd.DataFrame(all_data)
-                                export_df.to_excel(writer, sheet_name='Quintile Results', index=False, header=False)
-                            
-                            # Format the Excel file
-                            output.seek(0)
-                            wb = load_workbook(output)
-                            ws = wb['Quintile Results']
-                            
-                            # Set print area and page setup
-                            max_row = ws.max_row
-                            max_col = ws.max_column
-                            ws.print_area = f'A1:{get_column_letter(max_col)}{max_row}'
-                            ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-                            ws.page_setup.fitToWidth = 1
-                            ws.page_setup.fitToHeight = 0
-                            
-                            # Style headers
-                            header_font = Font(bold=True, size=11)
-                            title_font = Font(bold=True, size=12)
-                            
-                            # Format title row
-                            ws['A1'].font = title_font
-                            ws.merge_cells(f'A1:{get_column_letter(max_col)}1')
-                            
-                            # Format section headers
-                            for row_idx, row in enumerate(ws.iter_rows(min_row=1, max_row=max_row), 1):
-                                cell_value = str(row[0].value) if row[0].value else ""
-                                
-                                is_header = any(keyword in cell_value for keyword in ["Source:", "Filter Criteria:", "Income Quintile Boundaries:", 
-                                                                                     "Spending by Income Quintile", "Household Total Income Range:"])
-                                if is_header:
-                                    for cell in row:
-                                        cell.font = Font(bold=True, size=11)
-                                        cell.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-                            
-                            # Auto-adjust column widths
-                            for col in ws.columns:
-                                max_length = 0
-                                col_letter = get_column_letter(col[0].column)
-                                for cell in col:
-                                    try:
-                                        if cell.value:
-                                            max_length = max(max_length, len(str(cell.value)))
-                                    except:
-                                        pass
-                                adjusted_width = min(max_length + 2, 50)
-                                ws.column_dimensions[col_letter].width = adjusted_width
-                            
-                            # Save formatted workbook
-                            output = BytesIO()
-                            wb.save(output)
-                            output.seek(0)
-                            excel_data = output.read()
-                            
-                            st.download_button(
-                                label="Download Quintile Results (Excel)",
-                                data=excel_data,
-                                file_name="spending_estimates_by_quintile.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key="excel_quintile",
-                                type="primary",
-                                use_container_width=True
-                            )
-                        except ImportError:
-                            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
-                        except Exception as e:
-                            st.error(f"Error creating Excel file: {e}")
-                            import traceback
-                            st.text(traceback.format_exc())
-                    else:
-                        st.warning("No results calculated. Please check your data filters.")
+                for key in ('group_results', 'group_pivot_df', 'group_boundaries', 'group_names', 'group_title',
+                            'group_elasticity', 'group_records', 'group_intervals_df', 'group_tests_df',
+                            'calculation_stages'):
+                    st.session_state[key] = active_job.result[key]
+                st.success(f"Calculated spending estimates for {active_job.result['n_vars']} categories across "
+                           f"{len(active_job.result['group_names'])} {active_job.result['group_title'].lower()}s.")
+        elif active_job.kind == 'comparison':
+            st.session_state['calculation_mode'] = "comparison"
+            for key in ('comparison_df', 'comparison_groups', 'calculation_stages'):
+                st.session_state[key] = active_job.result[key]
+            st.success(f"Compared {len(active_job.result['comparison_groups'])} domains.")
+        elif active_job.kind == 'crosstab':
+            st.session_state['calculation_mode'] = "crosstab"
+            for key in ('crosstab_df', 'crosstab_layout', 'calculation_stages'):
+                st.session_state[key] = active_job.result[key]
+            st.success(f"Calculated {len(active_job.result['crosstab_df'])} table cells and margins.")
+        elif active_job.kind == 'percentile':
+            st.session_state['calculation_mode'] = "percentile"
+            for key in ('percentile_df', 'percentiles', 'calculation_stages'):
+                st.session_state[key] = active_job.result[key]
+            st.success(f"Calculated percentiles for {len(active_job.result['percentile_df'])} spending codes.")
+        elif active_job.kind == 'per_person':
+            st.session_state['calculation_mode'] = "per_person"
+            for key in ('per_person_df', 'per_person_summary', 'calculation_stages'):
+                st.session_state[key] = active_job.result[key]
+            st.success(f"Calculated per person spending for {len(active_job.result['per_person_df'])} categories.")
+        elif active_job.kind == 'income_sweep':
+            st.session_state['calculation_mode'] = "income_sweep"
+            for key in ('sweep_df', 'sweep_edges', 'calculation_stages'):
+                st.session_state[key] = active_job.result[key]
+            st.success(f"Calculated spending across {len(active_job.result['sweep_edges']) - 1} income bands.")
     
     # Display results based on calculation mode
     calculation_mode_display = st.session_state.get('calculation_mode', None)
+    suppress = False
+    if calculation_mode_display is not None:
+        suppress = st.checkbox(
+            f"Suppress unreliable estimates (quality F) and estimates from fewer than {MIN_RECORDS} records",
+            key='suppress_estimates',
+            help="Suppressed estimates are left blank in the tables and the Excel exports. A sibling (or the total) "
+                 "of a suppressed code is also suppressed, so the code cannot be worked out from the total."
+        )
     
     # Show regular results only if calculation mode is income_range
     if calculation_mode_display == "income_range" and 'results' in st.session_state and st.session_state.results is not None:
-        results_df = st.session_state.results.copy()
-        
-        # Round numeric columns
-        numeric_cols = ['Mean Dollars Per Year', 'Variance', 'Standard Error', 'Coefficient of Variation']
-        for col in numeric_cols:
-            if col in results_df.columns:
-                results_df[col] = results_df[col].round(2)
+        results_df = st.session_state.results
+        domain_records = st.session_state.get('domain_records')
         
         # Add CSS for subtle table shading and column alignment
         st.markdown("""
@@ -1799,7 +1776,9 @@ def main():
         // Right-justify specific column headers and cells
         function alignNumericColumns() {
             const tables = document.querySelectorAll('div[data-testid="stDataFrame"] table');
-            const numericHeaders = ['Mean Dollars Per Year', 'Variance', 'Standard Error', 'Coefficient of Variation'];
+            const numericHeaders = ['Mean Dollars Per Year', 'Variance', 'Standard Error', 'Coefficient of Variation',
+                                    'Participation Rate (%)', 'Participation SE (%)', 'Mean per Reporting Household',
+                                    'Reporting Mean SE'];
             
             tables.forEach(table => {
                 const headers = Array.from(table.querySelectorAll('thead th'));
@@ -1829,257 +1808,24 @@ def main():
         
         # Display by expenditure category
         st.subheader("By Expenditure Category")
-        # Organize results hierarchically
+        # Organize results hierarchically (flags come from the unrounded CVs)
         hierarchy_data_display = st.session_state.get('hierarchy_data', hierarchy_data)
-        hierarchical_results, var_to_node = organize_hierarchical_results(results_df, hierarchy_data_display)
-        if hierarchical_results:
-            display_df = build_hierarchical_display(hierarchical_results, var_to_node)
-            # Reorder columns
-            display_cols = ['Spending Code', 'Spending Description'] + [c for c in display_df.columns if c not in ['Spending Code', 'Spending Description', 'Level']]
-            display_df = display_df[[c for c in display_cols if c in display_df.columns]]
-            st.dataframe(display_df, use_container_width=True, height=400)
-        else:
-            # Fallback to original display if hierarchy not available
-            display_cols = ['Spending Code', 'Spending Description', 'Spending Category'] + [c for c in results_df.columns if c not in ['Spending Code', 'Spending Description', 'Spending Category']]
-            display_df = results_df[[c for c in display_cols if c in results_df.columns]]
-            st.dataframe(display_df, use_container_width=True, height=400)
+        display_df = income_range_table(results_df, hierarchy_data_display, domain_records, suppress)
+        numeric_cols = [col for col in INCOME_RANGE_ESTIMATES if col in display_df.columns]
+        display_df[numeric_cols] = display_df[numeric_cols].round(2)
+        st.dataframe(display_df, use_container_width=True, height=400)
+        show_flag_legend(suppress)
         
         # Export options - Single download button
         st.subheader("📥 Export Results")
         
         try:
-            from io import BytesIO
-            from openpyxl import load_workbook
-            from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-            from openpyxl.utils import get_column_letter
-            
-            output = BytesIO()
-            
-            # Get all available filter variables and their options
-            all_filter_vars = {
-                'PROV': get_unique_values(df, 'Prov'),
-                'HHTYPE6': get_unique_values(df, 'HHType6'),
-                'HHSIZE': get_unique_values(df, 'HHSize'),
-                'DWELTYP': get_unique_values(df, 'DwellTyp'),
-                'TENURE': get_unique_values(df, 'Tenure'),
-                'RP_AGEGRP': get_unique_values(df, 'RP_AgeGrp'),
-                'RP_GENDER': get_unique_values(df, 'RP_Gender'),
-                'RP_MARSTAT': get_unique_values(df, 'RP_MarStat'),
-                'RP_EDUC': get_unique_values(df, 'RP_Educ'),
-                'SP_AGEGRP': get_unique_values(df, 'SP_AgeGrp'),
-                'SP_EDUC': get_unique_values(df, 'SP_Educ'),
-                'P0TO4YN': get_unique_values(df, 'P0to4YN'),
-                'P5TO15YN': get_unique_values(df, 'P5to15YN'),
-                'VEHICLEYN': get_unique_values(df, 'VehicleYN'),
-                'HH_MAJINCSRC': get_unique_values(df, 'HH_MajIncSrc')
-            }
-            
-            # Create single sheet with all sections
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                # Create empty dataframe to start
-                all_data = []
-                
-                # TOP SECTION: Source and Filters
-                all_data.append(["Survey of Household Spending 2019 - Spending Estimates"])
-                all_data.append([""])
-                all_data.append(["Source:"])
-                all_data.append(["Statistics Canada. Survey of Household Spending, 2019. " +
-                                "Public Use Microdata File. Statistics Canada Catalogue no. 62M0004X. " +
-                                "This does not constitute an endorsement by Statistics Canada of this product."])
-                all_data.append([""])
-                all_data.append(["Generated:", pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")])
-                all_data.append([""])
-                all_data.append(["Filter Criteria:"])
-                all_data.append(["Variable", "Selected Value", "All Available Options"])
-                
-                # Add filter information
-                filter_labels = {
-                    'PROV': 'Province',
-                    'HHTYPE6': 'Household type',
-                    'HHSIZE': 'Household size',
-                    'DWELTYP': 'Type of dwelling',
-                    'TENURE': 'Dwelling tenure',
-                    'RP_AGEGRP': 'Reference person - Age group',
-                    'RP_GENDER': 'Reference person - Gender',
-                    'RP_MARSTAT': 'Reference person - Marital status',
-                    'RP_EDUC': 'Reference person - Education',
-                    'SP_AGEGRP': 'Spouse - Age group',
-                    'SP_EDUC': 'Spouse - Education',
-                    'P0TO4YN': 'Presence of persons aged 0 to 4 years',
-                    'P5TO15YN': 'Presence of persons aged 5 to 15 years',
-                    'VEHICLEYN': 'Owned, leased or operated a vehicle',
-                    'HH_MAJINCSRC': 'Household - Major source of income'
-                }
-                
-                # Map from display labels to actual column names
-                var_name_map = {
-                    'PROV': 'Prov',
-                    'HHTYPE6': 'HHType6',
-                    'HHSIZE': 'HHSize',
-                    'DWELTYP': 'DwellTyp',
-                    'TENURE': 'Tenure',
-                    'RP_AGEGRP': 'RP_AgeGrp',
-                    'RP_GENDER': 'RP_Gender',
-                    'RP_MARSTAT': 'RP_MarStat',
-                    'RP_EDUC': 'RP_Educ',
-                    'SP_AGEGRP': 'SP_AgeGrp',
-                    'SP_EDUC': 'SP_Educ',
-                    'P0TO4YN': 'P0to4YN',
-                    'P5TO15YN': 'P5to15YN',
-                    'VEHICLEYN': 'VehicleYN',
-                    'HH_MAJINCSRC': 'HH_MajIncSrc'
-                }
-                
-                for var, label in filter_labels.items():
-                    if var in all_filter_vars and all_filter_vars[var]:
-                        actual_var = var_name_map.get(var, var)
-                        selected_val = st.session_state.filters.get(actual_var, None)
-                        if selected_val is not None:
-                            # Handle both single values and lists
-                            if isinstance(selected_val, list):
-                                if len(selected_val) > 0:
-                                    selected_labels = []
-                                    for val in selected_val:
-                                        lbl = format_value(var, val)
-                                        selected_labels.append(f"{lbl} ({val})")
-                                    selected_display = "; ".join(selected_labels)
-                                else:
-                                    selected_display = "All"
-                            else:
-                                selected_label = format_value(var, selected_val)
-                                selected_display = f"{selected_label} ({selected_val})"
-                        else:
-                            selected_display = "All"
-                        
-                        # Get all available options
-                        options_list = []
-                        for val in sorted(all_filter_vars[var]):
-                            opt_label = format_value(var, val)
-                            options_list.append(f"{opt_label} ({val})")
-                        options_str = "; ".join(options_list[:10])  # Limit to first 10 for display
-                        if len(options_list) > 10:
-                            options_str += f"; ... ({len(options_list)} total options)"
-                        
-                        all_data.append([label, selected_display, options_str])
-                
-                # Add income range filter if applied
-                if st.session_state.get('income_range') is not None:
-                    income_range = st.session_state.income_range
-                    all_data.append(["Household Total Income Range:", f"${income_range[0]:,.0f} to ${income_range[1]:,.0f}"])
-                
-                all_data.append([""])
-                all_data.append(["Number of Records Matching Criteria:", st.session_state.get('filtered_count', 'N/A')])
-                
-                all_data.append([""])
-                all_data.append([""])
-                
-                # BOTTOM SECTION: Expenditure Categories
-                all_data.append(["By Expenditure Category"])
-                all_data.append(["Spending Code", "Spending Description", 
-                               "Mean Dollars Per Year", "Variance", "Standard Error", "Coefficient of Variation (%)"])
-                
-                # Use hierarchical structure if available
-                hierarchy_data_export = st.session_state.get('hierarchy_data', hierarchy_data)
-                hierarchical_results_export, var_to_node_export = organize_hierarchical_results(results_df, hierarchy_data_export)
-                
-                if hierarchical_results_export:
-                    # Build hierarchical display with indentation
-                    for item in hierarchical_results_export:
-                        level = int(item['level']) if item.get('level') is not None else 0
-                        # Apply indentation: Level 0 and 1 = no indent, Level 2+ = 2 spaces
-                        if level >= 2:
-                            indent = "  "  # 2 spaces for Level 2
-                        else:
-                            indent = ""  # No indent for Level 0 and 1
-                        var_code = item['var_code']
-                        description = item['description']
-                        
-                        all_data.append([
-                            var_code,
-                            f"{indent}{description}",
-                            round(item['mean'], 2),
-                            round(item['variance'], 2),
-                            round(item['std_error'], 2),
-                            round(item['cv'], 2) if not pd.isna(item['cv']) else ""
-                        ])
-                else:
-                    # Fallback to original structure
-                    display_cols = ['Spending Code', 'Spending Description', 
-                                  'Mean Dollars Per Year', 'Variance', 'Standard Error', 'Coefficient of Variation']
-                    results_export = results_df[[c for c in display_cols if c in results_df.columns]].copy()
-                    
-                    for _, row in results_export.iterrows():
-                        all_data.append([
-                            row['Spending Code'],
-                            row['Spending Description'],
-                            round(row['Mean Dollars Per Year'], 2),
-                            round(row['Variance'], 2),
-                            round(row['Standard Error'], 2),
-                            round(row['Coefficient of Variation'], 2) if not pd.isna(row['Coefficient of Variation']) else ""
-                        ])
-                
-                # Convert to DataFrame and write
-                export_df = pd.DataFrame(all_data)
-                export_df.to_excel(writer, sheet_name='Spending Estimates', index=False, header=False)
-            
-            # Format the Excel file
-            output.seek(0)
-            wb = load_workbook(output)
-            ws = wb['Spending Estimates']
-            
-            # Set print area and page setup
-            max_row = ws.max_row
-            max_col = ws.max_column
-            ws.print_area = f'A1:{get_column_letter(max_col)}{max_row}'
-            ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-            ws.page_setup.fitToWidth = 1
-            ws.page_setup.fitToHeight = 0
-            
-            # Style headers and important rows
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            title_font = Font(bold=True, size=12)
-            border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
-            # Format title row
-            ws['A1'].font = title_font
-            ws.merge_cells(f'A1:{get_column_letter(max_col)}1')
-            
-            # Format section headers
-            for row_idx, row in enumerate(ws.iter_rows(min_row=1, max_row=max_row), 1):
-                cell_value = str(row[0].value) if row[0].value else ""
-                
-                # Format section headers
-                is_header = any(keyword in cell_value for keyword in ["Source:", "Filter Criteria:", 
-                                                             "By Expenditure Category", "Spending Category Breakdown", "Individual Spending Code Breakdown", "TOTAL", "Household Total Income Range:"])
-                if is_header:
-                    for cell in row:
-                        cell.font = Font(bold=True, size=11)
-                        cell.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-            
-            # Auto-adjust column widths
-            for col in ws.columns:
-                max_length = 0
-                col_letter = get_column_letter(col[0].column)
-                for cell in col:
-                    try:
-                        if cell.value:
-                            max_length = max(max_length, len(str(cell.value)))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[col_letter].width = adjusted_width
-            
-            # Save formatted workbook
-            output = BytesIO()
-            wb.save(output)
-            output.seek(0)
-            excel_data = output.read()
+            with perf.stage('export', rows=len(results_df)):
+                excel_data = build_income_range_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), results_df, hierarchy_data_display,
+                    year=year, domain_records=domain_records, suppress=suppress
+                )
             
             col_left, col_right = st.columns([1, 3])
             with col_left:
@@ -2099,26 +1845,324 @@ def main():
             import traceback
             st.text(traceback.format_exc())
     
-    # Show quintile results only if calculation mode is quintile
-    elif calculation_mode_display == "quintile" and 'quintile_pivot_df' in st.session_state:
+    # Show income group results only if calculation mode is income_group
+    elif calculation_mode_display == "income_group" and 'group_pivot_df' in st.session_state:
         st.markdown("---")
-        st.subheader("📊 Spending by Income Quintile")
+        group_title = st.session_state.group_title
+        st.subheader(f"📊 Spending by {group_title}")
         
-        # Display quintile boundaries
-        quintile_boundaries = st.session_state.get('quintile_boundaries', None)
-        if quintile_boundaries:
-            st.info(f"""
-            **Income Quintile Boundaries:**
-            - Quintile 1 (Lowest): ≤ ${quintile_boundaries[0]:,.0f}
-            - Quintile 2: ${quintile_boundaries[0]:,.0f} - ${quintile_boundaries[1]:,.0f}
-            - Quintile 3: ${quintile_boundaries[1]:,.0f} - ${quintile_boundaries[2]:,.0f}
-            - Quintile 4: ${quintile_boundaries[2]:,.0f} - ${quintile_boundaries[3]:,.0f}
-            - Quintile 5 (Highest): > ${quintile_boundaries[3]:,.0f}
-            """)
+        # Display income group boundaries
+        group_boundaries = st.session_state.get('group_boundaries', None)
+        if group_boundaries:
+            lines = [f"- {label}: {income_range_text}"
+                     for label, income_range_text in income_group_boundary_rows(group_boundaries, group_title)]
+            elasticity = st.session_state.get('group_elasticity')
+            if elasticity is not None:
+                lines.append(f"\nBoundaries are in equivalised dollars: household income ÷ household size^{elasticity:g}.")
+            st.info(f"**{group_title} Boundaries:**\n" + "\n".join(lines))
         
-        # Display quintile results table
-        pivot_df = st.session_state.quintile_pivot_df
+        # Display income group results table
+        pivot_df = income_group_table(st.session_state.group_pivot_df, st.session_state.group_names,
+                                      st.session_state.get('group_records'), hierarchy_data, suppress)
         st.dataframe(pivot_df, use_container_width=True, height=600)
+        show_flag_legend(suppress)
+        
+        # Confidence intervals and adjacent-group differences (absent from results calculated before they existed)
+        intervals_df = st.session_state.get('group_intervals_df')
+        tests_df = st.session_state.get('group_tests_df')
+        if intervals_df is not None:
+            st.subheader("Confidence Intervals (95%)")
+            intervals_df = flag_table(intervals_df, [(
+                'Quality', 'Coefficient of Variation (%)',
+                ['Average ($)', 'Standard Error ($)', 'Normal 95% CI Lower ($)', 'Normal 95% CI Upper ($)',
+                 'Bootstrap 95% CI Lower ($)', 'Bootstrap 95% CI Upper ($)'],
+                'Records'
+            )], suppress=suppress)
+            st.dataframe(intervals_df, use_container_width=True, height=400, hide_index=True)
+            st.caption("Normal intervals are the average ± 1.96 standard errors; bootstrap intervals are the "
+                       "2.5th and 97.5th percentiles of the bootstrap replicate estimates.")
+        if tests_df is not None:
+            st.subheader(f"Differences Between {group_title}s")
+            st.info(f"Each {group_title.lower()} is compared with the one below it, and the highest with the lowest. "
+                    f"Standard errors come from the paired bootstrap replicates of the two groups; a difference is "
+                    f"marked significant when it is more than {SIGNIFICANCE_Z} standard errors from zero.")
+            st.dataframe(tests_df, use_container_width=True, height=400, hide_index=True)
+        
+        # Export income group results to Excel
+        st.subheader(f"📥 Export {group_title} Results")
+        try:
+            with perf.stage('export', rows=len(pivot_df)):
+                excel_data = build_income_group_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), group_boundaries, pivot_df,
+                    group_title=group_title, equivalence_elasticity=st.session_state.get('group_elasticity'),
+                    year=year, suppress=suppress, intervals_df=intervals_df, tests_df=tests_df
+                )
+            
+            st.download_button(
+                label=f"Download {group_title} Results (Excel)",
+                data=excel_data,
+                file_name=f"spending_estimates_by_{group_title.split()[-1].lower()}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_income_group",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
+    
+    # Show domain comparison results only if calculation mode is comparison
+    elif calculation_mode_display == "comparison" and 'comparison_df' in st.session_state:
+        st.markdown("---")
+        st.subheader("📊 Domain Comparison")
+        
+        comparison_groups = st.session_state.comparison_groups
+        reference = comparison_groups[0][0]
+        st.info("**Domains:** " + "; ".join(f"{name} ({n:,} records)" for name, n in comparison_groups) +
+                f"\n\nDifferences and ratios are against **{reference}**. Their standard errors come from the "
+                f"paired bootstrap replicates of the two domains; a difference is marked significant when it is "
+                f"more than {SIGNIFICANCE_Z} standard errors from zero.")
+        empty = [name for name, n in comparison_groups if n == 0]
+        if empty:
+            st.warning(f"No records match: {', '.join(empty)}.")
+        
+        specs = []
+        for name, n in comparison_groups:
+            value_cols = [f'{name} Avg ($)', f'{name} SE ($)', f'{name} CV (%)']
+            if name != reference:
+                value_cols += [f'{name} - {reference} ($)', f'{name} - {reference} SE ($)', f'{name} / {reference}',
+                               f'{name} / {reference} SE']
+            specs.append((f'{name} Quality', f'{name} CV (%)', value_cols, n))
+        comparison_df = st.session_state.comparison_df
+        parents = parent_positions(comparison_df['Spending Code'].tolist(), hierarchy_data)
+        comparison_df = flag_table(comparison_df, specs, suppress, parents)
+        st.dataframe(comparison_df, use_container_width=True, height=600)
+        show_flag_legend(suppress)
+        
+        st.subheader("📥 Export Comparison Results")
+        try:
+            with perf.stage('export', rows=len(comparison_df)):
+                domain_rows = [["Domain", "Records"]] + [[name, n] for name, n in comparison_groups]
+                domain_rows.append(["Reference domain:", reference])
+                excel_data = build_table_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), "Domain Comparison", comparison_df,
+                    sections=[("Domains Compared:", domain_rows),
+                              ("Quality Flags:", [list(row) for row in flag_legend(suppress)])], year=year
+                )
+            
+            st.download_button(
+                label="Download Comparison Results (Excel)",
+                data=excel_data,
+                file_name="spending_estimates_comparison.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_comparison",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
+    
+    # Show the cross-tabulation only if calculation mode is crosstab
+    elif calculation_mode_display == "crosstab" and 'crosstab_df' in st.session_state:
+        st.markdown("---")
+        layout = st.session_state.crosstab_layout
+        column_variables = {column: var for var, column in FILTER_VARIABLES.items()}
+        row_label = FILTER_LABELS[column_variables[layout['row_col']]]
+        col_label = FILTER_LABELS[column_variables[layout['col_col']]]
+        description = SPENDING_DESCRIPTIONS.get(layout['code'], layout['code'])
+        st.subheader(f"📊 {description} ({layout['code']}) by {row_label} and {col_label}")
+        
+        crosstab_df = flag_table(st.session_state.crosstab_df,
+                                 [('Quality', 'Coefficient of Variation (%)',
+                                   ['Average ($)', 'Standard Error ($)', 'Coefficient of Variation (%)'], 'Records')],
+                                 suppress, crosstab_parents(st.session_state.crosstab_df))
+        statistic = st.radio("Statistic", ['Average ($)', 'Standard Error ($)', 'Coefficient of Variation (%)', 'Quality',
+                                           'Records'],
+                             horizontal=True, key='crosstab_statistic')
+        pivot = crosstab_df.pivot(index='Row', columns='Column', values=statistic)
+        pivot = pivot.reindex(index=layout['row_names'], columns=layout['col_names'])
+        pivot.index.name = row_label
+        pivot.columns.name = col_label
+        st.dataframe(pivot, use_container_width=True)
+        show_flag_legend(suppress)
+        
+        st.subheader("📥 Export Cross-tabulation")
+        try:
+            with perf.stage('export', rows=len(crosstab_df)):
+                table_rows = [["Spending code:", f"{layout['code']} - {description}"],
+                              ["Rows:", row_label], ["Columns:", col_label]]
+                excel_data = build_table_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), "Cross-tabulation",
+                    crosstab_df.rename(columns={'Row': row_label, 'Column': col_label}),
+                    sections=[("Table:", table_rows),
+                              ("Quality Flags:", [list(row) for row in flag_legend(suppress)])], year=year
+                )
+            
+            st.download_button(
+                label="Download Cross-tabulation (Excel)",
+                data=excel_data,
+                file_name="spending_crosstab.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_crosstab",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
+    
+    # Show percentiles only if calculation mode is percentile
+    elif calculation_mode_display == "percentile" and 'percentile_df' in st.session_state:
+        st.markdown("---")
+        st.subheader("📊 Spending Percentiles")
+        percentile_df = flag_table(
+            st.session_state.percentile_df,
+            [(f'P{p} Quality', f'P{p} CV (%)', [f'P{p} ($)', f'P{p} SE ($)', f'P{p} CV (%)'], 'Records')
+             for p in st.session_state.percentiles],
+            suppress
+        )
+        st.info("Weighted percentiles of household spending in the filtered domain, next to the mean. "
+                "Standard errors are the spread of the percentile over the bootstrap replicates.")
+        st.dataframe(percentile_df, use_container_width=True)
+        show_flag_legend(suppress)
+        
+        st.subheader("📥 Export Percentiles")
+        try:
+            with perf.stage('export', rows=len(percentile_df)):
+                excel_data = build_table_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), "Spending Percentiles", percentile_df,
+                    sections=[("Table:", [["Percentiles:", ", ".join(f"P{p}" for p in st.session_state.percentiles)]]),
+                              ("Quality Flags:", [list(row) for row in flag_legend(suppress)])],
+                    year=year
+                )
+            
+            st.download_button(
+                label="Download Percentiles (Excel)",
+                data=excel_data,
+                file_name="spending_percentiles.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_percentiles",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
+    
+    # Show per person spending only if calculation mode is per_person
+    elif calculation_mode_display == "per_person" and 'per_person_df' in st.session_state:
+        st.markdown("---")
+        st.subheader("📊 Spending per Person and per Adult Equivalent")
+        summary = st.session_state.per_person_summary
+        st.info(f"**Average household size:** {summary['household_size']:.2f} persons "
+                f"(SE {summary['household_size_se']:.3f}); {summary['adult_equivalents']:.2f} adult equivalents.\n\n"
+                "Per person figures divide total spending by the total number of persons; per adult equivalent "
+                "figures divide it by the square root of household size summed over households. Household size "
+                "is top-coded at 4 in the PUMF, so per person figures are slightly high for larger households.")
+        records = summary['records']
+        per_person_df = flag_table(
+            st.session_state.per_person_df,
+            [(f'{measure} Quality', f'{measure} CV (%)',
+              [f'{measure} ($)', f'{measure} SE ($)', f'{measure} CV (%)'], records)
+             for measure in ('Per Household', 'Per Person', 'Per Adult Equivalent')],
+            suppress, parent_positions(st.session_state.per_person_df['Spending Code'].tolist(), hierarchy_data)
+        )
+        st.dataframe(per_person_df, use_container_width=True, height=600)
+        show_flag_legend(suppress)
+        
+        st.subheader("📥 Export Per Person Results")
+        try:
+            with perf.stage('export', rows=len(per_person_df)):
+                summary_rows = [["Average household size:", round(summary['household_size'], 2)],
+                                ["Average adult equivalents:", round(summary['adult_equivalents'], 2)],
+                                ["Adult equivalents:", "square root of household size (top-coded at 4)"]]
+                excel_data = build_table_workbook(
+                    st.session_state.filters, st.session_state.get('income_range'),
+                    st.session_state.get('filtered_count', 'N/A'), "Spending per Person", per_person_df,
+                    sections=[("Households:", summary_rows),
+                              ("Quality Flags:", [list(row) for row in flag_legend(suppress)])],
+                    year=year
+                )
+            
+            st.download_button(
+                label="Download Per Person Results (Excel)",
+                data=excel_data,
+                file_name="spending_estimates_per_person.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_per_person",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
+    
+    # Show income sweep results only if calculation mode is income_sweep
+    elif calculation_mode_display == "income_sweep" and 'sweep_df' in st.session_state:
+        st.markdown("---")
+        st.subheader("📊 Spending by Income Band")
+        sweep_edges_done = st.session_state.sweep_edges
+        sweep_df = flag_table(st.session_state.sweep_df, [(
+            'Quality', 'Coefficient of Variation (%)',
+            ['Average ($)', 'Standard Error ($)', 'Normal 95% CI Lower ($)', 'Normal 95% CI Upper ($)',
+             'Bootstrap 95% CI Lower ($)', 'Bootstrap 95% CI Upper ($)'],
+            'Records'
+        )], suppress=suppress)
+        band_records = sweep_df.drop_duplicates('Income From ($)')['Records']
+        st.info(f"**{len(sweep_edges_done) - 1} bands** from ${sweep_edges_done[0]:,.0f} to "
+                f"${sweep_edges_done[-1]:,.0f}, {int(band_records.sum()):,} records. Each band includes its lower "
+                f"limit; the last also includes its upper limit.")
+        st.altair_chart(income_sweep_chart(sweep_df), use_container_width=True)
+        st.caption("Lines are average spending at each band's midpoint; shaded areas are normal 95% confidence "
+                   "intervals (average ± 1.96 standard errors).")
+        st.dataframe(sweep_df, use_container_width=True, height=600, hide_index=True)
+        show_flag_legend(suppress)
+        
+        st.subheader("📥 Export Income Sweep Results")
+        try:
+            with perf.stage('export', rows=len(sweep_df)):
+                excel_data = build_table_workbook(
+                    st.session_state.filters, (sweep_edges_done[0], sweep_edges_done[-1]),
+                    int(band_records.sum()), "Spending by Income Band", sweep_df,
+                    sections=[("Quality Flags:", [list(row) for row in flag_legend(suppress)])],
+                    year=year
+                )
+            
+            st.download_button(
+                label="Download Income Sweep Results (Excel)",
+                data=excel_data,
+                file_name="spending_estimates_income_sweep.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="excel_income_sweep",
+                type="primary",
+                use_container_width=True
+            )
+        except ImportError:
+            st.warning("Excel export requires openpyxl. Install with: pip install openpyxl")
+        except Exception as e:
+            st.error(f"Error creating Excel file: {e}")
+            import traceback
+            st.text(traceback.format_exc())
 
 if __name__ == "__main__":
     main()
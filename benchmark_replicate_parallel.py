@@ -0,0 +1,69 @@
+"""Benchmark replicate-block parallelism: scaling from 1 to N worker processes.
+
+Times the national-domain replicate reduction of a synthetic PUMF (all records,
+19 codes, main weight plus 500 bootstrap weights) serially and with process pools
+of increasing size, and checks that every parallel result is bit-identical to the serial one.
+
+    python benchmark_replicate_parallel.py --scale 10 --max-workers 16
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from shs_engine import ReplicateEngine, compact_frame, merge_bootstrap_weights, variable_exists
+from synthetic_pumf import generate_synthetic_pumf
+
+# TC001, TE001 and the Level 2 categories (ITEMS_FOR_TC001_BALANCE in app.py)
+LEVEL2_CODES = ['TE001', 'TC001', 'FD001', 'SH001', 'HO001', 'HF001', 'CL030', 'TR001', 'HC001', 'PC001',
+                'RE001', 'ED002', 'RO001', 'TA018', 'GC001', 'ME001', 'TX010', 'EP011', 'MG001']
+
+
+def time_sums(engine, values, labels, repeat):
+    engine.replicate_sums(values, labels, 1)  # warm-up (starts the pool)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = engine.replicate_sums(values, labels, 1)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help="multiple of the real PUMF record count")
+    parser.add_argument('--codes', type=int, default=19)
+    parser.add_argument('--replicates', type=int, default=500)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    df, df_bsw = generate_synthetic_pumf(args.scale, n_replicates=args.replicates)
+    df, bootstrap_cols = merge_bootstrap_weights(compact_frame(df), compact_frame(df_bsw))
+    codes = [c for c in LEVEL2_CODES if variable_exists(df, c)][:args.codes]
+    n_records = len(df)
+    labels = np.zeros(n_records, dtype=np.intp)
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(f"{n_records:,} records x {args.codes} codes x {args.replicates + 1} weights")
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}  bit-identical")
+    baseline = None
+    for workers in worker_counts:
+        engine = ReplicateEngine(df, bootstrap_cols, workers=workers)
+        seconds, (num, den) = time_sums(engine, engine.values(codes), labels, args.repeat)
+        engine.close()
+        if baseline is None:
+            baseline = (seconds, num, den)
+        identical = np.array_equal(num, baseline[1]) and np.array_equal(den, baseline[2])
+        print(f"{workers:>8} {seconds:>10.4f} {baseline[0] / seconds:>8.2f}  {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Benchmark suite for the load, filter, estimation, income group and export stages.
+
+Runs each case against a synthetic PUMF (synthetic_pumf.py) at one or more
+scales. Every case runs in a fresh process, so its peak RSS is its own and no
+cache survives from a previous case. The best wall time of --repeat runs and the
+process's peak RSS are compared with a stored baseline; the run fails (exit
+status 1) if any case is slower or larger than the baseline by more than the
+tolerance. Baselines are per host: save one on the machine that runs the check.
+
+    python benchmark_suite.py --scales 1 10 --save-baseline
+    python benchmark_suite.py --scales 1 10
+    python benchmark_suite.py --cases quintile export_quintile --scales 1
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+BASELINE_FILE = Path("benchmark_baseline.json")
+DATA_DIR = Path("synthetic")
+XPORT_MAX_SCALE = 10  # larger XPORT files are generated in memory and take minutes to write
+SERVICE_REQUESTS = 200  # requests per service_latency run
+SERVICE_P99_TARGET_MS = 100
+
+# Typical sidebar selections (filter columns hold int8 codes after compact_frame)
+FILTER_SETS = [
+    ({}, None),
+    ({'Prov': [35]}, None),
+    ({'Prov': [24], 'Tenure': [1]}, None),
+    ({'HHType6': [2, 3], 'RP_AgeGrp': [3, 4, 5]}, None),
+    ({'VehicleYN': [1]}, (40000, 100000)),
+]
+
+
+def data_paths(data_dir, scale):
+    """(columnar cache directory, SAS transport directory) for a scale"""
+    base = Path(data_dir) / f"x{scale:g}"
+    return base / "cache", base / "xport"
+
+
+def prepare_data(data_dir, scale, need_xport):
+    """Generate the synthetic files for a scale unless they already exist"""
+    from columnar_cache import read_manifest
+    from synthetic_pumf import write_cache, write_xport
+
+    cache_dir, xport_dir = data_paths(data_dir, scale)
+    if read_manifest(cache_dir) is None:
+        print(f"Generating columnar cache at scale {scale:g}...", flush=True)
+        write_cache(cache_dir, scale)
+    if need_xport and not (xport_dir / "pumf_shs2019_bsw.xpt").exists():
+        print(f"Generating SAS transport files at scale {scale:g}...", flush=True)
+        write_xport(xport_dir, scale)
+
+
+def load_app():
+    """Import app.py outside a Streamlit session (its functions run in bare mode)"""
+    import streamlit.logger
+    streamlit.logger.set_log_level('ERROR')
+    os.environ.setdefault('SHS_PERF_LOG', 'off')
+    import app
+    return app
+
+
+def load_engine(cache_dir):
+    from columnar_cache import load_columnar_cache
+    from shs_engine import ReplicateEngine, merge_bootstrap_weights
+
+    df, bootstrap_cols = merge_bootstrap_weights(*load_columnar_cache(cache_dir))
+    return ReplicateEngine(df, bootstrap_cols)
+
+
+def new_job():
+    from job_queue import Job
+    return Job('benchmark', 'benchmark', heavy=False)
+
+
+# Each case does its setup and returns the function to time
+
+def case_load_cold(cache_dir, xport_dir):
+    """Parse the SAS files, apply the load-time schema and merge the bootstrap weights"""
+    import pyreadstat
+    from shs_engine import compact_frame, merge_bootstrap_weights
+
+    def run():
+        df, _ = pyreadstat.read_xport(str(xport_dir / "pumf_shs2019.xpt"))
+        df_bsw, _ = pyreadstat.read_xport(str(xport_dir / "pumf_shs2019_bsw.xpt"))
+        merge_bootstrap_weights(compact_frame(df), compact_frame(df_bsw))
+    return run
+
+
+def case_load_warm(cache_dir, xport_dir):
+    """Open the columnar cache and merge the bootstrap weights"""
+    from columnar_cache import load_columnar_cache
+    from shs_engine import merge_bootstrap_weights
+
+    return lambda: merge_bootstrap_weights(*load_columnar_cache(cache_dir))
+
+
+def case_filter_data(cache_dir, xport_dir):
+    """app.filter_data over the typical filter sets"""
+    app = load_app()
+    df = load_engine(cache_dir).df
+
+    def run():
+        for filters, income_range in FILTER_SETS:
+            app.filter_data(df, filters, income_range)
+    return run
+
+
+def case_filter_index(cache_dir, xport_dir):
+    """Bitmap domain masks for the typical filter sets"""
+    index = load_engine(cache_dir).index
+
+    def run():
+        for filters, income_range in FILTER_SETS:
+            index.domain_mask(filters, income_range)
+    return run
+
+
+def case_estimate_balance(cache_dir, xport_dir):
+    """Means and bootstrap variances of the 19 TC001 balance codes for each filter set"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    codes = app.get_available_spending_vars(engine.df)
+    masks = [engine.index.domain_mask(filters, income_range) for filters, income_range in FILTER_SETS]
+
+    def run():
+        for mask in masks:
+            engine.estimate(codes, mask)
+    return run
+
+
+def case_estimate_hierarchy(cache_dir, xport_dir):
+    """Means and bootstrap variances of every code in the expenditure hierarchy (national domain)"""
+    from shs_engine import variable_exists
+
+    app = load_app()
+    engine = load_engine(cache_dir)
+    codes = [code for code in app.load_hierarchy()['var_to_node'] if variable_exists(engine.df, code)]
+    mask = engine.index.domain_mask({}, None)
+    return lambda: engine.estimate(codes, mask)
+
+
+def case_level2_rollup(cache_dir, xport_dir):
+    """Income range mode: balance codes, Level 2 rollups, income and consumption"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    hierarchy_data = app.load_hierarchy()
+    filters, income_range = FILTER_SETS[-1]
+    return lambda: app.run_income_range_calculation(new_job(), engine, filters, income_range, hierarchy_data)
+
+
+def case_quintile(cache_dir, xport_dir):
+    """Quintile mode for the national domain"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    hierarchy_data = app.load_hierarchy()
+    return lambda: app.run_income_group_calculation(new_job(), engine, {}, hierarchy_data, 5)
+
+
+def case_decile(cache_dir, xport_dir):
+    """Decile mode for the national domain (one grouped pass, like quintiles)"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    hierarchy_data = app.load_hierarchy()
+    return lambda: app.run_income_group_calculation(new_job(), engine, {}, hierarchy_data, 10)
+
+
+def case_percentile(cache_dir, xport_dir):
+    """Median and P90 of the 19 TC001 balance codes with bootstrap SEs (national domain)"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    codes = app.get_available_spending_vars(engine.df)
+    return lambda: app.run_percentile_calculation(new_job(), engine, {}, None, codes, [50, 90])
+
+
+def case_per_person(cache_dir, xport_dir):
+    """Per person mode: household means plus per person and per adult equivalent ratios in one pass"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    hierarchy_data = app.load_hierarchy()
+    filters, income_range = FILTER_SETS[-1]
+    return lambda: app.run_per_person_calculation(new_job(), engine, filters, income_range, hierarchy_data)
+
+
+def case_income_sweep(cache_dir, xport_dir):
+    """Income sweep of the 19 TC001 balance codes over 25 $10k bands (national domain)"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    codes = app.get_available_spending_vars(engine.df)
+    edges = app.income_sweep_edges(0, 250000, 10000)
+    return lambda: app.run_income_sweep_calculation(new_job(), engine, {}, codes, edges)
+
+
+def case_service_latency(cache_dir, xport_dir):
+    """Estimation service over HTTP: single-domain, 19-code requests with the result cache off (p50 and p99)"""
+    import threading
+    from http.server import ThreadingHTTPServer
+
+    import numpy as np
+    from estimation_service import EstimationService, make_handler, query_service
+
+    app = load_app()
+    engine = load_engine(cache_dir)
+    codes = app.get_available_spending_vars(engine.df)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(EstimationService(engine, cache_size=0)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    def run():
+        latencies = []
+        for i in range(SERVICE_REQUESTS):
+            filters, income_range = FILTER_SETS[i % len(FILTER_SETS)]
+            start = time.perf_counter()
+            query_service(url, filters, income_range, codes=codes)
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        return {'p50_ms': float(p50), 'p99_ms': float(p99)}
+    return run
+
+
+def case_export_income_range(cache_dir, xport_dir):
+    """Excel workbook for income range results"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    hierarchy_data = app.load_hierarchy()
+    filters, income_range = FILTER_SETS[-1]
+    result = app.run_income_range_calculation(new_job(), engine, filters, income_range, hierarchy_data)
+    return lambda: app.build_income_range_workbook(
+        filters, income_range, len(engine.df), result['results'], hierarchy_data
+    )
+
+
+def case_export_quintile(cache_dir, xport_dir):
+    """Excel workbook for quintile results"""
+    app = load_app()
+    engine = load_engine(cache_dir)
+    result = app.run_income_group_calculation(new_job(), engine, {}, app.load_hierarchy(), 5)
+    return lambda: app.build_income_group_workbook(
+        {}, None, len(engine.df), result['group_boundaries'], result['group_pivot_df']
+    )
+
+
+CASES = {
+    'load_cold': case_load_cold,
+    'load_warm': case_load_warm,
+    'filter_data': case_filter_data,
+    'filter_index': case_filter_index,
+    'estimate_balance': case_estimate_balance,
+    'estimate_hierarchy': case_estimate_hierarchy,
+    'level2_rollup': case_level2_rollup,
+    'quintile': case_quintile,
+    'decile': case_decile,
+    'percentile': case_percentile,
+    'per_person': case_per_person,
+    'income_sweep': case_income_sweep,
+    'service_latency': case_service_latency,
+    'export_income_range': case_export_income_range,
+    'export_quintile': case_export_quintile,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where it cannot be read)"""
+    # On Linux ru_maxrss survives exec, so a spawned child would report its parent's peak
+    status = Path('/proc/self/status')
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 2**10
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_case(name, data_dir, scale, repeat):
+    """Set up and time one case (runs in its own process)"""
+    cache_dir, xport_dir = data_paths(data_dir, scale)
+    fn = CASES[name](cache_dir, xport_dir)
+    times = []
+    metrics = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extra = fn()
+        times.append(time.perf_counter() - start)
+        if isinstance(extra, dict):
+            # Cases can report their own metrics (latency percentiles); keep the best run's
+            if not metrics or times[-1] == min(times):
+                metrics = extra
+    return dict({'case': name, 'scale': scale, 'seconds': min(times), 'peak_rss_mb': peak_rss_mb()}, **metrics)
+
+
+def compare(results, baseline, time_tolerance, rss_tolerance):
+    """Print results next to the baseline and return the number of regressions"""
+    previous = {(r['case'], r['scale']): r for r in baseline.get('results', [])}
+    regressions = 0
+    print(f"{'case':<22}{'scale':>7}{'seconds':>11}{'baseline':>11}{'ratio':>8}{'RSS MB':>9}{'baseline':>10}  status")
+    for r in results:
+        base = previous.get((r['case'], r['scale']))
+        status = "new"
+        base_seconds = base_rss = ratio = None
+        if base is not None:
+            base_seconds, base_rss = base['seconds'], base.get('peak_rss_mb')
+            ratio = r['seconds'] / base_seconds if base_seconds > 0 else 1.0
+            slower = ratio > 1 + time_tolerance
+            larger = (r['peak_rss_mb'] is not None and base_rss is not None
+                      and r['peak_rss_mb'] > base_rss * (1 + rss_tolerance))
+            status = " ".join(s for s, bad in (("SLOWER", slower), ("LARGER", larger)) if bad) or "ok"
+            regressions += slower or larger
+
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else "-"
+        print(f"{r['case']:<22}{r['scale']:>7g}{r['seconds']:>11.4f}{fmt(base_seconds, '.4f'):>11}"
+              f"{fmt(ratio, '.2f'):>8}{fmt(r['peak_rss_mb'], '.0f'):>9}{fmt(base_rss, '.0f'):>10}  {status}")
+    for r in results:
+        if 'p99_ms' in r:
+            verdict = "meets" if r['p99_ms'] < SERVICE_P99_TARGET_MS else "MISSES"
+            print(f"{r['case']} at scale {r['scale']:g}: p50 {r['p50_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms "
+                  f"({verdict} the {SERVICE_P99_TARGET_MS} ms p99 target)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 10.0],
+                        help="multiples of the real PUMF record count")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=str(DATA_DIR), help="where the synthetic files are kept")
+    parser.add_argument('--baseline', default=str(BASELINE_FILE))
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument('--rss-tolerance', type=float, default=0.10, help="allowed relative peak RSS growth")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for scale in args.scales:
+        with_cold = 'load_cold' in args.cases and scale <= XPORT_MAX_SCALE
+        prepare_data(args.data_dir, scale, with_cold)
+        for name in args.cases:
+            if name == 'load_cold' and not with_cold:
+                print(f"Skipping load_cold at scale {scale:g} (SAS transport files only up to {XPORT_MAX_SCALE}x)")
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.append(pool.submit(run_case, name, args.data_dir, scale, args.repeat).result())
+
+    report = {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results
+    }
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if baseline.get('host') not in (None, report['host']):
+        print(f"Note: baseline was recorded on {baseline['host']}, not this host")
+    regressions = compare(results, baseline, args.time_tolerance, args.rss_tolerance)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline to {baseline_path}")
+    elif regressions:
+        print(f"{regressions} case(s) regressed against {baseline_path}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
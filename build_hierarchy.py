@@ -1,9 +1,16 @@
 import pandas as pd
 import re
 import json
+import sys
+
+from datasets import DEFAULT_YEAR, hierarchy_file
+
+# Survey year to compile: python build_hierarchy.py 2021 (default 2019)
+year = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_YEAR
+output_file = hierarchy_file(year)
 
 # Read the hierarchy file
-df = pd.read_excel('SHS_EDM_2019/Documentation/Expenditure category hierarchy/Hierarchy of expenditure categories, PUMF 2019.xlsx', header=6)
+df = pd.read_excel(f'SHS_EDM_{year}/Documentation/Expenditure category hierarchy/Hierarchy of expenditure categories, PUMF {year}.xlsx', header=6)
 
 # Extract hierarchy structure
 hierarchy_data = []
@@ -142,8 +149,8 @@ hierarchy_structure = {
     'sibling_groups': {f"{parent}_{level}": vars_list for (parent, level), vars_list in sibling_groups.items()}
 }
 
-with open('hierarchy_structure.json', 'w') as f:
+with open(output_file, 'w') as f:
     json.dump(hierarchy_structure, f, indent=2)
 
-print("\n\nHierarchy structure saved to hierarchy_structure.json")
+print(f"\n\nHierarchy structure saved to {output_file}")
 
@@ -7,39 +7,18 @@ items = [
     'GC001', 'ME001', 'TX010', 'EP011', 'MG001'
 ]
 
-# Read SPENDING_DESCRIPTIONS from app.py
-import re
+from shs_metadata import SPENDING_DESCRIPTIONS
 
-with open('app.py', 'r', encoding='utf-8') as f:
-    content = f.read()
+descriptions = {item: SPENDING_DESCRIPTIONS.get(item, "MISSING") for item in items}
 
-# Extract SPENDING_DESCRIPTIONS dictionary
-match = re.search(r'SPENDING_DESCRIPTIONS = \{([^}]+)\}', content, re.DOTALL)
-if match:
-    descs_text = match.group(1)
-    # Simple extraction - look for "KEY": "VALUE" patterns
-    descriptions = {}
-    for item in items:
-        pattern = f'"{item}":\\s*"([^"]+)"'
-        match_item = re.search(pattern, descs_text)
-        if match_item:
-            descriptions[item] = match_item.group(1)
-        else:
-            descriptions[item] = "MISSING"
+print("Checking descriptions for all 19 items:\n")
+missing = [i for i in items if descriptions.get(i) == "MISSING"]
 
-    print("Checking descriptions for all 19 items:\n")
-    missing = [i for i in items if descriptions.get(i) == "MISSING"]
-    
-    if missing:
-        print(f"Missing descriptions: {missing}\n")
-    else:
-        print("All items have descriptions!\n")
-    
-    print("All descriptions:")
-    for item in items:
-        print(f"  {item}: {descriptions.get(item, 'MISSING')}")
+if missing:
+    print(f"Missing descriptions: {missing}\n")
 else:
-    print("Could not find SPENDING_DESCRIPTIONS in app.py")
-
-
+    print("All items have descriptions!\n")
 
+print("All descriptions:")
+for item in items:
+    print(f"  {item}: {descriptions.get(item, 'MISSING')}")
@@ -0,0 +1,341 @@
+"""Check every optimised estimator path against the frozen reference implementation.
+
+Runs reference_estimators (the original pandas functions) and each engine path
+over randomized domains and quintile splits of a synthetic PUMF, plus edge
+cases, and compares means, variances, standard errors and CVs:
+
+    numpy     ReplicateEngine with the compiled kernel turned off
+    kernel    ReplicateEngine with the compiled kernel (skipped if it is not built)
+    parallel  replicate blocks spread over worker processes
+    float32   load-time schema (int8 filter codes, float32 bootstrap weights)
+    service   EstimationService, first (computed) and second (cached) request
+
+Besides the means, each domain checks the participation rates and reporter means,
+spending per person and per adult equivalent, and weighted quantiles of a few
+codes (float64 paths only: with float32 bootstrap weights a replicate quantile
+can land on the neighbouring record, which no tolerance bounds).
+
+Edge cases: an empty domain, a single-record domain, an all-missing variable, an
+all-missing _C/_D pair, a bootstrap weight that is zero everywhere, records with
+zero main weight and records with missing income or household size. A value
+matches when |new - reference| <= rtol * |reference| + atol, with atol scaled by
+the variable's magnitude, and missing values must be missing in both. The
+tolerances are tight for float64 paths (summation order only) and looser for
+float32 bootstrap weights (see shs_engine.compact_frame for the error bound).
+
+    python check_equivalence.py --domains 20 --replicates 500
+"""
+
+import argparse
+import contextlib
+import sys
+
+import numpy as np
+
+import reference_estimators as ref
+import shs_engine
+from estimation_service import EstimationService
+from shs_engine import ReplicateEngine, compact_frame, merge_bootstrap_weights
+from shs_metadata import FILTER_VARIABLES
+from synthetic_pumf import generate_synthetic_pumf
+
+# TC001, TE001 and the Level 2 categories, plus the synthetic all-missing codes
+CODES = ['TE001', 'TC001', 'FD001', 'SH001', 'HO001', 'HF001', 'CL030', 'TR001', 'HC001', 'PC001',
+         'RE001', 'ED002', 'RO001', 'TA018', 'GC001', 'ME001', 'TX010', 'EP011', 'MG001',
+         'HH_TotInc', 'ZZ001', 'ZZ002']
+STATS = ('mean', 'variance', 'std_error', 'cv')
+
+# Weighted quantiles are checked for fewer codes: the reference sorts once per weight column
+QUANTILE_CODES = ['TE001', 'FD001', 'SH001', 'HH_TotInc', 'ZZ001', 'ZZ002']
+PROBABILITIES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# (rtol, atol as a multiple of the statistic's natural scale) per path
+TOLERANCES = {
+    'float64': {'mean': (1e-10, 1e-12), 'variance': (1e-7, 1e-12), 'std_error': (1e-7, 1e-10), 'cv': (1e-7, 1e-10)},
+    'float32': {'mean': (1e-10, 1e-12), 'variance': (1e-4, 1e-9), 'std_error': (1e-4, 1e-7), 'cv': (1e-4, 1e-7)},
+}
+
+
+def make_data(scale, n_replicates, seed):
+    """(float64 frame, compact frame, bootstrap columns) with the edge cases built in"""
+    df, df_bsw = generate_synthetic_pumf(scale, seed, n_replicates, missing_rate=0.05)
+    rng = np.random.default_rng(seed)
+    df['ZZ001'] = np.nan
+    df['ZZ002_C'] = np.nan
+    df['ZZ002_D'] = np.nan
+    df.loc[rng.random(len(df)) < 0.01, 'WeightD'] = 0.0
+    df.loc[rng.random(len(df)) < 0.01, 'HH_TotInc'] = np.nan
+    df.loc[rng.random(len(df)) < 0.01, 'HHSize'] = np.nan
+    df_bsw['BSW3'] = 0.0
+
+    full, bootstrap_cols = merge_bootstrap_weights(df, df_bsw)
+    compact, _ = merge_bootstrap_weights(compact_frame(df), compact_frame(df_bsw))
+    return full, compact, bootstrap_cols
+
+
+def random_domains(df, n_domains, rng):
+    """Random sidebar selections: 1 to 3 filters with 1 to 3 codes each, sometimes an income range"""
+    columns = [col for col in FILTER_VARIABLES.values() if col in df.columns]
+    domains = []
+    for _ in range(n_domains):
+        filters = {}
+        for col in rng.choice(columns, rng.integers(1, 4), replace=False):
+            codes = sorted(df[col].dropna().unique())
+            filters[col] = list(rng.choice(codes, min(len(codes), rng.integers(1, 4)), replace=False))
+        income_range = None
+        if rng.random() < 0.3:
+            low, high = np.sort(rng.choice(df['HH_TotInc'].dropna().to_numpy(), 2, replace=False))
+            income_range = (float(low), float(high))
+        domains.append((filters, income_range))
+    return domains
+
+
+def edge_domains(df):
+    """Empty and single-record domains (by an income range that holds one household)"""
+    income = df['HH_TotInc'].dropna()
+    unique_income = income[~income.duplicated(keep=False)]
+    single = float(unique_income.iloc[len(unique_income) // 2])
+    return [
+        ({'Prov': ['99']}, None),
+        ({}, (single, single)),
+        ({}, None),
+    ]
+
+
+@contextlib.contextmanager
+def kernel_disabled():
+    kernel = shs_engine.compiled_grouped_sums
+    shs_engine.compiled_grouped_sums = None
+    try:
+        yield
+    finally:
+        shs_engine.compiled_grouped_sums = kernel
+
+
+@contextlib.contextmanager
+def parallel_everywhere():
+    threshold = shs_engine.PARALLEL_MIN_RECORDS
+    shs_engine.PARALLEL_MIN_RECORDS = 0
+    try:
+        yield
+    finally:
+        shs_engine.PARALLEL_MIN_RECORDS = threshold
+
+
+def reference_domain(df, bootstrap_cols, filters, income_range):
+    domain = ref.filter_data(df, filters, income_range)
+    return [ref.estimate(domain, code, bootstrap_cols) for code in CODES]
+
+
+def reference_quintiles(df, bootstrap_cols, filters):
+    """(boundaries, [per-quintile reference estimates], total estimates) or None"""
+    boundaries, quintile_df = ref.assign_income_quintiles(ref.filter_data(df, filters))
+    if boundaries is None:
+        return None
+    groups = []
+    for quintile in range(1, 6):
+        group = quintile_df[quintile_df['Income_Quintile'] == quintile]
+        groups.append([ref.estimate(group, code, bootstrap_cols) for code in CODES] if len(group) else None)
+    total = [ref.estimate(quintile_df, code, bootstrap_cols) for code in CODES]
+    return boundaries, groups, total
+
+
+class Checker:
+    """Accumulates comparisons and failures per path"""
+
+    def __init__(self):
+        self.counts = {}
+        self.worst = {}
+        self.failures = []
+
+    def compare(self, path, precision, context, reference, estimates, i):
+        """Compare one code's reference dict with position i of an engine result"""
+        self.compare_stats(path, precision, f"{context} {CODES[i]}", reference,
+                           {stat: estimates[stat][i] for stat in STATS})
+
+    def compare_stats(self, path, precision, context, reference, actuals):
+        """Compare the statistics in actuals with the reference dict, whose 'mean' (the
+        estimate) sets the natural scale"""
+        magnitude = abs(reference['mean']) if not np.isnan(reference['mean']) else 0.0
+        natural = {'mean': max(magnitude, 1.0), 'variance': max(magnitude, 1.0) ** 2,
+                   'std_error': max(magnitude, 1.0), 'cv': 100.0}
+        for stat, actual in actuals.items():
+            expected = float(reference[stat])
+            actual = float(actual)
+            rtol, atol = TOLERANCES[precision][stat]
+            self.counts[path] = self.counts.get(path, 0) + 1
+            if np.isnan(expected) or np.isnan(actual):
+                ok = np.isnan(expected) and np.isnan(actual)
+            else:
+                # Error as a fraction of the allowed error: at most 1 passes
+                ratio = abs(actual - expected) / (rtol * abs(expected) + atol * natural[stat])
+                ok = ratio <= 1
+                self.worst[(path, stat)] = max(self.worst.get((path, stat), 0.0), ratio)
+            if not ok:
+                self.failures.append(f"{path}: {context} {stat}: expected {expected!r}, got {actual!r}")
+
+    def compare_rows(self, path, precision, context, references, estimates):
+        for i, reference in enumerate(references):
+            self.compare(path, precision, context, reference, estimates, i)
+
+    def fail(self, path, message):
+        self.counts[path] = self.counts.get(path, 0) + 1
+        self.failures.append(f"{path}: {message}")
+
+
+def service_estimates(service, filters, income_range):
+    """Estimates from the service's JSON rows (None becomes NaN), in CODES order"""
+    rows = service.estimate({'filters': filters, 'income_range': income_range, 'codes': CODES})['results']
+    return {stat: [np.nan if row[stat] is None else row[stat] for row in rows] for stat in STATS}
+
+
+def check_domains(checker, engines, service, domains, full, bootstrap_cols):
+    for number, (filters, income_range) in enumerate(domains):
+        context = f"domain {number} {filters} {income_range}"
+        references = reference_domain(full, bootstrap_cols, filters, income_range)
+        for path, (engine, precision, setup) in engines.items():
+            with setup():
+                mask = engine.index.domain_mask(filters, income_range)
+                checker.compare_rows(path, precision, context, references, engine.estimate(CODES, mask))
+        for attempt in ('computed', 'cached'):
+            estimates = service_estimates(service, filters, income_range)
+            checker.compare_rows(f'service ({attempt})', 'float32', context, references, estimates)
+
+
+def check_participation(checker, engines, domains, full, bootstrap_cols):
+    for number, (filters, income_range) in enumerate(domains):
+        context = f"participation {number} {filters} {income_range}"
+        domain = ref.filter_data(full, filters, income_range)
+        references = [ref.estimate_participation(domain, code, bootstrap_cols) for code in CODES]
+        for path, (engine, precision, setup) in engines.items():
+            with setup():
+                estimates = engine.estimate(CODES, engine.index.domain_mask(filters, income_range),
+                                            participation=True)
+            for i, (rate, reporters) in enumerate(references):
+                checker.compare_stats(path, precision, f"{context} {CODES[i]} rate", rate,
+                                      {'mean': estimates['participation'][i],
+                                       'std_error': estimates['participation_se'][i]})
+                checker.compare_stats(path, precision, f"{context} {CODES[i]} reporter mean", reporters,
+                                      {'mean': estimates['reporter_mean'][i],
+                                       'std_error': estimates['reporter_mean_se'][i],
+                                       'cv': estimates['reporter_mean_cv'][i]})
+
+
+def check_ratios(checker, engines, domains, full, bootstrap_cols):
+    """Spending per person and per adult equivalent (square-root scale)"""
+    for number, (filters, income_range) in enumerate(domains):
+        context = f"ratios {number} {filters} {income_range}"
+        domain = ref.filter_data(full, filters, income_range)
+        size = ref.household_size(domain)
+        references = {name: [ref.estimate_ratio(domain, code, denominator, bootstrap_cols) for code in CODES]
+                      for name, denominator in (('per_person', size), ('per_adult_equivalent', size ** 0.5))}
+        for path, (engine, precision, setup) in engines.items():
+            with setup():
+                denominators = {'per_person': engine.household_size(),
+                                'per_adult_equivalent': engine.adult_equivalents()}
+                estimates = engine.estimate(CODES, engine.index.domain_mask(filters, income_range),
+                                            denominators=denominators)
+            for name, rows in references.items():
+                for i, reference in enumerate(rows):
+                    checker.compare_stats(path, precision, f"{context} {CODES[i]} {name}", reference,
+                                          {'mean': estimates[name][i], 'std_error': estimates[f'{name}_se'][i],
+                                           'cv': estimates[f'{name}_cv'][i]})
+
+
+def check_percentiles(checker, engines, domains, full, bootstrap_cols):
+    """Weighted quantiles of QUANTILE_CODES on the float64 paths"""
+    for number, (filters, income_range) in enumerate(domains):
+        context = f"quantiles {number} {filters} {income_range}"
+        domain = ref.filter_data(full, filters, income_range)
+        references = [ref.estimate_quantiles(domain, code, PROBABILITIES, bootstrap_cols)
+                      for code in QUANTILE_CODES]
+        for path, (engine, precision, setup) in engines.items():
+            if precision != 'float64':
+                continue
+            with setup():
+                estimates = engine.estimate_quantiles(QUANTILE_CODES, PROBABILITIES,
+                                                      engine.index.domain_mask(filters, income_range))
+            for i, rows in enumerate(references):
+                for k, reference in enumerate(rows):
+                    checker.compare_stats(path, precision, f"{context} {QUANTILE_CODES[i]} p{PROBABILITIES[k]:g}",
+                                          reference, {'mean': estimates['quantile'][i, k],
+                                                      **{stat: estimates[stat][i, k] for stat in STATS[1:]}})
+
+
+def check_quintiles(checker, engines, domains, full, bootstrap_cols):
+    for number, (filters, _) in enumerate(domains):
+        context = f"quintiles {number} {filters}"
+        reference = reference_quintiles(full, bootstrap_cols, filters)
+        for path, (engine, precision, setup) in engines.items():
+            with setup():
+                boundaries, labels = engine.quintile_labels(engine.index.domain_mask(filters, None))
+                if reference is None or boundaries is None:
+                    if (reference is None) != (boundaries is None):
+                        checker.fail(path, f"{context}: quintiles found by only one implementation")
+                    continue
+                if not np.array_equal(np.asarray(reference[0], dtype=float), np.asarray(boundaries, dtype=float)):
+                    checker.fail(path, f"{context}: boundaries {list(boundaries)} != {reference[0]}")
+                groups = engine.estimate_groups(CODES, labels, 5)
+                for q, group_reference in enumerate(reference[1]):
+                    if group_reference is None:
+                        if groups['n_records'][q] != 0:
+                            checker.fail(path, f"{context}: quintile {q + 1} should be empty")
+                        continue
+                    estimates = {stat: groups[stat][q] for stat in STATS}
+                    checker.compare_rows(path, precision, f"{context} Q{q + 1}", group_reference, estimates)
+                checker.compare_rows(path, precision, f"{context} total", reference[2],
+                                     engine.estimate(CODES, labels >= 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help="multiple of the real PUMF record count")
+    parser.add_argument('--replicates', type=int, default=100, help="bootstrap weights (500 in the real file)")
+    parser.add_argument('--domains', type=int, default=12, help="randomized domains")
+    parser.add_argument('--quintile-domains', type=int, default=4, help="randomized quintile splits")
+    parser.add_argument('--seed', type=int, default=2019)
+    parser.add_argument('--workers', type=int, default=2, help="processes for the parallel path")
+    args = parser.parse_args()
+
+    full, compact, bootstrap_cols = make_data(args.scale, args.replicates, args.seed)
+    rng = np.random.default_rng(args.seed)
+    domains = edge_domains(full) + random_domains(full, args.domains, rng)
+    quintile_domains = [({}, None), ({'Prov': ['99']}, None)] + random_domains(full, args.quintile_domains, rng)
+
+    engines = {'numpy': (ReplicateEngine(full, bootstrap_cols, workers=1), 'float64', kernel_disabled)}
+    if shs_engine.compiled_grouped_sums is not None:
+        engines['kernel'] = (ReplicateEngine(full, bootstrap_cols, workers=1), 'float64', contextlib.nullcontext)
+    else:
+        print("Compiled kernel not available: skipping the kernel path")
+    engines['parallel'] = (ReplicateEngine(full, bootstrap_cols, workers=args.workers), 'float64',
+                           parallel_everywhere)
+    engines['float32'] = (ReplicateEngine(compact, bootstrap_cols, workers=1), 'float32', contextlib.nullcontext)
+    service = EstimationService(ReplicateEngine(compact, bootstrap_cols, workers=1))
+
+    print(f"{len(full):,} records, {len(bootstrap_cols)} bootstrap weights, "
+          f"{len(domains)} domains, {len(quintile_domains)} quintile splits")
+    checker = Checker()
+    try:
+        check_domains(checker, engines, service, domains, full, bootstrap_cols)
+        check_participation(checker, engines, domains, full, bootstrap_cols)
+        check_ratios(checker, engines, domains, full, bootstrap_cols)
+        check_percentiles(checker, engines, domains, full, bootstrap_cols)
+        check_quintiles(checker, engines, quintile_domains, full, bootstrap_cols)
+    finally:
+        for engine, _, _ in engines.values():
+            engine.close()
+
+    print("Worst error as a fraction of the tolerance (1 = at the limit):")
+    print(f"{'path':<20}{'checks':>8}" + "".join(f"{stat:>12}" for stat in STATS))
+    for path, count in checker.counts.items():
+        print(f"{path:<20}{count:>8}" + "".join(f"{checker.worst.get((path, stat), 0.0):>12.2e}" for stat in STATS))
+    if checker.failures:
+        print(f"\n{len(checker.failures)} mismatches:")
+        for failure in checker.failures[:50]:
+            print("  " + failure)
+        sys.exit(1)
+    print("All paths match the reference implementation.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Columnar cache of the PUMF: one .npy file per main-file column plus a single
+records x replicates bootstrap weight matrix, described by manifest.json.
+
+Columns are stored after the load-time schema (shs_engine.compact_frame) and
+memory-mapped when the cache is opened, so loading costs a few mmap calls
+instead of parsing and merging the sas7bdat files. An optional second matrix,
+replicate_weights.npy, holds WeightD followed by the bootstrap weights with
+non-positive weights set to zero: the replicate engine's own layout, so an
+engine can map it instead of building a copy.
+
+write_sas_cache builds a cache from the sas7bdat files without holding the
+bootstrap weight file in memory: worker processes read it in row chunks and
+write each chunk straight into the preallocated memory-mapped BSW matrix.
+SHS_INGEST_WORKERS (default: all cores) and SHS_INGEST_CHUNK_ROWS (default
+10000) set the parallelism and the chunk size; peak memory per worker is about
+chunk rows x columns x 8 bytes, whatever the file size. A file of one chunk is
+read in the calling process.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+BSW_MATRIX = 'bsw.npy'
+REPLICATE_WEIGHTS = 'replicate_weights.npy'
+COLUMNS_DIR = 'columns'
+INGEST_WORKERS = int(os.environ.get('SHS_INGEST_WORKERS', 0)) or os.cpu_count() or 1
+INGEST_CHUNK_ROWS = int(os.environ.get('SHS_INGEST_CHUNK_ROWS', 10000))
+
+# np.load parses .npy headers with ast.literal_eval, which is not thread-safe on
+# some CPython 3.11 releases; caches are opened from the script thread and from jobs
+_load_lock = threading.Lock()
+
+
+def load_array(path, mmap=True):
+    """np.load of one cache file (memory-mapped read-only by default)"""
+    with _load_lock:
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def column_array(series):
+    """numpy array for a column that np.save can write without pickling (text becomes fixed-width str)"""
+    if not isinstance(series.dtype, np.dtype) or series.dtype == object:
+        return series.astype(str).to_numpy(dtype=str)
+    return series.to_numpy()
+
+
+def create_column_files(cache_dir, columns, n_records):
+    """Preallocate writable memory-mapped files for main-file columns ({name: dtype})"""
+    column_dir = Path(cache_dir) / COLUMNS_DIR
+    column_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        name: np.lib.format.open_memmap(column_dir / f'{name}.npy', mode='w+', dtype=dtype, shape=(n_records,))
+        for name, dtype in columns.items()
+    }
+
+
+def create_bsw_matrix(cache_dir, n_records, n_replicates, dtype=np.float32):
+    """Preallocate the writable memory-mapped bootstrap weight matrix"""
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(Path(cache_dir) / BSW_MATRIX, mode='w+', dtype=dtype,
+                                     shape=(n_records, n_replicates))
+
+
+def source_fingerprints(paths):
+    """{file name: {size, mtime_ns}} of the source files a cache is built from"""
+    fingerprints = {}
+    for path in paths:
+        stat = os.stat(path)
+        fingerprints[Path(path).name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return fingerprints
+
+
+def sources_changed(recorded, paths):
+    """True when recorded fingerprints (a manifest's source_files) differ from the files at paths.
+
+    Without recorded fingerprints, or when the source files are not present (a
+    cache shipped on its own), nothing has changed."""
+    if not recorded or not all(Path(path).exists() for path in paths):
+        return False
+    return source_fingerprints(paths) != recorded
+
+
+@contextmanager
+def cache_lock(cache_dir):
+    """Cross-process lock for building or completing a cache (fcntl; only in-process locks elsewhere).
+
+    The lock file sits next to the cache directory, so it survives the cache being replaced."""
+    cache_dir = Path(cache_dir)
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(cache_dir.with_name(cache_dir.name + '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_directory(cache_dir):
+    """Empty temporary directory next to cache_dir to build a replacement cache in"""
+    cache_dir = Path(cache_dir)
+    return Path(tempfile.mkdtemp(prefix=f'.{cache_dir.name}.build-', dir=cache_dir.parent))
+
+
+def replace_cache(build_dir, cache_dir):
+    """Move a finished cache from build_dir to cache_dir, replacing any old cache there.
+
+    The old directory is renamed away before it is removed, so readers never see a
+    partly written cache, and arrays still mapped from the old files stay valid."""
+    cache_dir = Path(cache_dir)
+    old = None
+    if cache_dir.exists():
+        old = cache_dir.with_name(f'.{cache_dir.name}.old-{os.getpid()}')
+        os.replace(cache_dir, old)
+    os.replace(build_dir, cache_dir)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def write_manifest(cache_dir, n_records, columns, bootstrap_cols, source=None, source_files=None):
+    """Record the cache layout; written last, so a cache without a manifest is incomplete.
+
+    source_files (see source_fingerprints) lets readers detect replaced source files."""
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'n_records': int(n_records),
+        'columns': list(columns),
+        'bootstrap_cols': list(bootstrap_cols),
+        'source': source,
+        'source_files': source_files
+    }
+    with open(Path(cache_dir) / MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def write_main_columns(cache_dir, df):
+    """Write a main-file frame's columns (after the load-time schema); returns the column names"""
+    from shs_engine import compact_frame
+
+    df = compact_frame(df)
+    columns = {name: column_array(df[name]) for name in df.columns}
+    files = create_column_files(cache_dir, {name: arr.dtype for name, arr in columns.items()}, len(df))
+    for name, arr in columns.items():
+        files[name][:] = arr
+        files[name].flush()
+    return list(columns)
+
+
+def write_columnar_cache(cache_dir, df, df_bsw, source=None):
+    """Write a main-file frame and its bootstrap weight frame (rows in the same order) as a cache"""
+    from shs_engine import bootstrap_columns, compact_frame
+
+    columns = write_main_columns(cache_dir, df)
+    bootstrap_cols = bootstrap_columns(df_bsw.columns)
+    bsw = compact_frame(df_bsw[bootstrap_cols])
+    dtype = np.result_type(*bsw.dtypes) if bootstrap_cols else np.float32
+    matrix = create_bsw_matrix(cache_dir, len(df), len(bootstrap_cols), dtype)
+    matrix[:] = bsw.to_numpy(dtype=dtype)
+    matrix.flush()
+    return write_manifest(cache_dir, len(df), columns, bootstrap_cols, source)
+
+
+def read_manifest(cache_dir):
+    """Manifest of a complete cache, or None if there is no (finished) cache here"""
+    path = Path(cache_dir) / MANIFEST
+    if not path.exists():
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('format_version') == FORMAT_VERSION else None
+
+
+def open_bsw_matrix(cache_dir, mmap=True):
+    """The records x replicates bootstrap weight matrix (memory-mapped read-only by default)"""
+    return load_array(Path(cache_dir) / BSW_MATRIX, mmap)
+
+
+def load_columnar_cache(cache_dir, columns=None, mmap=True):
+    """Open a cache as (main DataFrame, bootstrap weight DataFrame).
+
+    The bootstrap frame carries a 'caseid' column so it merges with the main
+    frame exactly like the sas7bdat files do. columns limits the main-file
+    columns read."""
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No columnar cache found in {cache_dir}")
+    names = manifest['columns'] if columns is None else [c for c in columns if c in manifest['columns']]
+    column_dir = Path(cache_dir) / COLUMNS_DIR
+    # copy=False keeps one block per column, so the columns stay memory-mapped
+    df = pd.DataFrame({
+        name: load_array(column_dir / f'{name}.npy', mmap)
+        for name in names
+    }, copy=False)
+
+    df_bsw = pd.DataFrame(open_bsw_matrix(cache_dir, mmap), columns=manifest['bootstrap_cols'], copy=False)
+    if 'CaseID' in manifest['columns']:
+        df_bsw.insert(0, 'caseid', load_array(column_dir / 'CaseID.npy', mmap=False))
+    return df, df_bsw
+
+
+def write_replicate_weights(cache_dir, weight_col='WeightD', chunk_records=50000):
+    """Write the engine weight matrix of a complete cache (see ReplicateEngine), chunk by chunk"""
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No columnar cache found in {cache_dir}")
+    main_weight = load_array(Path(cache_dir) / COLUMNS_DIR / f'{weight_col}.npy')
+    bsw = open_bsw_matrix(cache_dir)
+    n_records = manifest['n_records']
+    # Written under a temporary name and renamed, so readers never see a partial matrix
+    partial = Path(cache_dir) / f'{REPLICATE_WEIGHTS}.partial'
+    matrix = np.lib.format.open_memmap(partial, mode='w+', dtype=bsw.dtype, shape=(n_records, 1 + bsw.shape[1]))
+    for start in range(0, n_records, chunk_records):
+        block = matrix[start:start + chunk_records]
+        block[:, 0] = main_weight[start:start + chunk_records]
+        block[:, 1:] = bsw[start:start + chunk_records]
+        block[~(block > 0)] = 0
+    matrix.flush()
+    del matrix
+    os.replace(partial, Path(cache_dir) / REPLICATE_WEIGHTS)
+
+
+def open_replicate_weights(cache_dir):
+    """The engine weight matrix, memory-mapped read-only, or None if the cache does not have one"""
+    path = Path(cache_dir) / REPLICATE_WEIGHTS
+    return load_array(path) if path.exists() else None
+
+
+# Worker side of write_sas_cache: CaseID positions of the main file, built once per worker
+_case_positions = {}
+
+
+def _ingest_bsw_chunk(cache_dir, bsw_file, read_function, key, bootstrap_cols, dtype, offset, limit):
+    """Read one row chunk of the bootstrap weight file into its main-file rows of bsw.npy.
+
+    Returns the positions written (rows whose case ID is not in the main file are dropped,
+    as in the left merge)."""
+    import pyreadstat
+
+    chunk, _ = getattr(pyreadstat, read_function)(str(bsw_file), row_offset=offset, row_limit=limit,
+                                                  usecols=[key] + bootstrap_cols)
+    if cache_dir not in _case_positions:
+        _case_positions[cache_dir] = pd.Index(load_array(Path(cache_dir) / COLUMNS_DIR / 'CaseID.npy', mmap=False))
+    positions = _case_positions[cache_dir].get_indexer(chunk[key])
+    found = positions >= 0
+    matrix = np.lib.format.open_memmap(Path(cache_dir) / BSW_MATRIX, mode='r+')
+    matrix[positions[found]] = chunk.loc[found, bootstrap_cols].to_numpy(dtype=dtype)
+    matrix.flush()
+    return positions[found]
+
+
+def write_sas_cache(cache_dir, df, bsw_file, read_function='read_sas7bdat', workers=INGEST_WORKERS,
+                    chunk_rows=INGEST_CHUNK_ROWS, source=None, source_files=None):
+    """Write a cache from a main-file frame and a bootstrap weight file read in parallel row chunks.
+
+    Rows are matched on CaseID like merge_bootstrap_weights; main-file records without
+    bootstrap weights get NaN. read_function names the pyreadstat reader of bsw_file.
+    source_files is recorded in the manifest (see write_manifest)."""
+    import pyreadstat
+    from shs_engine import BSW_DTYPE, bootstrap_columns
+
+    if 'CaseID' not in df.columns:
+        raise ValueError("The main file has no CaseID column to match the bootstrap weights on")
+    read = getattr(pyreadstat, read_function)
+    _, meta = read(str(bsw_file), metadataonly=True)
+    key = 'caseid' if 'caseid' in meta.column_names else 'CaseID'
+    bootstrap_cols = bootstrap_columns(meta.column_names)
+    n_rows = meta.number_rows
+    if n_rows is None:
+        # Some formats (SAS transport) do not record the row count
+        n_rows = len(read(str(bsw_file), usecols=[key])[0])
+
+    columns = write_main_columns(cache_dir, df)
+    matrix = create_bsw_matrix(cache_dir, len(df), len(bootstrap_cols), BSW_DTYPE)
+    del matrix
+    chunks = [(offset, min(chunk_rows, n_rows - offset)) for offset in range(0, n_rows, chunk_rows)]
+    # The dtype is passed by name so that workers do not import shs_engine (and its kernel)
+    args = (str(cache_dir), str(bsw_file), read_function, key, bootstrap_cols, np.dtype(BSW_DTYPE).name)
+    workers = max(min(int(workers), len(chunks)), 1)
+    if workers == 1:
+        written = [_ingest_bsw_chunk(*args, offset, limit) for offset, limit in chunks]
+    else:
+        # spawn keeps workers independent of the (possibly multi-threaded) parent process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_ingest_bsw_chunk, *args, offset, limit) for offset, limit in chunks]
+            written = [future.result() for future in futures]
+    _case_positions.pop(str(cache_dir), None)
+
+    filled = np.zeros(len(df), dtype=bool)
+    for positions in written:
+        filled[positions] = True
+    if not filled.all():
+        matrix = np.lib.format.open_memmap(Path(cache_dir) / BSW_MATRIX, mode='r+')
+        matrix[~filled] = np.nan
+        matrix.flush()
+    return write_manifest(cache_dir, len(df), columns, bootstrap_cols, source, source_files)
@@ -0,0 +1,278 @@
+"""
+Registry of SHS PUMF releases, one dataset per survey year.
+
+Each year has its own sas7bdat files, columnar cache (columnar_cache.py) and
+expenditure hierarchy. A year is opened on first use from its columnar cache;
+if the cache does not exist yet it is built from the sas7bdat files first, so
+the files are parsed and merged once per year, not once per process. An open
+dataset is the memory-mapped main columns and a replicate engine over the
+cache's memory-mapped weight matrix, so switching to a year whose cache exists
+costs a few mmap calls. A cache whose manifest records different sizes or
+modification times for the sas7bdat files than those on disk is rebuilt.
+
+Open years that have not been used for SHS_DATASET_IDLE_SECONDS (default 1800)
+are closed, and at most SHS_MAX_OPEN_DATASETS (default 2) stay open, least
+recently used closed first. Years are found from the SHS_EDM_<year> folders and
+from caches named shs<year> under SHS_CACHE_DIR (default 'cache').
+SHS_DATA_CACHE points the default year at an existing cache instead.
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from columnar_cache import (
+    build_directory, cache_lock, load_columnar_cache, open_replicate_weights, read_manifest, replace_cache,
+    source_fingerprints, sources_changed, write_replicate_weights, write_sas_cache
+)
+from shs_engine import ReplicateEngine, compact_frame, merge_bootstrap_weights
+
+DEFAULT_YEAR = 2019
+CACHE_ROOT = Path(os.environ.get('SHS_CACHE_DIR', 'cache'))
+IDLE_SECONDS = float(os.environ.get('SHS_DATASET_IDLE_SECONDS', 1800))
+MAX_OPEN = int(os.environ.get('SHS_MAX_OPEN_DATASETS', 2))
+
+
+class DatasetSpec:
+    """Where one survey year's files live"""
+
+    def __init__(self, year, main_file, bsw_file, cache_dir, hierarchy_file):
+        self.year = year
+        self.main_file = Path(main_file)
+        self.bsw_file = Path(bsw_file)
+        self.cache_dir = Path(cache_dir)
+        self.hierarchy_file = Path(hierarchy_file)
+
+    @property
+    def sources(self):
+        return [self.main_file, self.bsw_file]
+
+    def current_manifest(self):
+        """Manifest of a complete cache built from the current sas7bdat files, else None"""
+        manifest = read_manifest(self.cache_dir)
+        if manifest is None or sources_changed(manifest.get('source_files'), self.sources):
+            return None
+        return manifest
+
+    @property
+    def cached(self):
+        return self.current_manifest() is not None
+
+    @property
+    def available(self):
+        return self.cached or (self.main_file.exists() and self.bsw_file.exists())
+
+
+def hierarchy_file(year, root='.'):
+    """hierarchy_structure.json for the default year, hierarchy_structure_<year>.json for the others"""
+    name = "hierarchy_structure.json" if year == DEFAULT_YEAR else f"hierarchy_structure_{year}.json"
+    return Path(root) / name
+
+
+def dataset_spec(year, root='.', cache_root=CACHE_ROOT):
+    """Spec for a year laid out like the 2019 release (SHS_EDM_<year>/Data/SAS/pumf_shs<year>*.sas7bdat)"""
+    data_dir = Path(root) / f"SHS_EDM_{year}" / "Data" / "SAS"
+    cache_dir = Path(cache_root) / f"shs{year}"
+    if year == DEFAULT_YEAR and os.environ.get('SHS_DATA_CACHE'):
+        cache_dir = Path(os.environ['SHS_DATA_CACHE'])
+    hierarchy = hierarchy_file(year, root)
+    if not hierarchy.exists():
+        # Until build_hierarchy.py has been run for a year, use the default year's hierarchy
+        hierarchy = hierarchy_file(DEFAULT_YEAR, root)
+    return DatasetSpec(year, data_dir / f"pumf_shs{year}.sas7bdat", data_dir / f"pumf_shs{year}_bsw.sas7bdat",
+                       cache_dir, hierarchy)
+
+
+def discover_datasets(root='.', cache_root=CACHE_ROOT):
+    """{year: spec} for every year with sas7bdat files or a columnar cache (always includes the default year)"""
+    years = {DEFAULT_YEAR}
+    for pattern, folder in ((r'SHS_EDM_(\d{4})', Path(root)), (r'shs(\d{4})', Path(cache_root))):
+        if folder.is_dir():
+            years.update(int(m.group(1)) for m in (re.fullmatch(pattern, p.name) for p in folder.iterdir()) if m)
+    specs = {year: dataset_spec(year, root, cache_root) for year in sorted(years)}
+    return {year: spec for year, spec in specs.items() if year == DEFAULT_YEAR or spec.available}
+
+
+class OpenDataset:
+    """One year's main columns, bootstrap weight names and replicate engine"""
+
+    def __init__(self, spec, df, bootstrap_cols, engine, source_files=None):
+        self.spec = spec
+        self.df = df
+        self.bootstrap_cols = bootstrap_cols
+        self.engine = engine
+        self.source_files = source_files  # fingerprints of the sas7bdat files it was read from
+        self.last_used = time.time()
+
+    @property
+    def stale(self):
+        return sources_changed(self.source_files, self.spec.sources)
+
+    @property
+    def year(self):
+        return self.spec.year
+
+
+class DatasetRegistry:
+    """Datasets opened on demand and shared by every session (or request) of a process"""
+
+    def __init__(self, specs=None, max_open=MAX_OPEN, idle_seconds=IDLE_SECONDS, workers=None):
+        self.specs = dict(specs) if specs is not None else discover_datasets()
+        self.max_open = max(int(max_open), 1)
+        self.idle_seconds = idle_seconds
+        self.workers = workers
+        self._open = OrderedDict()
+        self._main_frames = {}  # parsed main files of years whose cache is still being built
+        self._cached_frames = {}  # {year: (manifest, main columns)} mapped from caches by main_frame
+        self._lock = threading.Lock()
+        self._year_locks = {year: threading.Lock() for year in self.specs}
+        # Held while a year's main file is parsed, so the script thread and the open job parse it once
+        self._parse_locks = {year: threading.Lock() for year in self.specs}
+
+    def years(self):
+        return list(self.specs)
+
+    def spec(self, year):
+        if year not in self.specs:
+            raise ValueError(f"No SHS dataset for {year}; available years: {', '.join(map(str, self.specs))}")
+        return self.specs[year]
+
+    def get(self, year):
+        """The open dataset for a year, or None if it is not open (yet, or any more)"""
+        with self._lock:
+            dataset = self._open.get(year)
+            if dataset is not None:
+                dataset.last_used = time.time()
+                self._open.move_to_end(year)
+        if dataset is not None and dataset.stale:
+            # Its sas7bdat files were replaced: close it so the next open rebuilds the cache
+            self.evict(year)
+            dataset = None
+        self.evict_idle(keep=year)
+        return dataset
+
+    def open(self, year):
+        """Open a year, building its columnar cache first if needed"""
+        dataset = self.get(year)
+        if dataset is not None:
+            return dataset
+        spec = self.spec(year)
+        with self._year_locks[year]:
+            dataset = self.get(year)
+            if dataset is None:
+                dataset = self._load(spec)
+                with self._lock:
+                    self._open[year] = dataset
+                    self._main_frames.pop(year, None)
+                    self._cached_frames.pop(year, None)
+        self.evict_idle(keep=year)
+        return dataset
+
+    def main_frame(self, year):
+        """A year's main-file columns, without waiting for its bootstrap weights"""
+        dataset = self.get(year)
+        if dataset is not None:
+            return dataset.df
+        spec = self.spec(year)
+        manifest = spec.current_manifest()
+        if manifest is not None:
+            # Mapped once per cache, not on every rerun; a rebuilt cache has a new manifest
+            with self._lock:
+                cached = self._cached_frames.get(year)
+            if cached is not None and cached[0] == manifest:
+                return cached[1]
+            df = load_columnar_cache(spec.cache_dir)[0]
+            with self._lock:
+                self._cached_frames[year] = (manifest, df)
+            return df
+        return self._parsed_main_file(spec)
+
+    def evict(self, year):
+        """Close an open year; its arrays are unmapped once no caller holds them"""
+        with self._lock:
+            dataset = self._open.pop(year, None)
+            self._cached_frames.pop(year, None)
+        if dataset is not None:
+            dataset.engine.close()
+
+    def evict_idle(self, keep=None):
+        """Close years idle for longer than idle_seconds, then the least recently used beyond max_open"""
+        now = time.time()
+        with self._lock:
+            idle = [year for year, dataset in self._open.items()
+                    if year != keep and now - dataset.last_used > self.idle_seconds]
+            remaining = [year for year in self._open if year != keep and year not in idle]
+            surplus = max(len(self._open) - len(idle) - self.max_open, 0)
+        for year in idle + remaining[:surplus]:
+            self.evict(year)
+
+    def _load(self, spec):
+        if not spec.cached:
+            try:
+                self._build_cache(spec)
+            except OSError:
+                # Cache directory not writable: keep this process's merged copy in memory instead
+                fingerprints = source_fingerprints(spec.sources)
+                df, bootstrap_cols = self._read_sas(spec)
+                return OpenDataset(spec, df, bootstrap_cols, ReplicateEngine(df, bootstrap_cols, workers=self.workers),
+                                   fingerprints)
+        weights = open_replicate_weights(spec.cache_dir)
+        if weights is None:
+            try:
+                with cache_lock(spec.cache_dir):
+                    if open_replicate_weights(spec.cache_dir) is None:
+                        write_replicate_weights(spec.cache_dir)
+                weights = open_replicate_weights(spec.cache_dir)
+            except OSError:
+                pass
+        df, df_bsw = load_columnar_cache(spec.cache_dir)
+        if weights is None:
+            df, bootstrap_cols = merge_bootstrap_weights(df, df_bsw)
+        else:
+            bootstrap_cols = read_manifest(spec.cache_dir)['bootstrap_cols']
+        engine = ReplicateEngine(df, bootstrap_cols, workers=self.workers, weights=weights)
+        return OpenDataset(spec, df, bootstrap_cols, engine, read_manifest(spec.cache_dir).get('source_files'))
+
+    def _parsed_main_file(self, spec):
+        """A year's main file, parsed once however many threads ask for it before its dataset is open"""
+        import pyreadstat
+        with self._parse_locks[spec.year]:
+            with self._lock:
+                df = self._main_frames.get(spec.year)
+            if df is None:
+                df, _ = pyreadstat.read_sas7bdat(str(spec.main_file))
+                df = compact_frame(df)
+                with self._lock:
+                    self._main_frames[spec.year] = df
+        return df
+
+    def _read_sas(self, spec):
+        """Parse and merge a year's sas7bdat files in memory"""
+        import pyreadstat
+        df_bsw, _ = pyreadstat.read_sas7bdat(str(spec.bsw_file))
+        return merge_bootstrap_weights(self._parsed_main_file(spec), compact_frame(df_bsw))
+
+    def _build_cache(self, spec):
+        """Write a year's columnar cache (bootstrap weights streamed in chunks) and engine weight matrix,
+        replacing any stale one.
+
+        The cache is built in a temporary sibling directory and renamed into place, under a
+        lock shared with other processes (the app and the estimation service) using it."""
+        with cache_lock(spec.cache_dir):
+            if spec.cached:
+                return  # built by another process while this one waited
+            fingerprints = source_fingerprints(spec.sources)
+            df = self._parsed_main_file(spec)
+            build_dir = build_directory(spec.cache_dir)
+            try:
+                write_sas_cache(build_dir, df, spec.bsw_file,
+                                source=f"{spec.main_file.name} + {spec.bsw_file.name}", source_files=fingerprints)
+                write_replicate_weights(build_dir)
+                replace_cache(build_dir, spec.cache_dir)
+            except BaseException:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
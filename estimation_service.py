@@ -0,0 +1,287 @@
+"""
+Local HTTP estimation service for the Survey of Household Spending 2019.
+
+Loads the PUMF once, keeps the filter index and replicate engine warm in memory
+and answers JSON estimate requests:
+
+    POST /estimate
+    {"filters": {"Prov": ["35"]}, "income_range": [0, 100000],
+     "mode": "income_range", "codes": ["TC001", "FD001"], "year": 2019}
+
+mode is "income_range" (one domain) or "quintile" (five weighted income
+quintiles of the filtered domain; income_range is ignored, as in the app).
+Each result row carries its quality flag (release_rules.py). A malformed
+request (not a JSON object, an unknown mode or filter column, codes that are
+not a list of the dataset's spending codes) gets a 400 and any other failure,
+on /estimate or /health, a 500, both with a JSON "error" message.
+year is optional and picks a survey year from the dataset registry
+(datasets.py); other years are opened on first request and closed when idle.
+Identical requests that arrive while one is being computed share its result,
+and finished results are kept in an LRU cache.
+
+Run with:
+    python estimation_service.py --port 8765
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from datasets import DEFAULT_YEAR, DatasetRegistry
+from release_rules import quality_flags
+from shs_engine import ReplicateEngine, load_dataset, variable_exists
+
+MODES = ("income_range", "quintile")
+
+
+class EstimationService:
+    """Warm engine plus request coalescing and a result cache.
+
+    Serves either one engine or, with a registry, every survey year it knows."""
+
+    def __init__(self, engine=None, cache_size=256, registry=None, default_year=DEFAULT_YEAR):
+        self.engine = engine
+        self.registry = registry
+        self.default_year = default_year
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def engine_for(self, year):
+        """Engine for a survey year (opened through the registry if there is one)"""
+        if self.registry is not None:
+            return self.registry.open(year).engine
+        if year != self.default_year:
+            raise ValueError(f"This service only has {self.default_year} data")
+        return self.engine
+
+    def request_key(self, payload):
+        """Canonical form of a request, used for both coalescing and caching"""
+        if not isinstance(payload, dict):
+            raise ValueError("The request body must be a JSON object")
+        if not isinstance(payload.get('filters') or {}, dict):
+            raise ValueError("'filters' must be an object of column: values")
+        codes = payload.get('codes', [])
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            raise ValueError("'codes' must be a list of spending code strings")
+        filters = {
+            col: sorted(str(v) for v in (value if isinstance(value, list) else [value]))
+            for col, value in (payload.get('filters') or {}).items()
+            if value is not None and value != []
+        }
+        mode = payload.get('mode', 'income_range')
+        return json.dumps({
+            'filters': filters,
+            'income_range': payload.get('income_range') if mode == 'income_range' else None,
+            'mode': mode,
+            'codes': codes,
+            'year': int(payload['year']) if payload.get('year') is not None else self.default_year
+        }, sort_keys=True)
+
+    def estimate(self, payload):
+        """Return the (possibly cached or shared) result for a request payload"""
+        key = self.request_key(payload)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._compute(json.loads(key))
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if future.exception() is None:
+                    self._cache[key] = future.result()
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return result
+
+    def _compute(self, request):
+        codes = request['codes']
+        if not codes:
+            raise ValueError("'codes' must list at least one spending code")
+        if request['mode'] not in MODES:
+            raise ValueError(f"'mode' must be one of {', '.join(MODES)}")
+
+        engine = self.engine_for(request['year'])
+        unknown = [col for col in request['filters'] if col not in engine.index.bitmaps]
+        if unknown:
+            raise ValueError(f"Unknown filter column(s) {', '.join(unknown)}; "
+                             f"available: {', '.join(engine.index.bitmaps)}")
+        unknown = [code for code in codes if not variable_exists(engine.df, code)]
+        if unknown:
+            raise ValueError(f"Unknown spending code(s) {', '.join(unknown)}")
+        mask = engine.index.domain_mask(request['filters'], request['income_range'])
+        if request['mode'] == 'income_range':
+            estimates = engine.estimate(codes, mask)
+            return {
+                'n_records': int(mask.sum()),
+                'results': _rows(codes, estimates)
+            }
+
+        boundaries, labels = engine.quintile_labels(mask)
+        if boundaries is None:
+            return {'n_records': 0, 'boundaries': [], 'groups': []}
+        estimates = engine.estimate_groups(codes, labels, 5)
+        groups = []
+        for q in range(5):
+            groups.append({
+                'quintile': q + 1,
+                'n_records': int(estimates['n_records'][q]),
+                'results': _rows(codes, {key: value[q] for key, value in estimates.items()})
+            })
+        return {
+            'n_records': int((labels >= 0).sum()),
+            'boundaries': [float(b) for b in boundaries],
+            'groups': groups
+        }
+
+
+def _json_number(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _rows(codes, estimates):
+    quality = quality_flags(estimates['cv'], estimates['n_records'])
+    return [
+        {
+            'code': code,
+            'mean': _json_number(estimates['mean'][i]),
+            'variance': _json_number(estimates['variance'][i]),
+            'std_error': _json_number(estimates['std_error'][i]),
+            'cv': _json_number(estimates['cv'][i]),
+            'quality': str(quality[i])
+        }
+        for i, code in enumerate(codes)
+    ]
+
+
+def make_handler(service):
+    """Request handler class bound to one EstimationService"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _answer(self, respond):
+            """Send respond()'s body, or its error: 400 for a malformed request, 500 for anything else"""
+            try:
+                body = respond()
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            except Exception as e:
+                # Registry, cache or IO failures: answer rather than drop the connection
+                self._send(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+            self._send(200, body)
+
+        def _health(self):
+            engine = service.engine_for(service.default_year)
+            return {
+                'status': 'ok',
+                'year': service.default_year,
+                'years': service.registry.years() if service.registry else [service.default_year],
+                'records': len(engine.df),
+                'bootstrap_weights': engine.n_replicates
+            }
+
+        def _estimate(self):
+            start = time.perf_counter()
+            length = int(self.headers.get('Content-Length', 0))
+            result = service.estimate(json.loads(self.rfile.read(length) or b'{}'))
+            return dict(result, elapsed_ms=round((time.perf_counter() - start) * 1000, 2))
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._answer(self._health)
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path == '/estimate':
+                self._answer(self._estimate)
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def query_service(url, filters=None, income_range=None, mode='income_range', codes=(), year=None, timeout=30):
+    """Call a running estimation service (e.g. from the Streamlit app or a dashboard)"""
+    from urllib.request import Request, urlopen
+    payload = {
+        'filters': filters or {},
+        'income_range': list(income_range) if income_range is not None else None,
+        'mode': mode,
+        'codes': list(codes),
+        'year': year
+    }
+    request = Request(url.rstrip('/') + '/estimate', data=json.dumps(payload).encode('utf-8'),
+                      headers={'Content-Type': 'application/json'})
+    with urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SHS 2019 local estimation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=256)
+    parser.add_argument('--year', type=int, default=DEFAULT_YEAR, help="survey year for requests without one")
+    parser.add_argument('--main-file', help="serve only these sas7bdat files (with --bsw-file) instead of the registry")
+    parser.add_argument('--bsw-file')
+    args = parser.parse_args()
+    if bool(args.main_file) != bool(args.bsw_file):
+        parser.error("--main-file and --bsw-file go together")
+
+    print("Loading data...")
+    if args.main_file:
+        df, bootstrap_cols = load_dataset(args.main_file, args.bsw_file)
+        service = EstimationService(ReplicateEngine(df, bootstrap_cols), cache_size=args.cache_size,
+                                    default_year=args.year)
+    else:
+        registry = DatasetRegistry()
+        service = EstimationService(cache_size=args.cache_size, registry=registry, default_year=args.year)
+    engine = service.engine_for(args.year)
+    print(f"Loaded {len(engine.df):,} records with {engine.n_replicates} bootstrap weights.")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Per-stage timing and memory instrumentation.
+
+A StageLog records the named stages of one script run or one calculation job:
+wall time, CPU time, rows touched and memory. Every finished stage is also
+written as one JSON line to the 'shs.perf' logger, so latency distributions can
+be aggregated across sessions from the server logs.
+
+Memory is the change in resident set size over the stage plus the process's
+peak RSS. With SHS_PERF_TRACEMALLOC=1, tracemalloc also reports the peak of
+Python and numpy allocations during each stage (slower; stages should not nest).
+CPU time is for the whole process, so it includes the compiled kernel's threads
+and, on a shared server, other sessions' work.
+
+SHS_PERF_LOG chooses where the JSON lines go: 'stderr' (default), a file path,
+or 'off'.
+
+Profiling is opt-in (SHS_PROFILE=1, or ?profile=1 in the page URL) and wraps
+one calculation: cProfile writes a .prof file for pstats/snakeviz, and a stack
+sampler writes a .collapsed file (one "frame;frame;frame count" line per stack,
+the format flamegraph.pl, speedscope and py-spy use). Files go to
+SHS_PROFILE_DIR (default 'profiles') and are named after the filter signature.
+When profiling is off, calculations run unwrapped.
+"""
+
+import cProfile
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger('shs.perf')
+
+PERF_LOG = os.environ.get('SHS_PERF_LOG', 'stderr')
+TRACEMALLOC = os.environ.get('SHS_PERF_TRACEMALLOC', '') not in ('', '0')
+PROFILE_DIR = Path(os.environ.get('SHS_PROFILE_DIR', 'profiles'))
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+
+if not logger.handlers:
+    if PERF_LOG == 'off':
+        logger.addHandler(logging.NullHandler())
+    else:
+        handler = logging.StreamHandler(sys.stderr) if PERF_LOG == 'stderr' else logging.FileHandler(PERF_LOG)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+if TRACEMALLOC and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (None where it cannot be read)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where it cannot be read)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class StageLog:
+    """Timed stages of one script run or calculation job"""
+
+    def __init__(self, run, **context):
+        self.run = run
+        self.context = context
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time the enclosed block; the yielded record's 'rows' can be set inside it"""
+        record = {'stage': name, 'rows': rows}
+        rss_before = rss_mb()
+        if tracemalloc.is_tracing():
+            traced_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['wall_ms'] = (time.perf_counter() - wall_start) * 1000
+            record['cpu_ms'] = (time.process_time() - cpu_start) * 1000
+            rss_after = rss_mb()
+            record['rss_delta_mb'] = rss_after - rss_before if rss_after is not None and rss_before is not None else None
+            record['peak_rss_mb'] = peak_rss_mb()
+            if tracemalloc.is_tracing():
+                record['alloc_peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_before) / 2**20
+            self.stages.append(record)
+            logger.info(json.dumps(dict({'event': 'stage', 'run': self.run, 'ts': time.time()},
+                                        **self.context, **record), default=str))
+
+    @property
+    def total_ms(self):
+        return sum(record['wall_ms'] for record in self.stages)
+
+
+def profiling_enabled(query_params=None):
+    """True when SHS_PROFILE is set or the page was opened with ?profile=1"""
+    if os.environ.get('SHS_PROFILE', '') not in ('', '0'):
+        return True
+    return query_params is not None and str(query_params.get('profile', '')).lower() in ('1', 'true', 'yes')
+
+
+def request_signature(kind, filters, income_range=None):
+    """File-name-safe tag for a calculation: kind, the filters in readable form and a short hash"""
+    canonical = json.dumps({
+        'filters': {col: sorted(str(v) for v in (value if isinstance(value, list) else [value]))
+                    for col, value in sorted(filters.items()) if value not in (None, [])},
+        'income_range': list(income_range) if income_range is not None else None
+    }, sort_keys=True)
+    readable = "_".join(f"{col}-{'+'.join(values)}" for col, values in json.loads(canonical)['filters'].items())
+    if income_range is not None:
+        readable += f"_inc-{income_range[0]:.0f}-{income_range[1]:.0f}"
+    readable = re.sub(r'[^A-Za-z0-9_+-]', '', readable)[:80] or "all"
+    return f"{kind}_{readable}_{hashlib.sha1(canonical.encode()).hexdigest()[:8]}"
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval and counts identical stacks"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(name='shs-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile_call(path_stem, fn, *args, **kwargs):
+    """Run fn under cProfile and the stack sampler; writes <path_stem>.prof and <path_stem>.collapsed.
+
+    Only one cProfile can be active per process on Python 3.12+, so a calculation
+    that overlaps another profiled one gets the sampled stacks only."""
+    Path(path_stem).parent.mkdir(parents=True, exist_ok=True)
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    try:
+        profiler.enable()
+    except ValueError:
+        profiler = None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{path_stem}.prof")
+        sampler.stop()
+        sampler.write_collapsed(f"{path_stem}.collapsed")
+        logger.info(json.dumps({'event': 'profile', 'ts': time.time(), 'path': str(path_stem),
+                                'pstats': profiler is not None, 'samples': sum(sampler.counts.values())}))
+
+
+def profiled(fn, path_stem):
+    """fn wrapped so that each call is profiled into path_stem (for submitting as a job)"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return profile_call(path_stem, fn, *args, **kwargs)
+    return wrapper
+
+
+def profile_path(kind, filters, income_range=None):
+    """Timestamped output path (without suffix) for one profiled calculation"""
+    return PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{request_signature(kind, filters, income_range)}"
@@ -0,0 +1,131 @@
+"""
+Background job queue for long-running spending calculations.
+
+Quintile, full-hierarchy and batch runs are submitted as jobs to a local thread
+pool instead of running on the Streamlit script thread. Each job has an ID,
+reports its progress, can be cancelled, and keeps its result after it finishes
+so that a later script rerun can pick it up. The number of heavy jobs running
+at once is capped per process.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested"""
+
+
+class Job:
+    """State of one submitted calculation"""
+
+    def __init__(self, job_id, kind, heavy):
+        self.id = job_id
+        self.kind = kind
+        self.heavy = heavy
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+    def cancel(self):
+        """Ask the job to stop at its next progress report"""
+        self._cancel_requested.set()
+
+    def report(self, progress, message=None):
+        """Record progress (0 to 1); raises JobCancelled if cancellation was requested"""
+        if self.cancel_requested:
+            raise JobCancelled()
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+
+class JobManager:
+    """Thread pool that runs jobs and keeps their state and results"""
+
+    def __init__(self, max_workers=4, max_heavy_jobs=2, max_finished_jobs=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shs-job')
+        self._heavy_slots = threading.BoundedSemaphore(max_heavy_jobs)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.max_finished_jobs = max_finished_jobs
+
+    def submit(self, kind, fn, *args, heavy=True, **kwargs):
+        """Queue fn(job, *args, **kwargs) and return the new job's ID"""
+        with self._lock:
+            job = Job(f"{kind}-{next(self._ids)}", kind, heavy)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        """Job with this ID, or None if it is unknown or has been pruned"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job, fn, args, kwargs):
+        if job.heavy:
+            # A job cancelled while it waits for a heavy slot finishes without taking one
+            while not self._heavy_slots.acquire(timeout=0.1):
+                if job.cancel_requested:
+                    job.status = CANCELLED
+                    job.finished_at = time.time()
+                    return
+        try:
+            if job.cancel_requested:
+                job.status = CANCELLED
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            if job.heavy:
+                self._heavy_slots.release()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
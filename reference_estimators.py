@@ -0,0 +1,292 @@
+"""
+Reference estimators, frozen from the original app.py.
+
+These are the record-by-record pandas versions of calculate_weighted_mean,
+calculate_bootstrap_variance, filter_data and the quintile assignment that the
+app used before the replicate engine. They are slow on purpose and must not be
+optimised: check_equivalence.py compares every faster path against them.
+
+The weighted quantile, participation and per-person ratio estimators were added
+with the engine features, written in the same plain style: one subset, sort or
+sum per weight column.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def get_variable_value(df, var):
+    """Get the variable value, handling _C and _D versions.
+    If both _C and _D exist, sum them. Otherwise use the available version."""
+    var_c = var + '_C'
+    var_d = var + '_D'
+
+    has_c = var_c in df.columns
+    has_d = var_d in df.columns
+
+    if has_c and has_d:
+        # Both exist, sum them
+        return df[var_c].fillna(0) + df[var_d].fillna(0)
+    elif has_c:
+        # Only _C exists
+        return df[var_c]
+    elif has_d:
+        # Only _D exists
+        return df[var_d]
+    elif var in df.columns:
+        # Base variable exists (no _C or _D)
+        return df[var]
+    else:
+        # Variable doesn't exist
+        return pd.Series([np.nan] * len(df), index=df.index)
+
+
+def calculate_weighted_mean(df, var, weight_col='WeightD'):
+    """Calculate weighted mean for a variable, handling _C and _D versions"""
+    # Get the variable value (handling _C and _D)
+    var_values = get_variable_value(df, var)
+
+    # Filter out missing values
+    mask = var_values.notna() & (df[weight_col] > 0)
+    if mask.sum() == 0:
+        return np.nan
+
+    weighted_sum = (var_values.loc[mask] * df.loc[mask, weight_col]).sum()
+    total_weight = df.loc[mask, weight_col].sum()
+
+    if total_weight == 0:
+        return np.nan
+
+    return weighted_sum / total_weight
+
+
+def calculate_bootstrap_variance(df, var, weight_col='WeightD', bootstrap_cols=None):
+    """Calculate bootstrap variance using bootstrap weights, handling _C and _D versions"""
+    if bootstrap_cols is None or len(bootstrap_cols) == 0:
+        return np.nan
+
+    # Get variable values (handling _C and _D)
+    var_values = get_variable_value(df, var)
+
+    # Calculate estimate with main weight
+    mask = var_values.notna() & (df[weight_col] > 0)
+    if mask.sum() == 0:
+        return np.nan
+
+    weighted_sum = (var_values.loc[mask] * df.loc[mask, weight_col]).sum()
+    total_weight = df.loc[mask, weight_col].sum()
+
+    if total_weight == 0:
+        return np.nan
+
+    main_estimate = weighted_sum / total_weight
+
+    if np.isnan(main_estimate):
+        return np.nan
+
+    # Calculate estimates with each bootstrap weight
+    bootstrap_estimates = []
+    for bs_col in bootstrap_cols:
+        if bs_col in df.columns:
+            bs_mask = var_values.notna() & (df[bs_col] > 0)
+            if bs_mask.sum() > 0:
+                bs_weighted_sum = (var_values.loc[bs_mask] * df.loc[bs_mask, bs_col]).sum()
+                bs_total_weight = df.loc[bs_mask, bs_col].sum()
+                if bs_total_weight > 0:
+                    bs_estimate = bs_weighted_sum / bs_total_weight
+                    if not np.isnan(bs_estimate):
+                        bootstrap_estimates.append(bs_estimate)
+
+    if len(bootstrap_estimates) == 0:
+        return np.nan
+
+    # Bootstrap variance formula: sum((estimate_b - estimate_full)^2) / B
+    bootstrap_estimates = np.array(bootstrap_estimates)
+    variance = np.mean((bootstrap_estimates - main_estimate) ** 2)
+
+    return variance
+
+
+def filter_data(df, filters, income_range=None):
+    """Apply filters to the dataset"""
+    filtered_df = df.copy()
+
+    for var, value in filters.items():
+        if value is not None and var in filtered_df.columns:
+            if isinstance(value, list):
+                if len(value) > 0:
+                    filtered_df = filtered_df[filtered_df[var].isin(value)]
+            else:
+                filtered_df = filtered_df[filtered_df[var] == value]
+
+    # Apply income range filter if provided
+    if income_range is not None and 'HH_TotInc' in filtered_df.columns:
+        min_income, max_income = income_range
+        if min_income is not None:
+            filtered_df = filtered_df[filtered_df['HH_TotInc'] >= min_income]
+        if max_income is not None:
+            filtered_df = filtered_df[filtered_df['HH_TotInc'] <= max_income]
+
+    return filtered_df
+
+
+def estimate(df, var, bootstrap_cols, weight_col='WeightD'):
+    """Mean, variance, standard error and CV (%) the way the app's results table built them"""
+    mean_est = calculate_weighted_mean(df, var, weight_col)
+    variance = calculate_bootstrap_variance(df, var, weight_col, bootstrap_cols)
+    std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
+    cv = (std_error / mean_est * 100) if not np.isnan(mean_est) and mean_est != 0 else np.nan
+    return {'mean': mean_est, 'variance': variance, 'std_error': std_error, 'cv': cv}
+
+
+def assign_income_quintiles(filtered_df, income_col='HH_TotInc', weight_col='WeightD'):
+    """Quintile boundaries and the valid-income records with an Income_Quintile column (1-5).
+
+    Returns (None, empty frame) when no record has income and a positive weight."""
+    quintile_df = filtered_df.copy()
+
+    # Filter out missing income values
+    valid_income = quintile_df[income_col].notna() & (quintile_df[weight_col] > 0)
+    quintile_df = quintile_df[valid_income].copy()
+
+    if len(quintile_df) == 0:
+        return None, quintile_df
+
+    # Calculate weighted percentiles for quintile boundaries
+    # Sort by income
+    sorted_df = quintile_df.sort_values(income_col).copy()
+    sorted_df['cumsum_weight'] = sorted_df[weight_col].cumsum()
+    total_weight = sorted_df[weight_col].sum()
+
+    # Find quintile boundaries (20th, 40th, 60th, 80th percentiles)
+    quintile_boundaries = []
+    for percentile in [20, 40, 60, 80]:
+        target_weight = total_weight * (percentile / 100)
+        # Find the index where cumulative weight reaches or exceeds target
+        mask = sorted_df['cumsum_weight'] >= target_weight
+        if mask.any():
+            boundary_idx = mask.idxmax()
+            boundary_value = sorted_df.loc[boundary_idx, income_col]
+            quintile_boundaries.append(boundary_value)
+        else:
+            # If target weight is beyond all data, use max income
+            quintile_boundaries.append(sorted_df[income_col].max())
+
+    # Assign quintiles
+    def assign_quintile(income):
+        if pd.isna(income):
+            return None
+        if income <= quintile_boundaries[0]:
+            return 1
+        elif income <= quintile_boundaries[1]:
+            return 2
+        elif income <= quintile_boundaries[2]:
+            return 3
+        elif income <= quintile_boundaries[3]:
+            return 4
+        else:
+            return 5
+
+    quintile_df['Income_Quintile'] = quintile_df[income_col].apply(assign_quintile)
+    return quintile_boundaries, quintile_df
+
+
+def calculate_weighted_quantiles(df, var, probabilities, weight_col='WeightD'):
+    """Weighted quantiles of a variable: the value of the first record (in value order)
+    at which the cumulative weight reaches p of the total, as for the quintile boundaries"""
+    var_values = get_variable_value(df, var)
+    mask = var_values.notna() & (df[weight_col] > 0)
+    if mask.sum() == 0:
+        return [np.nan] * len(probabilities)
+
+    sorted_df = pd.DataFrame({'value': var_values.loc[mask], 'weight': df.loc[mask, weight_col]})
+    sorted_df = sorted_df.sort_values('value', kind='stable')
+    sorted_df['cumsum_weight'] = sorted_df['weight'].cumsum()
+    total_weight = sorted_df['weight'].sum()
+
+    quantiles = []
+    for p in probabilities:
+        reached = sorted_df['cumsum_weight'] >= total_weight * p
+        if reached.any():
+            quantiles.append(sorted_df.loc[reached.idxmax(), 'value'])
+        else:
+            quantiles.append(sorted_df['value'].max())
+    return quantiles
+
+
+def estimate_quantiles(df, var, probabilities, bootstrap_cols, weight_col='WeightD'):
+    """Quantile, bootstrap variance, standard error and CV (%) for each probability"""
+    main = calculate_weighted_quantiles(df, var, probabilities, weight_col)
+    bootstrap_estimates = [calculate_weighted_quantiles(df, var, probabilities, bs_col)
+                           for bs_col in bootstrap_cols if bs_col in df.columns]
+
+    results = []
+    for k, quantile in enumerate(main):
+        replicates = np.array([estimates[k] for estimates in bootstrap_estimates if not np.isnan(estimates[k])])
+        if np.isnan(quantile) or len(replicates) == 0:
+            variance = np.nan
+        else:
+            variance = np.mean((replicates - quantile) ** 2)
+        std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
+        cv = (std_error / quantile * 100) if not np.isnan(quantile) and quantile != 0 else np.nan
+        results.append({'mean': quantile, 'variance': variance, 'std_error': std_error, 'cv': cv})
+    return results
+
+
+def estimate_participation(df, var, bootstrap_cols, weight_col='WeightD'):
+    """(participation rate, mean among reporting households) estimate dicts.
+
+    The rate is the weighted mean of a 0/1 indicator of a non-zero value over the
+    households with a value; the reporter mean is the ordinary estimate over the
+    households whose value is non-zero."""
+    var_values = get_variable_value(df, var)
+    indicator_df = df[[weight_col] + [col for col in bootstrap_cols if col in df.columns]].copy()
+    indicator_df['reported'] = (var_values != 0).astype(float).where(var_values.notna())
+    rate = estimate(indicator_df, 'reported', bootstrap_cols, weight_col)
+
+    reporters = df[var_values.notna() & (var_values != 0)]
+    return rate, estimate(reporters, var, bootstrap_cols, weight_col)
+
+
+def household_size(df, size_col='HHSize'):
+    """Household size, missing where it is missing or not positive"""
+    size = pd.to_numeric(df[size_col], errors='coerce')
+    return size.where(size > 0)
+
+
+def calculate_ratio(df, var, denominator, weight_col='WeightD'):
+    """Weighted sum of a variable over the weighted sum of a per-record denominator,
+    over the records where both are present"""
+    var_values = get_variable_value(df, var)
+    mask = var_values.notna() & denominator.notna() & (df[weight_col] > 0)
+    if mask.sum() == 0:
+        return np.nan
+
+    weighted_sum = (var_values.loc[mask] * df.loc[mask, weight_col]).sum()
+    denominator_sum = (denominator.loc[mask] * df.loc[mask, weight_col]).sum()
+
+    if denominator_sum == 0:
+        return np.nan
+
+    return weighted_sum / denominator_sum
+
+
+def estimate_ratio(df, var, denominator, bootstrap_cols, weight_col='WeightD'):
+    """Ratio (spending per person for household size), bootstrap variance, standard error and CV (%)"""
+    ratio = calculate_ratio(df, var, denominator, weight_col)
+
+    bootstrap_estimates = []
+    if not np.isnan(ratio):
+        for bs_col in bootstrap_cols:
+            if bs_col in df.columns:
+                bs_ratio = calculate_ratio(df, var, denominator, bs_col)
+                if not np.isnan(bs_ratio):
+                    bootstrap_estimates.append(bs_ratio)
+
+    if len(bootstrap_estimates) == 0:
+        variance = np.nan
+    else:
+        variance = np.mean((np.array(bootstrap_estimates) - ratio) ** 2)
+    std_error = np.sqrt(variance) if not np.isnan(variance) else np.nan
+    cv = (std_error / ratio * 100) if not np.isnan(ratio) and ratio != 0 else np.nan
+    return {'mean': ratio, 'variance': variance, 'std_error': std_error, 'cv': cv}
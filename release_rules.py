@@ -0,0 +1,161 @@
+"""
+Release rules for published estimates: quality flags, small-cell suppression
+and complementary suppression in hierarchy totals.
+
+Every rule works on whole arrays (one entry per estimate), so a results table of
+any size - every hierarchy code, every income group, every crosstab cell - is
+flagged with a few numpy operations and no per-row Python loop.
+
+Quality flags follow the Statistics Canada CV bands:
+
+    A   CV under 5%          excellent
+    B   5% to under 10%      very good
+    C   10% to under 15%     good
+    D   15% to under 25%     acceptable
+    E   25% to under 35%     use with caution
+    F   35% or more          too unreliable to be published
+
+An estimate from fewer than SHS_MIN_RECORDS (default 30) sample records is
+flagged x instead. F and x estimates are suppressed. So that a suppressed code
+cannot be recovered by subtracting its published siblings from their published
+parent, complementary suppression then also suppresses (flag x) the sibling with
+the smallest estimate, or the parent itself when the code has no sibling left.
+Tables that also add up across a row (income groups and their Total, crosstab
+cells and their margins) are protected along every dimension at once.
+"""
+
+import os
+
+import numpy as np
+
+from shs_metadata import BALANCE_PARENTS
+
+MIN_RECORDS = int(os.environ.get('SHS_MIN_RECORDS', 30))
+
+# Upper CV limits (%) of flags A to E; anything from the last limit up is F
+CV_BANDS = np.array([5.0, 10.0, 15.0, 25.0, 35.0])
+FLAGS = np.array(['A', 'B', 'C', 'D', 'E', 'F'])
+SUPPRESSED = ('F', 'x')
+
+
+def quality_flags(cv, n_records=None, min_records=MIN_RECORDS):
+    """Quality flag per estimate: A-F by CV band, x below min_records records, '' where the CV is undefined"""
+    cv = np.abs(np.asarray(cv, dtype=np.float64))
+    flags = np.where(np.isnan(cv), '', FLAGS[np.searchsorted(CV_BANDS, np.nan_to_num(cv), side='right')])
+    if n_records is not None:
+        flags = np.where(np.broadcast_to(np.asarray(n_records), cv.shape) < min_records, 'x', flags)
+    return flags
+
+
+def parent_positions(codes, hierarchy_data):
+    """Position of each code's parent total among codes (-1 when the parent is not among them).
+
+    Parents come from the hierarchy, or from BALANCE_PARENTS where it has none."""
+    var_to_node = hierarchy_data.get('var_to_node', {}) if hierarchy_data else {}
+    position = {code: i for i, code in enumerate(codes)}
+    parents = [var_to_node.get(code, {}).get('parent') or BALANCE_PARENTS.get(code) for code in codes]
+    return np.array([position.get(parent, -1) for parent in parents], dtype=np.intp)
+
+
+def complementary_suppression(suppressed, parents, sizes):
+    """Suppression pattern in which no suppressed code is the only suppressed child of a published parent.
+
+    parents gives each row's parent row (-1 for none) and sizes the estimates;
+    rows with a missing estimate are never chosen as complements. Each round
+    suppresses, for every exposed parent, its published child with the smallest
+    |estimate|, or the parent when it has no such child; rounds repeat until no
+    parent is exposed. When rows add up along several dimensions, parents is a
+    sequence of such arrays (one per dimension), protected in turn until none
+    changes the pattern. Returns a new boolean array."""
+    suppressed = np.array(suppressed, dtype=bool)
+    relations = np.atleast_2d(np.asarray(parents, dtype=np.intp))
+    sizes = np.abs(np.asarray(sizes, dtype=np.float64))
+    while True:
+        n_suppressed = np.count_nonzero(suppressed)
+        for parents in relations:
+            suppressed = _protect_parents(suppressed, parents, sizes)
+        if len(relations) == 1 or np.count_nonzero(suppressed) == n_suppressed:
+            return suppressed
+
+
+def _protect_parents(suppressed, parents, sizes):
+    """complementary_suppression along one parent relation (updates suppressed in place)"""
+    has_parent = parents >= 0
+    parent_of = np.where(has_parent, parents, 0)
+    while True:
+        suppressed_children = np.bincount(parents[has_parent & suppressed], minlength=len(suppressed))
+        exposed = (suppressed_children == 1) & ~suppressed
+        if not exposed.any():
+            return suppressed
+        candidates = np.flatnonzero(has_parent & exposed[parent_of] & ~suppressed & ~np.isnan(sizes))
+        candidates = candidates[np.lexsort((sizes[candidates], parents[candidates]))]
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = parents[candidates][1:] != parents[candidates][:-1]
+        complements = candidates[first]
+        suppressed[complements] = True
+        # A lone suppressed child with no published sibling equals its parent, so the parent goes instead
+        uncovered = exposed.copy()
+        uncovered[parents[complements]] = False
+        suppressed[uncovered] = True
+
+
+def flag_table(table, specs, suppress=False, parents=None, min_records=MIN_RECORDS, total=None):
+    """A copy of a results table with a quality flag column for each estimate and, optionally, suppression.
+
+    specs lists (flag column, CV column, estimate columns, records) for each
+    estimate in a row - one for a long table, one per group for a wide one.
+    records is a column name, a scalar or an array of sample counts. The flag
+    column is inserted after the CV column. With suppress, the estimate columns
+    of F and x estimates are blanked. Complementary suppression is applied first,
+    the first estimate column giving the sizes, and its complements are flagged
+    x: down each spec's rows with parents (see parent_positions, or a sequence
+    of parent arrays for rows that add up several ways), and across each row
+    with total, the position in specs of the row total of the other specs.
+    Without suppress the flags are the quality flags alone."""
+    table = table.copy()
+    flags = []
+    for flag_col, cv_col, value_cols, records in specs:
+        if isinstance(records, str):
+            records = table[records].to_numpy()
+        flags.append(quality_flags(table[cv_col].to_numpy(dtype=np.float64), records, min_records))
+    flags = np.array(flags, dtype=object).reshape(len(specs), len(table))
+    if suppress and (parents is not None or total is not None):
+        # Every estimate in the table is one cell, so both dimensions share a suppression pattern
+        cells = np.arange(flags.size).reshape(flags.shape)
+        relations = []
+        for relation in ([] if parents is None else np.atleast_2d(parents)):
+            relations.append(np.where(relation >= 0, cells[:, relation], -1))
+        if total is not None:
+            across = np.repeat(cells[total][None, :], len(specs), axis=0)
+            across[total] = -1
+            relations.append(across)
+        primary = np.isin(flags, SUPPRESSED)
+        sizes = np.array([table[value_cols[0]].to_numpy(dtype=np.float64) for _, _, value_cols, _ in specs])
+        pattern = complementary_suppression(primary.ravel(), [relation.ravel() for relation in relations],
+                                            sizes.ravel()).reshape(flags.shape)
+        flags = np.where(pattern & ~primary, 'x', flags)
+    for (flag_col, cv_col, value_cols, _), spec_flags in zip(specs, flags):
+        spec_flags = spec_flags.astype(str)
+        if suppress:
+            hidden = np.isin(spec_flags, SUPPRESSED)
+            for col in value_cols:
+                table[col] = table[col].astype(np.float64).mask(hidden)
+        table.insert(table.columns.get_loc(cv_col) + 1, flag_col, spec_flags)
+    return table
+
+
+def flag_legend(suppress=False, min_records=MIN_RECORDS):
+    """(flag, meaning) rows for a table note or an Excel section"""
+    rows = [
+        ("A", "CV under 5% (excellent)"),
+        ("B", "CV 5% to under 10% (very good)"),
+        ("C", "CV 10% to under 15% (good)"),
+        ("D", "CV 15% to under 25% (acceptable)"),
+        ("E", "CV 25% to under 35% (use with caution)"),
+        ("F", "CV 35% or more (too unreliable to be published)"),
+        ("x", f"fewer than {min_records} sample records"),
+    ]
+    if suppress:
+        rows[-1] = ("x", f"fewer than {min_records} sample records, or suppressed to protect another estimate")
+        rows.append(("", "F and x estimates are suppressed (left blank)."))
+    return rows
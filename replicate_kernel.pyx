@@ -0,0 +1,68 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled weighted reduction kernel for the replicate engine.
+
+For each group and each replicate weight column, sums w*y and w over records
+whose value is not missing. Weights must already have non-positive entries set
+to zero (as ReplicateEngine.weights does), which together give the exclusion
+rule of calculate_weighted_mean. Runs without the GIL and spreads replicate columns
+over OpenMP threads, so several app threads can reduce the same shared arrays
+concurrently without copying them.
+"""
+
+import numpy as np
+cimport openmp
+from cython.parallel cimport prange
+from libc.math cimport isnan
+
+# Replicate weights may be stored as float32 or float64; sums are always float64
+ctypedef fused weight_t:
+    float
+    double
+
+
+# Replicate columns per thread work item; each item walks the records once
+cdef enum:
+    COLUMN_CHUNK = 32
+
+
+def grouped_sums(const double[:, ::1] values, const weight_t[:, ::1] weights,
+                 const Py_ssize_t[::1] labels, Py_ssize_t n_groups,
+                 Py_ssize_t start, Py_ssize_t stop):
+    """Per-group sums of w*y and w for weight columns start:stop, shaped (groups, codes, columns)"""
+    cdef Py_ssize_t n = values.shape[0]
+    cdef Py_ssize_t k = values.shape[1]
+    cdef Py_ssize_t n_cols = stop - start
+    cdef Py_ssize_t n_chunks = (n_cols + COLUMN_CHUNK - 1) // COLUMN_CHUNK
+    num = np.zeros((n_groups, k, n_cols))
+    den = np.zeros((n_groups, k, n_cols))
+    cdef double[:, :, ::1] num_v = num
+    cdef double[:, :, ::1] den_v = den
+    cdef Py_ssize_t c, r, r0, r1, i, j, g
+    cdef double w, y
+
+    with nogil:
+        # Each thread owns whole chunks of replicate columns, so no two threads write the
+        # same sum, and every sum accumulates records in the same order on any thread count
+        for c in prange(n_chunks, schedule='static'):
+            r0 = c * COLUMN_CHUNK
+            r1 = r0 + COLUMN_CHUNK
+            if r1 > n_cols:
+                r1 = n_cols
+            for i in range(n):
+                g = labels[i]
+                if g >= 0 and g < n_groups:
+                    for j in range(k):
+                        y = values[i, j]
+                        if not isnan(y):
+                            for r in range(r0, r1):
+                                w = weights[i, start + r]
+                                num_v[g, j, r] += w * y
+                                den_v[g, j, r] += w
+
+    return num, den
+
+
+def set_num_threads(int n_threads):
+    """OpenMP threads for later grouped_sums calls in this process (pool workers use one each)"""
+    openmp.omp_set_num_threads(n_threads)
@@ -0,0 +1,752 @@
+"""
+Replicate estimation engine for the Survey of Household Spending 2019 PUMF.
+
+Holds the merged microdata as dense numpy arrays so that weighted means and
+their bootstrap variances for many spending codes and many domains come from
+a single matrix product instead of one pandas pass per variable per weight.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import warnings
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from statistics import NormalDist
+
+from shs_metadata import FILTER_VARIABLES
+
+# Data paths
+DATA_DIR = Path("SHS_EDM_2019/Data/SAS")
+MAIN_FILE = DATA_DIR / "pumf_shs2019.sas7bdat"
+BSW_FILE = DATA_DIR / "pumf_shs2019_bsw.sas7bdat"
+
+WEIGHT_COL = 'WeightD'
+INCOME_COL = 'HH_TotInc'
+HOUSEHOLD_SIZE_COL = 'HHSize'
+
+# Replicate weight columns (main weight + BSW) are reduced in fixed-size blocks.
+# Serial and parallel runs evaluate exactly the same blocks, so they agree bit for bit
+# (the compiled kernel sums each column in record order, so any column split agrees).
+REPLICATE_BLOCK_SIZE = 64
+
+# Domains smaller than this are reduced in-process even when workers are configured
+PARALLEL_MIN_RECORDS = 5000
+
+# |difference / SE| above this is reported as significant (two-sided test at the 5% level)
+SIGNIFICANCE_Z = 1.96
+
+# Compiled reduction kernel (replicate_kernel.pyx, built on first import via pyximport).
+# Falls back to numpy when Cython or a compiler is unavailable, or SHS_DISABLE_KERNEL is set.
+compiled_grouped_sums = None
+if not os.environ.get('SHS_DISABLE_KERNEL'):
+    try:
+        import pyximport
+        pyximport.install(language_level=3)
+        from replicate_kernel import grouped_sums as compiled_grouped_sums
+        from replicate_kernel import set_num_threads as set_kernel_threads
+    except Exception:
+        compiled_grouped_sums = None
+
+# Filter columns offered in the app (actual column names in the main file)
+FILTER_COLUMNS = list(FILTER_VARIABLES.values())
+
+# Load-time storage precision for spending and bootstrap weight columns (see compact_frame)
+SPENDING_DTYPE = os.environ.get('SHS_SPENDING_DTYPE', 'float64')
+BSW_DTYPE = os.environ.get('SHS_BSW_DTYPE', 'float32')
+
+# Spending variables: two letters and a 3-4 digit number, optionally with a _C or _D suffix
+SPENDING_COLUMN = re.compile(r'^[A-Z]{2}\d{3,4}(_[CD])?$')
+
+
+def load_dataset(main_file=MAIN_FILE, bsw_file=BSW_FILE):
+    """Read the main and bootstrap weight files and merge them on CaseID"""
+    import pyreadstat
+    df, meta = pyreadstat.read_sas7bdat(str(main_file))
+    df_bsw, meta_bsw = pyreadstat.read_sas7bdat(str(bsw_file))
+    return merge_bootstrap_weights(compact_frame(df), compact_frame(df_bsw))
+
+
+def compact_frame(df, spending_dtype=SPENDING_DTYPE, bsw_dtype=BSW_DTYPE):
+    """Apply the load-time schema to a main-file or bootstrap-file DataFrame.
+
+    Filter columns are stored as int8 codes, the integer form of their
+    VALUE_LABELS keys ("01" -> 1), so domain filters are int8 equality tests.
+    Spending columns are stored as spending_dtype and BSW columns as bsw_dtype.
+    WeightD, the income columns and CaseID are left unchanged.
+
+    Precision: float32 has unit roundoff u = 2**-24 (about 6e-8). Weights and
+    values are only rounded when stored; all sums are accumulated in float64,
+    and full-sample estimates always use the float64 WeightD. Rounding each
+    replicate weight by at most u moves a replicate mean by at most
+    u / (1 - u) times the weighted mean absolute deviation of the variable about
+    that mean, i.e. under $0.01 for any code whose values stay below about
+    $80,000 from the mean. Standard errors move by no more than the same amount.
+    Storing spending as float32 adds a relative error of at most u to each mean.
+    Returns a new frame; the input is left unchanged."""
+    dtypes = {}
+    filter_codes = {}
+    for col in df.columns:
+        if col in FILTER_COLUMNS:
+            codes = pd.to_numeric(df[col].astype(str).str.strip(), errors='coerce')
+            # Keep the column as read if any code is missing or not a small integer
+            if codes.notna().all() and codes.between(-128, 127).all():
+                filter_codes[col] = codes.astype(np.int8)
+        elif col.startswith('BSW'):
+            dtypes[col] = bsw_dtype
+        elif SPENDING_COLUMN.match(col) and pd.api.types.is_float_dtype(df[col]):
+            dtypes[col] = spending_dtype
+    compact = df.astype(dtypes) if dtypes else df.copy(deep=False)
+    for col, codes in filter_codes.items():
+        compact[col] = codes
+    return compact
+
+
+def merge_bootstrap_weights(df, df_bsw):
+    """Merge bootstrap weights into the main data and return (df, sorted BSW column names)"""
+    if df_bsw is None:
+        return df, []
+
+    # Main file uses 'CaseID', bootstrap file uses 'caseid'
+    if 'CaseID' in df.columns:
+        if 'caseid' in df_bsw.columns:
+            df = df.merge(df_bsw, left_on='CaseID', right_on='caseid', how='left')
+        elif 'CaseID' in df_bsw.columns:
+            df = df.merge(df_bsw, left_on='CaseID', right_on='CaseID', how='left')
+
+    return df, bootstrap_columns(df.columns)
+
+
+def bootstrap_columns(columns):
+    """BSW column names sorted numerically by the number after BSW"""
+    def sort_key(col):
+        try:
+            return int(col.replace('BSW', ''))
+        except ValueError:
+            return 0
+    return sorted([col for col in columns if col.startswith('BSW')], key=sort_key)
+
+
+def variable_exists(df, var):
+    """Check if variable exists in any form (base, _C, or _D)"""
+    return (var in df.columns or
+            (var + '_C') in df.columns or
+            (var + '_D') in df.columns)
+
+
+def get_variable_value(df, var):
+    """Get the variable value, handling _C and _D versions.
+    If both _C and _D exist, sum them. Otherwise use the available version."""
+    var_c = var + '_C'
+    var_d = var + '_D'
+
+    has_c = var_c in df.columns
+    has_d = var_d in df.columns
+
+    if has_c and has_d:
+        # Both exist, sum them
+        return df[var_c].fillna(0) + df[var_d].fillna(0)
+    elif has_c:
+        return df[var_c]
+    elif has_d:
+        return df[var_d]
+    elif var in df.columns:
+        # Base variable exists (no _C or _D)
+        return df[var]
+    else:
+        # Variable doesn't exist
+        return pd.Series([np.nan] * len(df), index=df.index)
+
+
+def normalize_code(value):
+    """Canonical string form of a filter code ("01", 1, 1.0 and np.int8(1) all map to "1")"""
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return str(int(number)) if number.is_integer() else text
+
+
+class FilterIndex:
+    """Packed bitmap per (filter column, value) so a domain is a few bitwise ANDs/ORs"""
+
+    def __init__(self, df, columns=FILTER_COLUMNS, income_col=INCOME_COL):
+        self.n = len(df)
+        self.bitmaps = {}
+        for col in columns:
+            if col not in df.columns:
+                continue
+            codes = df[col].to_numpy()
+            col_bitmaps = {}
+            for value in pd.unique(codes[pd.notna(codes)]):
+                col_bitmaps[normalize_code(value)] = np.packbits(codes == value)
+            self.bitmaps[col] = col_bitmaps
+        self.income = df[income_col].to_numpy(dtype=np.float64) if income_col in df.columns else None
+        self._all = np.packbits(np.ones(self.n, dtype=bool))
+        self._none = np.zeros_like(self._all)
+
+    def column_bitmap(self, col, value):
+        """Bitmap of records matching one filter value (a list means any of its values)"""
+        col_bitmaps = self.bitmaps[col]
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        bitmap = self._none
+        for v in values:
+            bitmap = bitmap | col_bitmaps.get(normalize_code(v), self._none)
+        return bitmap
+
+    def group_labels(self, col, groups, mask=None):
+        """Record labels for domains defined by values of one column: i where the record matches
+        groups[i] (a value or a list of values), -1 elsewhere or outside mask"""
+        labels = np.full(self.n, -1, dtype=np.intp)
+        for i, value in enumerate(groups):
+            rows = np.unpackbits(self.column_bitmap(col, value), count=self.n).astype(bool)
+            if mask is not None:
+                rows &= mask
+            if (labels[rows] >= 0).any():
+                raise ValueError(f"Groups {i + 1} and {labels[rows].max() + 1} of {col} overlap")
+            labels[rows] = i
+        return labels
+
+    def cross_labels(self, row_col, row_groups, col_col, col_groups, mask=None):
+        """(cell, row, column) labels of a two-way table; a cell is row * len(col_groups) + column.
+
+        Row and column labels are -1 for records outside the table, so they also give the margins."""
+        rows = self.group_labels(row_col, row_groups, mask)
+        cols = self.group_labels(col_col, col_groups, mask)
+        in_table = (rows >= 0) & (cols >= 0)
+        rows[~in_table] = -1
+        cols[~in_table] = -1
+        return np.where(in_table, rows * len(col_groups) + cols, -1), rows, cols
+
+    def domain_mask(self, filters, income_range=None):
+        """Boolean row mask equivalent to app.filter_data(df, filters, income_range)"""
+        bitmap = self._all
+        for col, value in (filters or {}).items():
+            if value is None or col not in self.bitmaps:
+                continue
+            if isinstance(value, (list, tuple, set)) and len(value) == 0:
+                continue
+            bitmap = bitmap & self.column_bitmap(col, value)
+        mask = np.unpackbits(bitmap, count=self.n).astype(bool)
+
+        if income_range is not None and self.income is not None:
+            min_income, max_income = income_range
+            if min_income is not None:
+                mask &= self.income >= min_income
+            if max_income is not None:
+                mask &= self.income <= max_income
+        return mask
+
+
+def income_quintiles(income, weights, n_groups=5):
+    """Weighted income quantile boundaries (quintiles by default) and 1-based group labels.
+
+    A boundary is the income of the first household (in income order) at which
+    the cumulative weight reaches k/n_groups of the total; households at or
+    below a boundary fall in the lower group."""
+    order = np.argsort(income, kind='stable')
+    sorted_income = income[order]
+    cumsum_weight = np.cumsum(weights[order])
+    total_weight = cumsum_weight[-1]
+
+    boundaries = []
+    for k in range(1, n_groups):
+        target_weight = total_weight * (k / n_groups)
+        idx = np.searchsorted(cumsum_weight, target_weight, side='left')
+        boundaries.append(sorted_income[min(idx, len(sorted_income) - 1)])
+    boundaries = np.array(boundaries)
+
+    labels = np.searchsorted(boundaries, income, side='left') + 1
+    return boundaries, labels
+
+
+def replicate_quantiles(sorted_values, weights, probabilities):
+    """Weighted quantiles of one variable under every weight column at once.
+
+    sorted_values holds the records' values in ascending order (no NaN) and
+    weights the same records in the same order, one column per weight and zero
+    where a record does not count. The cumulative weights of all columns come
+    from one cumsum, so the quantile under each weight is a count of cumulative
+    weights below its target instead of a sort per replicate. As in
+    income_quintiles, a quantile is the value of the first record at which the
+    cumulative weight reaches p of the total. Returns an array shaped
+    (len(probabilities), weight columns), NaN for columns with no positive weight."""
+    quantiles = np.full((len(probabilities), weights.shape[1]), np.nan)
+    if len(sorted_values) == 0:
+        return quantiles
+    cumsum_weight = np.array(weights, dtype=np.float64)
+    np.cumsum(cumsum_weight, axis=0, out=cumsum_weight)
+    total_weight = cumsum_weight[-1]
+    for k, p in enumerate(probabilities):
+        idx = np.count_nonzero(cumsum_weight < total_weight * p, axis=0)
+        quantiles[k] = np.where(total_weight > 0, sorted_values[np.minimum(idx, len(sorted_values) - 1)], np.nan)
+    return quantiles
+
+
+def estimates_from_sums(num, den):
+    """Turn replicate sums into means, bootstrap variances, standard errors and CVs.
+
+    num and den have the replicate axis last, with the main weight in position 0
+    and the bootstrap weights after it. Replicates with no positive weight are
+    left out of the variance, as in reference_estimators.calculate_bootstrap_variance."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        est = np.where(den > 0, num / np.where(den > 0, den, 1), np.nan)
+    mean = est[..., 0]
+    replicates = est[..., 1:]
+
+    variance = replicate_variance(replicates, mean)
+    with np.errstate(invalid='ignore'):
+        std_error = np.sqrt(variance)
+        cv = np.where((mean != 0) & ~np.isnan(mean), std_error / np.where(mean != 0, mean, 1) * 100, np.nan)
+
+    return {
+        'mean': mean,
+        'variance': variance,
+        'std_error': std_error,
+        'cv': cv,
+        'replicates': replicates
+    }
+
+
+def replicate_variance(replicates, full):
+    """Bootstrap variance: mean squared deviation of the replicate statistics from the full-sample one.
+
+    The replicate axis is last; NaN replicates (no positive weight) are left out."""
+    with np.errstate(invalid='ignore'):
+        sq_dev = (replicates - full[..., None]) ** 2
+        n_valid = np.sum(~np.isnan(sq_dev), axis=-1)
+        return np.where(n_valid > 0, np.nansum(sq_dev, axis=-1) / np.maximum(n_valid, 1), np.nan)
+
+
+def compare_groups(result, reference=0):
+    """Differences and ratios of each group's means against a reference group, with bootstrap SEs.
+
+    result comes from ReplicateEngine.estimate_values (groups first, replicate axis
+    last). Every group is estimated under the same bootstrap weights, so the SE of
+    a difference or ratio is the spread of the paired replicate differences or
+    ratios; no independence between the domains is assumed."""
+    mean = result['mean']
+    replicates = result['replicates']
+    base = mean[reference]
+    base_replicates = replicates[reference]
+    contrasts = difference_tests(result, [(g, reference) for g in range(len(mean))])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(base != 0, mean / np.where(base != 0, base, 1), np.nan)
+        ratio_replicates = np.where(base_replicates != 0, replicates / np.where(base_replicates != 0, base_replicates, 1),
+                                    np.nan)
+        ratio_se = np.sqrt(replicate_variance(ratio_replicates, ratio))
+    contrasts['ratio'] = ratio
+    contrasts['ratio_se'] = ratio_se
+    return contrasts
+
+
+def difference_tests(result, pairs):
+    """Differences between the means of (group, other group) pairs, with paired bootstrap SEs and z tests.
+
+    Both groups of a pair are estimated under the same bootstrap weights, so the
+    SE is the spread of the replicate differences. Returns arrays shaped
+    (pairs, codes)."""
+    groups = np.array([g for g, _ in pairs], dtype=np.intp)
+    others = np.array([other for _, other in pairs], dtype=np.intp)
+    difference = result['mean'][groups] - result['mean'][others]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        difference_se = np.sqrt(replicate_variance(result['replicates'][groups] - result['replicates'][others],
+                                                   difference))
+        z = np.where(difference_se > 0, difference / np.where(difference_se > 0, difference_se, 1), np.nan)
+    return {
+        'difference': difference,
+        'difference_se': difference_se,
+        'z': z,
+        'significant': np.abs(np.nan_to_num(z)) > SIGNIFICANCE_Z
+    }
+
+
+def confidence_intervals(result, level=0.95):
+    """Normal-approximation (mean +/- z SE) and bootstrap percentile intervals from an estimate's replicates.
+
+    The percentile interval is read off the replicate means themselves, so it
+    can be asymmetric for skewed spending; NaN replicates are left out."""
+    z = NormalDist().inv_cdf((1 + level) / 2)
+    tail = (1 - level) / 2 * 100
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # groups with no replicate estimates give NaN
+        lower, upper = np.nanpercentile(result['replicates'], [tail, 100 - tail], axis=-1)
+    return {
+        'normal_lower': result['mean'] - z * result['std_error'],
+        'normal_upper': result['mean'] + z * result['std_error'],
+        'percentile_lower': lower,
+        'percentile_upper': upper
+    }
+
+
+def replicate_blocks(n_columns, block_size=REPLICATE_BLOCK_SIZE):
+    """(start, stop) column ranges of the fixed replicate block layout"""
+    return [(start, min(start + block_size, n_columns)) for start in range(0, n_columns, block_size)]
+
+
+def block_sums(values, weights, labels, n_groups, start, stop):
+    """Per-group sums of w*y and of w over non-missing values for weight columns start:stop"""
+    if compiled_grouped_sums is not None:
+        return compiled_grouped_sums(np.ascontiguousarray(values, dtype=np.float64), weights,
+                                     np.ascontiguousarray(labels, dtype=np.intp), n_groups, start, stop)
+    present = ~np.isnan(values)
+    y = np.where(present, values, 0.0)
+    present = present.astype(np.float64)
+    num = np.zeros((n_groups, values.shape[1], stop - start))
+    den = np.zeros((n_groups, values.shape[1], stop - start))
+    for g in range(n_groups):
+        rows = np.flatnonzero(labels == g)
+        if len(rows) == 0:
+            continue
+        w = weights[rows, start:stop]
+        num[g] = y[rows].T @ w
+        den[g] = present[rows].T @ w
+    return num, den
+
+
+# Arrays opened by a pool worker, keyed by path, so the weight matrix is mapped once per worker
+_worker_arrays = {}
+
+
+def _open_shared(path):
+    if path not in _worker_arrays:
+        _worker_arrays[path] = np.load(path, mmap_mode='r')
+    return _worker_arrays[path]
+
+
+def _init_worker():
+    """Pool initializer: one kernel thread per worker, since the pool already runs a block per process.
+
+    Setting OMP_NUM_THREADS here would come too late: unpickling this function
+    imports the module, which loads the kernel and its OpenMP runtime."""
+    if compiled_grouped_sums is not None:
+        set_kernel_threads(1)
+
+
+def _worker_block_sums(weights_path, values_path, labels_path, n_groups, start, stop):
+    """Pool task: attach to the memory-mapped arrays and reduce one replicate block"""
+    values = np.load(values_path, mmap_mode='r')
+    labels = np.load(labels_path, mmap_mode='r')
+    return block_sums(values, _open_shared(weights_path), labels, n_groups, start, stop)
+
+
+class ReplicateEngine:
+    """Weighted means with bootstrap variance for many codes and domains at once.
+
+    With workers > 1, replicate blocks of large domains are spread over a process
+    pool. Workers memory-map the weight matrix from a .npy file in shared memory
+    (/dev/shm where available) instead of receiving pickled DataFrames.
+
+    weights, if given, is that weight matrix already built (for example mapped
+    from a columnar cache, see columnar_cache.write_replicate_weights); df then
+    needs no BSW columns."""
+
+    def __init__(self, df, bootstrap_cols, weight_col=WEIGHT_COL, workers=None, weights=None):
+        self.df = df
+        self.bootstrap_cols = list(bootstrap_cols)
+        self.weight_col = weight_col
+        if weights is not None:
+            if weights.shape != (len(df), 1 + len(self.bootstrap_cols)):
+                raise ValueError(f"weights has shape {weights.shape}, expected "
+                                 f"{(len(df), 1 + len(self.bootstrap_cols))}")
+            self.weights = weights
+        else:
+            # Replicate weights keep the storage precision of the BSW columns (float32 by default);
+            # the main weight is also kept in float64 for the full-sample estimates
+            weight_dtype = np.result_type(*[df[col].dtype for col in self.bootstrap_cols]) if self.bootstrap_cols else np.float64
+            weights = df[[weight_col] + self.bootstrap_cols].to_numpy(dtype=weight_dtype)
+            # Records only count under a weight when that weight is positive
+            self.weights = np.ascontiguousarray(np.where(weights > 0, weights, weight_dtype.type(0)))
+        main_weight = df[weight_col].to_numpy(dtype=np.float64)
+        self.main_weight = np.where(main_weight > 0, main_weight, 0.0)
+        self.index = FilterIndex(df)
+        self._value_columns = {}
+        self._household_size = None
+        self._equivalised_income = {}
+        if workers is None:
+            workers = int(os.environ.get('SHS_REPLICATE_WORKERS', 1))
+        self.workers = max(int(workers), 1)
+        self._pool = None
+        self._shared_dir = None
+        self._pool_lock = threading.Lock()  # job threads and the estimation service share one engine
+
+    @property
+    def n_replicates(self):
+        return len(self.bootstrap_cols)
+
+    def values(self, codes):
+        """Value matrix (records x codes) with NaN where a code is missing"""
+        columns = []
+        for code in codes:
+            if code not in self._value_columns:
+                self._value_columns[code] = get_variable_value(self.df, code).to_numpy(dtype=np.float64)
+            columns.append(self._value_columns[code])
+        return np.column_stack(columns) if columns else np.empty((len(self.df), 0))
+
+    def replicate_sums(self, values, labels, n_groups):
+        """Per-group, per-replicate sums of w*y and of w over non-missing values.
+
+        labels assigns each record to a group 0..n_groups-1 (negative = excluded).
+        Returns (num, den) shaped (n_groups, n_codes, 1 + n_replicates)."""
+        blocks = replicate_blocks(self.weights.shape[1])
+        if self.workers > 1 and len(blocks) > 1 and np.count_nonzero(labels >= 0) >= PARALLEL_MIN_RECORDS:
+            partials = self._parallel_block_sums(values, labels, n_groups, blocks)
+        elif compiled_grouped_sums is not None:
+            # The kernel sums each column in record order whatever the column range, so one
+            # call over all columns matches the block layout exactly and uses every thread
+            partials = [block_sums(values, self.weights, labels, n_groups, 0, self.weights.shape[1])]
+        else:
+            partials = [block_sums(values, self.weights, labels, n_groups, start, stop) for start, stop in blocks]
+        num = np.concatenate([p[0] for p in partials], axis=-1)
+        den = np.concatenate([p[1] for p in partials], axis=-1)
+        if self.weights.dtype != np.float64:
+            # Full-sample estimates always use the float64 main weight
+            main_num, main_den = block_sums(values, self.main_weight[:, None], labels, n_groups, 0, 1)
+            num[..., 0] = main_num[..., 0]
+            den[..., 0] = main_den[..., 0]
+        return num, den
+
+    def _parallel_block_sums(self, values, labels, n_groups, blocks):
+        pool, shared_dir, weights_path = self._ensure_pool()
+        call_dir = tempfile.mkdtemp(dir=shared_dir)
+        try:
+            values_path = os.path.join(call_dir, 'values.npy')
+            labels_path = os.path.join(call_dir, 'labels.npy')
+            np.save(values_path, values)
+            np.save(labels_path, labels)
+            futures = [
+                pool.submit(_worker_block_sums, weights_path, values_path, labels_path,
+                                  n_groups, start, stop)
+                for start, stop in blocks
+            ]
+            return [future.result() for future in futures]
+        finally:
+            shutil.rmtree(call_dir, ignore_errors=True)
+
+    def _ensure_pool(self):
+        """(pool, shared directory, weights file), starting the pool on first use; exactly one per engine"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._start_pool()
+            return self._pool, self._shared_dir, self._weights_path
+
+    def _start_pool(self):
+        shm_root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self._shared_dir = tempfile.mkdtemp(prefix='shs-engine-', dir=shm_root)
+        self._weights_path = os.path.join(self._shared_dir, 'weights.npy')
+        np.save(self._weights_path, self.weights)
+        # spawn keeps workers independent of the (possibly multi-threaded) parent process
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker)
+        self._finalizer = weakref.finalize(self, _shutdown_pool, self._pool, self._shared_dir)
+
+    def close(self):
+        """Stop the worker pool and remove its shared files"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._finalizer()
+                self._pool = None
+                self._shared_dir = None
+
+    def estimate_values(self, values, labels, n_groups, participation=False, denominators=None):
+        """Estimates for an arbitrary value matrix over labelled groups.
+
+        With participation=True the same pass also gives, per code, the share of
+        households with a non-zero value (participation, a proportion) and the mean
+        among those households (reporter_mean), each with its bootstrap SE. An
+        indicator column per code is added to the value matrix: its weighted mean
+        is the participation rate, and the code's weighted sum over the
+        indicator's weighted sum is the reporter mean.
+
+        denominators ({name: per-record values}, such as household_size()) adds
+        ratio estimators: result[name] is each code's weighted sum over the
+        denominator's weighted sum (spending per person for household size), with
+        result[name + '_se'] and result[name + '_cv']. One column per denominator
+        is added; a code only gets its own pair of columns when its missing values
+        differ from the denominator's, so numerator and denominator always cover
+        the same households."""
+        n_codes = values.shape[1]
+        columns = [values]
+        if participation:
+            columns.append(np.where(np.isnan(values), np.nan, (values != 0).astype(np.float64)))
+        ratios = []
+        position = n_codes * (2 if participation else 1)
+        in_groups = labels >= 0
+        for name, denominator in (denominators or {}).items():
+            denominator = np.asarray(denominator, dtype=np.float64)
+            missing = np.isnan(values[in_groups]) != np.isnan(denominator[in_groups])[:, None]
+            mismatched = np.flatnonzero(missing.any(axis=0))
+            num_cols = np.arange(n_codes)
+            den_cols = np.full(n_codes, position)
+            columns.append(denominator[:, None])
+            position += 1
+            if len(mismatched):
+                both = ~np.isnan(values[:, mismatched]) & ~np.isnan(denominator)[:, None]
+                columns.append(np.where(both, values[:, mismatched], np.nan))
+                columns.append(np.where(both, denominator[:, None], np.nan))
+                num_cols[mismatched] = position + np.arange(len(mismatched))
+                den_cols[mismatched] = position + len(mismatched) + np.arange(len(mismatched))
+                position += 2 * len(mismatched)
+            ratios.append((name, num_cols, den_cols))
+        if len(columns) > 1:
+            values = np.hstack(columns)
+        num, den = self.replicate_sums(values, labels, n_groups)
+        result = estimates_from_sums(num[:, :n_codes], den[:, :n_codes])
+        for name, num_cols, den_cols in ratios:
+            ratio = estimates_from_sums(num[:, num_cols], num[:, den_cols])
+            result[name] = ratio['mean']
+            result[f'{name}_se'] = ratio['std_error']
+            result[f'{name}_cv'] = ratio['cv']
+        if participation:
+            indicators = slice(n_codes, 2 * n_codes)
+            rate = estimates_from_sums(num[:, indicators], den[:, indicators])
+            reporters = estimates_from_sums(num[:, :n_codes], num[:, indicators])
+            result['participation'] = rate['mean']
+            result['participation_se'] = rate['std_error']
+            result['reporter_mean'] = reporters['mean']
+            result['reporter_mean_se'] = reporters['std_error']
+            result['reporter_mean_cv'] = reporters['cv']
+        result['n_records'] = np.bincount(labels[labels >= 0], minlength=n_groups)[:n_groups]
+        return result
+
+    def estimate(self, codes, mask=None, participation=False, denominators=None):
+        """Estimates for spending codes over one domain (mask=None means all records)"""
+        return self.estimate_domain(self.values(codes), mask, participation, denominators)
+
+    def estimate_domain(self, values, mask=None, participation=False, denominators=None):
+        """Estimates for an arbitrary value matrix over one domain"""
+        labels = np.zeros(len(self.df), dtype=np.intp)
+        if mask is not None:
+            labels[~mask] = -1
+        result = self.estimate_values(values, labels, 1, participation, denominators)
+        return {key: value[0] for key, value in result.items()}
+
+    def estimate_groups(self, codes, labels, n_groups, participation=False, denominators=None):
+        """Estimates for spending codes in each of n_groups labelled domains"""
+        return self.estimate_values(self.values(codes), labels, n_groups, participation, denominators)
+
+    def estimate_quantiles(self, codes, probabilities, mask=None):
+        """Weighted quantiles (0.5 = median) of spending codes over one domain, with bootstrap SEs.
+
+        Records with a missing value are left out, as for the means. Each code is
+        sorted once and its replicate quantiles come from replicate_quantiles,
+        one replicate block at a time to bound memory. Returns quantile, variance,
+        std_error, cv (codes x probabilities), replicates (with the replicate
+        axis last) and n_records per code."""
+        probabilities = [float(p) for p in probabilities]
+        if any(not 0 < p < 1 for p in probabilities):
+            raise ValueError("Quantile probabilities must be between 0 and 1.")
+        n_columns = self.weights.shape[1]
+        estimates = np.full((len(codes), len(probabilities), n_columns), np.nan)
+        n_records = np.zeros(len(codes), dtype=np.int64)
+        for i, values in enumerate(self.values(codes).T):
+            present = ~np.isnan(values) if mask is None else mask & ~np.isnan(values)
+            rows = np.flatnonzero(present)
+            # One sort per code; every replicate block reuses the order
+            rows = rows[np.argsort(values[rows], kind='stable')]
+            sorted_values = values[rows]
+            n_records[i] = len(rows)
+            for start, stop in replicate_blocks(n_columns):
+                estimates[i, :, start:stop] = replicate_quantiles(sorted_values, self.weights[rows, start:stop],
+                                                                  probabilities)
+            if self.weights.dtype != np.float64:
+                # Full-sample estimates always use the float64 main weight
+                estimates[i, :, 0] = replicate_quantiles(sorted_values, self.main_weight[rows, None],
+                                                         probabilities)[:, 0]
+        quantile = estimates[..., 0]
+        replicates = estimates[..., 1:]
+        variance = replicate_variance(replicates, quantile)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std_error = np.sqrt(variance)
+            cv = np.where((quantile != 0) & ~np.isnan(quantile),
+                          std_error / np.where(quantile != 0, quantile, 1) * 100, np.nan)
+        return {
+            'quantile': quantile,
+            'variance': variance,
+            'std_error': std_error,
+            'cv': cv,
+            'replicates': replicates,
+            'n_records': n_records
+        }
+
+    def household_size(self):
+        """Persons per household, NaN where missing or not positive.
+
+        HHSize is top-coded in the PUMF (4 = 4 or more), so larger households count as 4."""
+        if self._household_size is None:
+            if HOUSEHOLD_SIZE_COL not in self.df.columns:
+                raise ValueError(f"{HOUSEHOLD_SIZE_COL} not found in the dataset.")
+            size = pd.to_numeric(self.df[HOUSEHOLD_SIZE_COL], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            with np.errstate(invalid='ignore'):
+                self._household_size = np.where(size > 0, size, np.nan)
+        return self._household_size
+
+    def adult_equivalents(self, elasticity=0.5):
+        """Household size ** elasticity: adult equivalents on the square-root scale by default"""
+        return self.household_size() ** float(elasticity)
+
+    def equivalised_income(self, elasticity=0.5):
+        """Household income divided by household size ** elasticity (0.5 = square-root scale, 1 = per capita).
+
+        Computed once per elasticity and kept with the engine."""
+        key = float(elasticity)
+        if key not in self._equivalised_income:
+            if self.index.income is None:
+                raise ValueError(f"Equivalised income needs {INCOME_COL} and {HOUSEHOLD_SIZE_COL} in the dataset.")
+            self._equivalised_income[key] = self.index.income / self.adult_equivalents(key)
+        return self._equivalised_income[key]
+
+    def quintile_labels(self, mask):
+        """Quintile boundaries and 0-based quintile labels within a domain"""
+        return self.income_group_labels(mask, 5)
+
+    def income_group_labels(self, mask, n_groups=5, boundaries=None, income=None):
+        """Income group boundaries and 0-based group labels within a domain.
+
+        Without boundaries the groups are weighted income quantiles of the domain
+        (quintiles, deciles, ...); with boundaries (ascending dollar amounts) there are
+        len(boundaries) + 1 bands, a household at a boundary falling in the lower band.
+        income ranks households by another income vector, such as equivalised_income().
+        Households with missing income or no positive main weight get label -1,
+        matching the app's quintile mode."""
+        income = self.index.income if income is None else income
+        weights = self.main_weight
+        labels = np.full(len(self.df), -1, dtype=np.intp)
+        valid = mask & ~np.isnan(income) & (weights > 0)
+        if not valid.any():
+            return None, labels
+        if boundaries is None:
+            boundaries, groups = income_quintiles(income[valid], weights[valid], n_groups)
+            labels[valid] = groups - 1
+        else:
+            boundaries = np.asarray(boundaries, dtype=np.float64)
+            labels[valid] = np.searchsorted(boundaries, income[valid], side='left')
+        return boundaries, labels
+
+    def income_band_labels(self, mask, edges, income=None):
+        """0-based band labels for an income sweep: band k holds income from edges[k] up to edges[k + 1].
+
+        Each band includes its lower edge and the last band also its upper edge, so
+        the bands cover the same households as the income range edges[0] to
+        edges[-1]. Records outside mask or the edges, or with missing income, get -1."""
+        income = self.index.income if income is None else income
+        edges = np.asarray(edges, dtype=np.float64)
+        n_bands = len(edges) - 1
+        labels = np.searchsorted(edges, income, side='right') - 1
+        labels[income == edges[-1]] = n_bands - 1
+        labels[~mask | (labels >= n_bands)] = -1  # NaN income sorts after the last edge
+        return labels.astype(np.intp, copy=False)
+
+
+def _shutdown_pool(pool, shared_dir):
+    pool.shutdown(wait=True)
+    shutil.rmtree(shared_dir, ignore_errors=True)
@@ -0,0 +1,629 @@
+"""
+Survey metadata shared by the app, the replicate engine and the helper scripts:
+value labels for the filter variables, their display names and the column each
+label set applies to, and the spending code tables (categories, descriptions,
+the TC001 balance items and their parent totals).
+
+Streamlit re-executes app.py on every interaction; tables defined here are built
+once per process when the module is first imported.
+"""
+
+# Value label mappings for filter variables
+VALUE_LABELS = {
+    'PROV': {
+        "10": "Newfoundland and Labrador",
+        "11": "Prince Edward Island",
+        "12": "Nova Scotia",
+        "13": "New Brunswick",
+        "24": "Quebec",
+        "35": "Ontario",
+        "46": "Manitoba",
+        "47": "Saskatchewan",
+        "48": "Alberta",
+        "59": "British Columbia",
+        "63": "Territorial capitals"
+    },
+    'HHTYPE6': {
+        "1": "One person household",
+        "2": "Couple without children",
+        "3": "Couple with children",
+        "4": "Couple with other related or unrelated persons",
+        "5": "Lone parent family with no additional persons",
+        "6": "Other household with related or unrelated persons"
+    },
+    'HHSIZE': {
+        "1": "1",
+        "2": "2",
+        "3": "3",
+        "4": "4 or more"
+    },
+    'P0TO4YN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'P5TO15YN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'P16TO29YN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'P30TO64YN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'P65TO74YN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'P75PLUSYN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'RP_AGEGRP': {
+        "01": "Less than 30 years",
+        "02": "30 to 39 years",
+        "03": "40 to 54 years",
+        "04": "55 to 64 years",
+        "05": "65 to 74 years",
+        "06": "75 years and over"
+    },
+    'RP_GENDER': {
+        "1": "Male",
+        "2": "Female"
+    },
+    'RP_MARSTAT': {
+        "1": "Married or common-law",
+        "2": "Single, never married",
+        "3": "Separated, widowed or divorced"
+    },
+    'RP_EDUC': {
+        "1": "Less than high school diploma or its equivalent",
+        "2": "High school diploma, high school equivalency certificate, or not stated",
+        "3": "Certificate or diploma from a trades school, college, CEGEP or other non-university educational institution",
+        "4": "University certificate or diploma",
+        "9": "Masked records (Prince Edward Island and the territorial capitals)"
+    },
+    'SPOUSEYN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'SP_AGEGRP': {
+        "01": "Less than 30 years",
+        "02": "30 to 39 years",
+        "03": "40 to 54 years",
+        "04": "55 to 64 years",
+        "05": "65 to 74 years",
+        "06": "75 years and over",
+        "96": "No spouse"
+    },
+    'SP_GENDER': {
+        "1": "Male",
+        "2": "Female",
+        "6": "No spouse"
+    },
+    'SP_EDUC': {
+        "1": "Less than high school diploma or its equivalent",
+        "2": "High school diploma, high school equivalency certificate, or not stated",
+        "3": "Certificate or diploma from a trades school, college, CEGEP or other non-university educational institution",
+        "4": "University certificate or diploma",
+        "6": "No spouse",
+        "9": "Masked records (Prince Edward Island and the territorial capitals)"
+    },
+    'DWELTYP': {
+        "1": "Single detached",
+        "2": "Double, row, terrace or duplex",
+        "3": "Apartment or other"
+    },
+    'TENURE': {
+        "1": "Owned with mortgage",
+        "2": "Owned without mortgage",
+        "3": "Rented"
+    },
+    'NUMBEDR': {
+        "1": "1",
+        "2": "2",
+        "3": "3",
+        "4": "4 or more"
+    },
+    'VEHICLEYN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'RECVEHYN': {
+        "1": "Yes",
+        "2": "No"
+    },
+    'HH_MAJINCSRC': {
+        "1": "Earnings (employment income)",
+        "2": "Investment income",
+        "3": "Government transfer payments",
+        "4": "Other income"
+    }
+}
+
+# Main-file column names of the filter variables, keyed by their VALUE_LABELS name
+FILTER_VARIABLES = {
+    'PROV': 'Prov',
+    'HHTYPE6': 'HHType6',
+    'HHSIZE': 'HHSize',
+    'DWELTYP': 'DwellTyp',
+    'TENURE': 'Tenure',
+    'RP_AGEGRP': 'RP_AgeGrp',
+    'RP_GENDER': 'RP_Gender',
+    'RP_MARSTAT': 'RP_MarStat',
+    'RP_EDUC': 'RP_Educ',
+    'SP_AGEGRP': 'SP_AgeGrp',
+    'SP_EDUC': 'SP_Educ',
+    'P0TO4YN': 'P0to4YN',
+    'P5TO15YN': 'P5to15YN',
+    'VEHICLEYN': 'VehicleYN',
+    'HH_MAJINCSRC': 'HH_MajIncSrc'
+}
+
+# Display names of the filter variables, as in the sidebar and the Excel exports
+FILTER_LABELS = {
+    'PROV': 'Province',
+    'HHTYPE6': 'Household type',
+    'HHSIZE': 'Household size',
+    'DWELTYP': 'Type of dwelling',
+    'TENURE': 'Dwelling tenure',
+    'RP_AGEGRP': 'Reference person - Age group',
+    'RP_GENDER': 'Reference person - Gender',
+    'RP_MARSTAT': 'Reference person - Marital status',
+    'RP_EDUC': 'Reference person - Education',
+    'SP_AGEGRP': 'Spouse - Age group',
+    'SP_EDUC': 'Spouse - Education',
+    'P0TO4YN': 'Presence of persons aged 0 to 4 years',
+    'P5TO15YN': 'Presence of persons aged 5 to 15 years',
+    'VEHICLEYN': 'Owned, leased or operated a vehicle',
+    'HH_MAJINCSRC': 'Household - Major source of income'
+}
+
+# Labels keyed by integer code ("01" -> 1), for filter columns stored as small-integer codes
+CODE_LABELS = {
+    var_name: {int(code): label for code, label in labels.items()}
+    for var_name, labels in VALUE_LABELS.items()
+}
+
+# Parent/aggregate variables that should be excluded from category totals (to avoid double-counting)
+# These are totals that include their subcategories
+PARENT_TOTALS = {
+    "FD001",  # Food expenditures (parent of all FD variables)
+    "FD003",  # Food purchased from stores (parent of store food items)
+    "FD990",  # Food purchased from restaurants (parent of FD991)
+    "FD991",  # Restaurant meals (parent of FD992-FD995)
+    "FD100",  # Bakery products (parent of FD101-FD108, FD112)
+    "FD200",  # Cereal grains and cereal products (parent of FD201-FD212)
+    "FD300",  # Fruit, fruit preparations and nuts (parent of FD301-FD316, FD330-FD382)
+    "FD400",  # Vegetables and vegetable preparations (parent of FD401-FD412, FD418, FD421, FD440-FD479)
+    "FD500",  # Dairy products and eggs (parent of FD501-FD505, FD520-FD525, FD540-FD541, FD550-FD555, FD570-FD572)
+    "FD600",  # Meat (parent of FD601-FD607, FD650-FD660)
+    "FD700",  # Fish and seafood (parent of FD701-FD706, FD720-FD724, FD730-FD732)
+    "FD800",  # Non-alcoholic beverages and other food products (parent of FD801-FD802, FD806, FD814-FD815, FD821, FD827-FD829, FD833-FD889)
+    "CS030",  # Communications (parent of CS003, CS004, CS005, etc.)
+    "HF001",  # Household furnishings and equipment (parent of HF002)
+    "HE001",  # Household equipment (parent of HE002, HE010, etc.)
+    "HC001",  # Health care (parent of HC002, HC022, etc.)
+    "HO001",  # Household operations (parent of HO002, HO003, etc.)
+    "PC001",  # Personal care (parent of PC002, PC020)
+    "RE001",  # Recreation (parent of RE002, RE003, etc.)
+    "RO001",  # Reading materials (parent of RO002, RO003, etc.)
+    "RV001",  # Recreational vehicles (parent of RV010, RV020)
+    "SH001",  # Shelter (parent of SH002, SH003, etc.)
+    "SH002",  # Shelter (another parent total)
+    "TR001",  # Transportation (parent of TR002, TR003, etc.)
+    "TR002",  # Transportation (another parent total)
+    "ME001",  # Miscellaneous expenditures (parent of ME039, ME040)
+    "TA018",  # Tobacco products, alcoholic beverages and cannabis (parent of TA005, TA006, TA007, TA008, TA990)
+    "TC001",  # Total current consumption (parent of all consumption)
+    "TE001"   # Total expenditure (parent of all expenditure)
+}
+
+# Spending category mappings (organized by major category prefix)
+# Excludes parent totals to avoid double-counting
+SPENDING_CATEGORIES = {
+    "Child Care": ["CC001"],
+    "Clothing": ["CL014", "CL015", "CL016", "CL017", "CL023", "CL026", "CL029", "CL030", "CL990"],
+    "Communications": ["CS003", "CS004", "CS005", "CS007", "CS008", "CS020", "CS021"],  # Excluded CS030 (parent)
+    "Education": ["ED002", "ED003", "ED030"],
+    "Personal Insurance": ["EP011"],
+    "Food": [
+        # Excluded parent totals: FD001, FD003, FD990, FD991, FD100, FD200, FD300, FD400, FD500, FD600, FD700, FD800
+        "FD1001", "FD1002", "FD1003", "FD1004", "FD101", "FD102", "FD103",
+        "FD104", "FD105", "FD106", "FD107", "FD108", "FD112", "FD201", "FD202", "FD203",
+        "FD204", "FD205", "FD206", "FD207", "FD208", "FD209", "FD212", "FD301", "FD302",
+        "FD303", "FD304", "FD305", "FD308", "FD309", "FD315", "FD316", "FD330", "FD331", "FD350",
+        "FD380", "FD381", "FD382", "FD401", "FD402", "FD403", "FD404", "FD405", "FD406",
+        "FD407", "FD408", "FD409", "FD410", "FD411", "FD412", "FD418", "FD421", "FD440", "FD441",
+        "FD442", "FD447", "FD470", "FD471", "FD478", "FD479", "FD501", "FD502", "FD503",
+        "FD504", "FD505", "FD520", "FD521", "FD522", "FD525", "FD540", "FD541", "FD550", "FD551",
+        "FD555", "FD570", "FD571", "FD572", "FD601", "FD602", "FD603", "FD604", "FD607",
+        "FD650", "FD651", "FD660", "FD701", "FD705", "FD706", "FD720", "FD721", "FD722",
+        "FD723", "FD724", "FD730", "FD731", "FD732", "FD801", "FD802", "FD806", "FD814",
+        "FD815", "FD821", "FD827", "FD828", "FD829", "FD833", "FD834", "FD835", "FD836", "FD837",
+        "FD838", "FD839", "FD840", "FD841", "FD842", "FD843", "FD844", "FD845", "FD846", "FD847",
+        "FD850", "FD851", "FD852", "FD853", "FD854", "FD855", "FD857", "FD870", "FD871", "FD872",
+        "FD873", "FD874", "FD875", "FD879", "FD880", "FD881", "FD882", "FD883", "FD884", "FD885",
+        "FD889", "FD992", "FD993", "FD994", "FD995"  # Restaurant subcategories (excluded FD990, FD991)
+    ],
+    "Games of Chance": ["GC001"],
+    "Health Care": ["HC002", "HC022", "HC025", "HC061"],  # Excluded HC001 (parent total)
+    "Household Equipment": ["HE002", "HE010", "HE017", "HE020"],  # Excluded HE001 (parent total)
+    "Household Furnishings": ["HF002"],  # Excluded HF001 (parent total)
+    "Household Operations": ["HO002", "HO003", "HO004", "HO005", "HO006", "HO010", "HO014", "HO018", "HO022"],  # Excluded HO001 (parent total)
+    "Miscellaneous": ["ME039", "ME040"],  # Excluded ME001 (parent total)
+    "Gifts and Contributions": ["MG001"],
+    "Personal Care": ["PC002", "PC020"],  # Excluded PC001 (parent total)
+    "Recreation": [
+        # Excluded RE001 (parent total)
+        "RE002", "RE003", "RE006", "RE007", "RE010", "RE016", "RE020", "RE022", "RE032",
+        "RE040", "RE041", "RE052", "RE060", "RE061", "RE062", "RE063", "RE066", "RE067", "RE074",
+        "RE090", "RE120", "RE124", "RE127", "RE140", "RE990"
+    ],
+    "Reading Materials": ["RO002", "RO003", "RO004", "RO005", "RO010"],  # Excluded RO001 (parent total)
+    "Recreational Vehicles": ["RV010", "RV020"],  # Excluded RV001 (parent total)
+    "Shelter": [
+        # Excluded SH001, SH002 (parent totals)
+        "SH003", "SH004", "SH010", "SH011", "SH015", "SH016", "SH019", "SH030",
+        "SH031", "SH032", "SH033", "SH034", "SH040", "SH041", "SH042", "SH044", "SH046", "SH047",
+        "SH050", "SH060", "SH061", "SH062", "SH082", "SH990", "SH991", "SH992"
+    ],
+    "Tobacco and Alcohol": ["TA005", "TA006", "TA007", "TA008", "TA990"],  # Excluded TA018 (parent total)
+    "Transportation": [
+        # Excluded TR001, TR002 (parent totals)
+        "TR003", "TR004", "TR008", "TR010", "TR020", "TR021", "TR022", "TR030",
+        "TR031", "TR033", "TR034", "TR036", "TR038", "TR039", "TR070", "TR071", "TR085"
+    ],
+    "Income Taxes": ["TX010"]
+}
+
+# Spending variable descriptions (from SAS labels)
+SPENDING_DESCRIPTIONS = {
+    "CC001": "Child care",
+    "CL014": "Laundromats, dry-cleaning and laundry services",
+    "CL015": "Services for clothing, footwear and jewellery",
+    "CL016": "Clothing services",
+    "CL017": "Clothing material, yarn, thread and other notions",
+    "CL023": "Children's wear (under 14 years)",
+    "CL026": "Men's and boys' wear (14 years and over)",
+    "CL029": "Women's and girls' wear (14 years and over)",
+    "CL030": "Clothing and accessories",
+    "CL990": "Accessories, watches, jewellery and athletic footwear",
+    "CS003": "Telephone",
+    "CS004": "Landline telephone services",
+    "CS005": "Cell phone and pager services",
+    "CS007": "Internet access services",
+    "CS008": "Digital services",
+    "CS020": "Postal, courier, delivery and other communication services",
+    "CS021": "Telephones and equipment",
+    "CS030": "Communications",
+    "ED002": "Education",
+    "ED003": "Tuition fees",
+    "ED030": "Textbooks and school supplies",
+    "EP011": "Personal insurance payments and pension contributions",
+    "FD001": "Food expenditures",
+    "FD003": "Food purchased from stores",
+    "FD100": "Bakery products",
+    "FD1001": "Frozen side dishes and other frozen prepared food",
+    "FD1002": "Other ready-to-serve prepared food",
+    "FD1003": "Cod, flounder, sole and haddock (fresh or frozen, uncooked)",
+    "FD1004": "Other oils and fats",
+    "FD101": "Bread and unsweetened rolls and buns",
+    "FD102": "Bread",
+    "FD103": "Unsweetened rolls and buns",
+    "FD104": "Cookies and crackers",
+    "FD105": "Cookies and sweet biscuits",
+    "FD106": "Crackers and crisp breads",
+    "FD107": "Other bakery products",
+    "FD108": "Other bakery products (except frozen)",
+    "FD112": "Frozen bakery products",
+    "FD200": "Cereal grains and cereal products",
+    "FD201": "Rice and rice mixes",
+    "FD202": "Rice",
+    "FD203": "Rice mixes",
+    "FD204": "Pasta products",
+    "FD205": "Pasta (fresh or dry)",
+    "FD206": "Pasta (canned)",
+    "FD207": "Pasta mixes",
+    "FD208": "Other cereal grains and cereal products",
+    "FD209": "Flour and flour-based mixes",
+    "FD212": "Breakfast cereal and other grain products (except infant)",
+    "FD300": "Fruit, fruit preparations and nuts",
+    "FD301": "Fresh fruit",
+    "FD302": "Apples (fresh)",
+    "FD303": "Bananas and plantains (fresh)",
+    "FD304": "Grapes (fresh)",
+    "FD305": "Peaches and nectarines (fresh)",
+    "FD308": "Pears (fresh)",
+    "FD309": "Berries (fresh)",
+    "FD315": "Citrus fruit (fresh)",
+    "FD316": "Other fruit (fresh)",
+    "FD330": "Preserved fruit and fruit preparations",
+    "FD331": "Fruit juice",
+    "FD350": "Other preserved fruit and fruit preparations",
+    "FD380": "Nuts and seeds",
+    "FD381": "Peanuts (shelled or unshelled)",
+    "FD382": "Other nuts and seeds",
+    "FD400": "Vegetables and vegetable preparations",
+    "FD401": "Fresh vegetables",
+    "FD402": "Potatoes (except sweet potatoes)",
+    "FD403": "Tomatoes (fresh)",
+    "FD404": "Lettuce (fresh)",
+    "FD405": "Cabbage (fresh)",
+    "FD406": "Carrots (fresh)",
+    "FD407": "Onions (fresh)",
+    "FD408": "Celery (fresh)",
+    "FD409": "Cucumber (fresh)",
+    "FD410": "Mushrooms (fresh)",
+    "FD411": "Broccoli (fresh)",
+    "FD412": "Other vegetables (fresh)",
+    "FD418": "Peppers (fresh)",
+    "FD421": "Fresh herbs",
+    "FD440": "Frozen and dried vegetables",
+    "FD441": "Potato products (frozen)",
+    "FD442": "Other frozen vegetables",
+    "FD447": "Dried vegetables and legumes",
+    "FD470": "Canned vegetables and other vegetable preparations",
+    "FD471": "Canned or bottled vegetables",
+    "FD478": "Ready-to-serve or ready-to-cook prepared salads and side dishes, fruit or vegetable based",
+    "FD479": "Vegetable juice (canned or bottled)",
+    "FD500": "Dairy products and eggs",
+    "FD501": "Cheese",
+    "FD502": "Cheddar cheese",
+    "FD503": "Mozzarella cheese",
+    "FD504": "Processed cheese",
+    "FD505": "Other cheeses",
+    "FD520": "Milk",
+    "FD521": "Fluid whole milk",
+    "FD522": "Fluid low-fat milk",
+    "FD525": "Skim and other fluid milk",
+    "FD540": "Butter",
+    "FD541": "Ice cream and ice milk (including novelties)",
+    "FD550": "Other dairy products",
+    "FD551": "Other processed milk products",
+    "FD555": "Other processed dairy products",
+    "FD570": "Eggs and other egg products",
+    "FD571": "Eggs",
+    "FD572": "Other egg products",
+    "FD600": "Meat",
+    "FD601": "Meat (except processed meat)",
+    "FD602": "Beef",
+    "FD603": "Pork",
+    "FD604": "Poultry",
+    "FD607": "Other meat and poultry",
+    "FD650": "Processed meat",
+    "FD651": "Bacon and ham",
+    "FD660": "Other processed meat",
+    "FD700": "Fish and seafood",
+    "FD701": "Fresh or frozen fish",
+    "FD705": "Salmon (fresh or frozen, uncooked)",
+    "FD706": "Other fish (fresh or frozen, uncooked)",
+    "FD720": "Canned fish or other preserved fish",
+    "FD721": "Tuna (canned)",
+    "FD722": "Salmon (canned)",
+    "FD723": "Other fish (canned or bottled)",
+    "FD724": "Cured fish",
+    "FD730": "Seafood and other marine products",
+    "FD731": "Shrimp and prawns",
+    "FD732": "Other seafood and marine products",
+    "FD800": "Non-alcoholic beverages and other food products",
+    "FD801": "Non-alcoholic beverages and beverage mixes",
+    "FD802": "Coffee and tea",
+    "FD806": "Non-alcoholic beverages",
+    "FD814": "Sugar and confectionery",
+    "FD815": "Sugar, syrups and sugar substitutes",
+    "FD821": "Candies and chocolates",
+    "FD827": "Margarine, oils and fats (excluding butter)",
+    "FD828": "Margarine",
+    "FD829": "Cooking and salad oils",
+    "FD833": "Condiments, spices and vinegars",
+    "FD834": "Mayonnaise, salad dressings and dips",
+    "FD835": "Pasta and pizza sauces (canned, bottled or dried)",
+    "FD836": "Other sauces and gravies (canned, bottled or dried)",
+    "FD837": "Dried herbs and spices",
+    "FD838": "Ketchup",
+    "FD839": "Other condiments (including vinegar)",
+    "FD840": "Pickled vegetables (including olives)",
+    "FD841": "Infant food",
+    "FD842": "Infant formula",
+    "FD843": "Infant cereals and biscuits",
+    "FD844": "Canned or bottled infant food",
+    "FD845": "Frozen prepared food",
+    "FD846": "Frozen dinners and entrees",
+    "FD847": "Frozen pizza",
+    "FD850": "Soup (except infant soup)",
+    "FD851": "Soup (chilled, frozen, canned or bottled)",
+    "FD852": "Soup (dried)",
+    "FD853": "Ready-to-serve prepared food",
+    "FD854": "Dinners and entrees (except frozen)",
+    "FD855": "Pizza (except frozen)",
+    "FD857": "Fish portions (pre-cooked and frozen)",
+    "FD870": "Other food preparations",
+    "FD871": "Peanut butter and other nut butters",
+    "FD872": "Honey",
+    "FD873": "Flavoured drink powders, crystals and syrups",
+    "FD874": "Non-dairy frozen ice treats",
+    "FD875": "Dessert powders",
+    "FD879": "Food seasonings (including table salt)",
+    "FD880": "Other materials for food preparation",
+    "FD881": "Tofu",
+    "FD882": "Other canned, bottled or dried meals",
+    "FD883": "Snack food",
+    "FD884": "Potato-based snack foods",
+    "FD885": "Other snack foods",
+    "FD889": "Other infant food (including frozen)",
+    "FD990": "Food purchased from restaurants",
+    "FD991": "Restaurant meals",
+    "FD992": "Restaurant dinners",
+    "FD993": "Restaurant lunches",
+    "FD994": "Restaurant breakfasts",
+    "FD995": "Restaurant snacks and beverages",
+    "GC001": "Games of chance",
+    "HC001": "Health care",
+    "HC002": "Direct costs to household",
+    "HC022": "Private health insurance plan premiums",
+    "HC025": "Accident or disability insurance premiums",
+    "HC061": "Private health and dental plan premiums",
+    "HE001": "Household equipment",
+    "HE002": "Household appliances",
+    "HE010": "Other household equipment",
+    "HE017": "Maintenance, rental, repairs and services related to household furnishings and equipment",
+    "HE020": "Services related to household furnishings and equipment",
+    "HF001": "Household furnishings and equipment",
+    "HF002": "Household furnishings",
+    "HO001": "Household operations",
+    "HO002": "Domestic and other custodial services (excluding child care)",
+    "HO003": "Pet expenses",
+    "HO004": "Pet food",
+    "HO005": "Purchase of pets and pet-related goods",
+    "HO006": "Veterinarian and other services",
+    "HO010": "Household cleaning supplies and equipment",
+    "HO014": "Paper, plastic and foil supplies",
+    "HO018": "Garden supplies and services",
+    "HO022": "Other household supplies",
+    "ME001": "Miscellaneous expenditures",
+    "ME039": "Financial services",
+    "ME040": "Other miscellaneous goods and services",
+    "MG001": "Gifts of money, support payments and charitable contributions",
+    "PC001": "Personal care",
+    "PC002": "Personal care products",
+    "PC020": "Personal care services",
+    "RE001": "Recreation",
+    "RE002": "Recreational equipment and related services",
+    "RE003": "Sports, athletic and recreation equipment",
+    "RE006": "Video game systems and accessories (excluding for computers)",
+    "RE007": "Art and craft materials",
+    "RE010": "Computer equipment and supplies",
+    "RE016": "Photographic goods and services",
+    "RE020": "Photographic services",
+    "RE022": "Collectors' items (e.g. stamps, coins)",
+    "RE032": "Other recreational equipment",
+    "RE040": "Home entertainment equipment and services",
+    "RE041": "Home entertainment equipment",
+    "RE052": "Home entertainment services",
+    "RE060": "Recreational services",
+    "RE061": "Entertainment",
+    "RE062": "Movie theatres",
+    "RE063": "Live sporting and performing arts events",
+    "RE066": "Admission fees to museums, zoos, and other sites",
+    "RE067": "Television and satellite radio services (including installation, service and pay TV charges)",
+    "RE074": "Package trips",
+    "RE090": "Use of recreational facilities and fees for other recreational activities",
+    "RE120": "Camcorders, cameras, parts, accessories and related equipment",
+    "RE124": "Sports, athletic and recreational equipment and related services",
+    "RE127": "Rental, maintenance and repairs of sports, athletic and recreational equipment",
+    "RE140": "Other recreational services",
+    "RE990": "Outdoor play equipment and children's toys",
+    "RO001": "Reading materials and other printed matter",
+    "RO002": "Newspapers",
+    "RO003": "Magazines and periodicals",
+    "RO004": "Books and E-Books (excluding school books)",
+    "RO005": "Maps, sheet music and other printed matter",
+    "RO010": "Services related to reading materials (e.g. photocopying, library fees)",
+    "RV001": "Recreational vehicles and associated services",
+    "RV010": "Operation of recreational vehicles",
+    "RV020": "Purchase of recreational vehicles",
+    "SH001": "Shelter",
+    "SH002": "Principal accommodation",
+    "SH003": "Rented living quarters",
+    "SH004": "Rent",
+    "SH010": "Owned living quarters",
+    "SH011": "Mortgage paid",
+    "SH015": "Homeowners' insurance premiums",
+    "SH016": "Other expenditures for owned living quarters",
+    "SH019": "Mortgage insurance premiums",
+    "SH030": "Water, fuel and electricity for principal accommodation",
+    "SH031": "Water and sewage",
+    "SH032": "Electricity",
+    "SH033": "Natural gas",
+    "SH034": "Other fuel",
+    "SH040": "Other accommodation",
+    "SH041": "Owned secondary residences",
+    "SH042": "Mortgage paid",
+    "SH044": "Insurance premiums",
+    "SH046": "Other expenses for owned secondary residences",
+    "SH047": "Other owned properties",
+    "SH050": "Accommodation away from home",
+    "SH060": "Communication and home security services (e.g. landline telephone, television, satellite radio and Internet)",
+    "SH061": "Property and school taxes, water and sewage charges",
+    "SH062": "Electricity and fuel (e.g. natural gas and wood)",
+    "SH082": "Repairs and maintenance",
+    "SH990": "Other expenses for rented living quarters",
+    "SH991": "Condominium fees, property taxes and school taxes",
+    "SH992": "All other expenses for the owned living quarters",
+    "TA005": "Alcoholic beverages",
+    "TA006": "Alcoholic beverages served on licensed premises and in restaurants",
+    "TA007": "Alcoholic beverages purchased from stores",
+    "TA008": "Self-made alcoholic beverages",
+    "TA018": "Tobacco products, alcoholic beverages and cannabis for non-medical use",
+    "TA990": "Tobacco products, smokers' supplies and cannabis for non-medical use",
+    "TR001": "Transportation",
+    "TR002": "Private transportation",
+    "TR003": "Private use automobiles, vans and trucks",
+    "TR004": "Purchase of automobiles, vans and trucks",
+    "TR008": "Accessories for automobiles, vans and trucks",
+    "TR010": "Fees for leased automobiles, vans and trucks",
+    "TR020": "Rented automobiles, vans and trucks",
+    "TR021": "Fees for rented vehicles (including insurance and mileage)",
+    "TR022": "Other expenses for rented automobiles, vans and trucks",
+    "TR030": "Automobile, van and truck operations",
+    "TR031": "Registration fees (including insurance if part of registration)",
+    "TR033": "Tires, batteries, and other parts and supplies for vehicles",
+    "TR034": "Maintenance and repairs of vehicles",
+    "TR036": "Gas and other fuels (all vehicles and tools)",
+    "TR038": "Parking (excluding parking fees included in rent and traffic and parking tickets)",
+    "TR039": "Drivers' licences and tests, and driving lessons",
+    "TR070": "Public transportation",
+    "TR071": "Vehicle operation, security and communication services",
+    "TR085": "Public and private vehicle insurance premiums",
+    "TX010": "Income taxes",
+    "TC001": "Total current consumption",
+    "TE001": "Total expenditure"
+}
+
+# Get all spending variables
+ALL_SPENDING_VARS = []
+for category, vars_list in SPENDING_CATEGORIES.items():
+    ALL_SPENDING_VARS.extend(vars_list)
+ALL_SPENDING_VARS = sorted(set(ALL_SPENDING_VARS))
+
+# Items to include - only the 19 specified expenditure categories
+# These are Level 2 categories plus totals that should balance with TC001
+ITEMS_FOR_TC001_BALANCE = {
+    # Totals
+    "TE001",   # Total expenditure
+    "TC001",   # Total current consumption
+    
+    # Level 2 expenditure categories
+    "FD001",   # Food expenditures
+    "SH001",   # Shelter
+    "HO001",   # Household operations
+    "HF001",   # Household furnishings and equipment
+    "CL030",   # Clothing and accessories
+    "TR001",   # Transportation
+    "HC001",   # Health care
+    "PC001",   # Personal care
+    "RE001",   # Recreation
+    "ED002",   # Education
+    "RO001",   # Reading materials and other printed matter
+    "TA018",   # Tobacco products, alcoholic beverages and cannabis for non-medical use
+    "GC001",   # Games of chance
+    "ME001",   # Miscellaneous expenditures
+    "TX010",   # Income taxes
+    "EP011",   # Personal insurance payments and pension contributions
+    "MG001"    # Gifts of money, support payments and charitable contributions
+}
+
+# No parent totals to exclude - we're using Level 2 categories directly
+PARENT_TOTALS_TO_EXCLUDE = set()
+
+# The Level 2 categories add up to TC001, and TC001, TX010, EP011 and MG001 to TE001;
+# hierarchy files do not always give these parents
+BALANCE_PARENTS = {
+    code: "TC001"
+    for code in ("FD001", "SH001", "HO001", "HF001", "CL030", "TR001", "HC001", "PC001", "RE001", "ED002",
+                 "RO001", "TA018", "GC001", "ME001")
+}
+BALANCE_PARENTS.update({code: "TE001" for code in ("TC001", "TX010", "EP011", "MG001")})
@@ -0,0 +1,242 @@
+"""
+Synthetic SHS-shaped PUMF for benchmarks and tests.
+
+Builds a main file and a bootstrap weight file with the same columns the app
+reads: CaseID, WeightD, the filter codes from VALUE_LABELS, HH_TotInc and the
+other income variables, every spending variable (with its _C/_D versions) from
+the SAS record layout, and BSW1 to BSW500. Spending is sparse and skewed, grows
+with income, and parent codes are the sums of their children in the expenditure
+hierarchy, so totals such as TC001 and TE001 behave like the real file.
+
+Scale 1 matches the real record count (7,930); larger scales are generated and
+written in chunks, so a 100x columnar cache never needs the whole file in memory.
+
+    python synthetic_pumf.py --scale 10 --format cache --out synthetic/x10
+    python synthetic_pumf.py --format xport --out synthetic/x1
+"""
+
+import argparse
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from shs_metadata import FILTER_VARIABLES, VALUE_LABELS
+
+LAYOUT_FILE = Path("SHS_EDM_2019/Reading cards/SAS/PUMF_SHS2019.lay")
+HIERARCHY_FILE = Path("hierarchy_structure.json")
+REAL_RECORD_COUNT = 7930  # pumf_shs2019 (User Guide, Table 1)
+N_REPLICATES = 500
+TOTAL_HOUSEHOLDS = 14_900_000  # approximate sum of WeightD
+
+# Layout names that the main file stores in mixed case (app columns, then the SAS format file)
+COLUMN_NAMES = dict(
+    FILTER_VARIABLES,
+    CASEID='CaseID', WEIGHTD='WeightD', HH_TOTINC='HH_TotInc',
+    RP_TOTINC='RP_TotInc', SP_TOTINC='SP_TotInc', OTH_TOTINC='Oth_TotInc',
+    P16TO29YN='P16to29YN', P30TO64YN='P30to64YN', P65TO74YN='P65to74YN', P75PLUSYN='P75plusYN',
+    SPOUSEYN='SpouseYN', SP_GENDER='SP_Gender', NUMBEDR='NumBedr', RECVEHYN='RecVehYN'
+)
+
+SPENDING_COLUMN = re.compile(r'^([A-Z]{2}\d{3,4})(_[CD])?$')
+COUPLE_TYPES = ("2", "3", "4")
+
+
+def read_layout(layout_file=LAYOUT_FILE):
+    """(name, is_character) for every variable in the SAS record layout"""
+    variables = []
+    for line in Path(layout_file).read_text().splitlines():
+        match = re.match(r'^@\s*\d+\s+(\w+)\s+(\$?)', line.strip())
+        if match:
+            variables.append((match.group(1), match.group(2) == '$'))
+    return variables
+
+
+def spending_layout(layout_file=LAYOUT_FILE):
+    """{base code: list of stored suffixes ('', '_C', '_D')} from the record layout"""
+    codes = {}
+    for name, is_char in read_layout(layout_file):
+        match = SPENDING_COLUMN.match(name)
+        if match and not is_char:
+            codes.setdefault(match.group(1), []).append(match.group(2) or '')
+    return codes
+
+
+def load_children(hierarchy_file=HIERARCHY_FILE):
+    """{code: distinct child codes} from the expenditure hierarchy.
+
+    Uses both children lists and parent links; Level 2 categories without a
+    parent are the components of TC001 (as in ITEMS_FOR_TC001_BALANCE)."""
+    if not Path(hierarchy_file).exists():
+        return {}
+    with open(hierarchy_file) as f:
+        var_to_node = json.load(f).get('var_to_node', {})
+    children = {code: list(dict.fromkeys(node.get('children', []))) for code, node in var_to_node.items()}
+    for code, node in var_to_node.items():
+        parent = node.get('parent') or ('TC001' if str(node.get('level')) == '2' else None)
+        if parent and parent != code and code not in children.setdefault(parent, []):
+            children[parent].append(code)
+    return children
+
+
+def _code_profiles(codes, seed):
+    """Per-code participation rate, typical amount and income elasticity (fixed for a seed)"""
+    rng = np.random.default_rng([seed, 0])
+    return {
+        code: (rng.uniform(0.05, 0.95), rng.lognormal(5.5, 1.2), rng.uniform(0.2, 0.9))
+        for code in codes
+    }
+
+
+def _filter_codes(rng, n):
+    """Filter variables as character codes, with spouse variables consistent with household type"""
+    columns = {}
+    for var, labels in VALUE_LABELS.items():
+        keys = [k for k in labels if k not in ("96", "6")] if var in ('SP_AGEGRP', 'SP_GENDER', 'SP_EDUC') else list(labels)
+        columns[COLUMN_NAMES[var]] = rng.choice(keys, n)
+    has_spouse = np.isin(columns[COLUMN_NAMES['HHTYPE6']], COUPLE_TYPES)
+    columns[COLUMN_NAMES['SPOUSEYN']] = np.where(has_spouse, "1", "2")
+    for var, no_spouse in (('SP_AGEGRP', "96"), ('SP_GENDER', "6"), ('SP_EDUC', "6")):
+        col = COLUMN_NAMES[var]
+        columns[col] = np.where(has_spouse, columns[col], no_spouse)
+    return columns
+
+
+def generate_chunk(start, n, scale=1.0, seed=2019, n_replicates=N_REPLICATES, missing_rate=0.0,
+                   layout=None, children=None, profiles=None):
+    """One block of synthetic records: (main DataFrame, BSW matrix of shape n x n_replicates)"""
+    layout = spending_layout() if layout is None else layout
+    children = load_children() if children is None else children
+    profiles = _code_profiles(sorted(layout), seed) if profiles is None else profiles
+    rng = np.random.default_rng([seed, 1, start])
+
+    data = {'CaseID': np.char.zfill(np.arange(start + 1, start + n + 1).astype(str), 6)}
+    mean_weight = TOTAL_HOUSEHOLDS / (REAL_RECORD_COUNT * scale)
+    data['WeightD'] = rng.lognormal(np.log(mean_weight) - 0.18, 0.6, n)
+    data.update(_filter_codes(rng, n))
+
+    rp_income = rng.lognormal(10.8, 0.8, n) * (rng.random(n) > 0.03)
+    sp_income = np.where(data[COLUMN_NAMES['SPOUSEYN']] == "1", rng.lognormal(10.5, 0.9, n), 0.0)
+    oth_income = rng.lognormal(9.0, 1.0, n) * (rng.random(n) < 0.2)
+    data.update(RP_TotInc=rp_income.round(2), SP_TotInc=sp_income.round(2), Oth_TotInc=oth_income.round(2))
+    income = rp_income + sp_income + oth_income
+    data['HH_TotInc'] = income.round(2)
+    relative_income = np.maximum(income, 5000.0) / 70000.0
+
+    # Leaves: sparse, skewed amounts that grow with income; parents: sums of their children
+    values = {}
+    for code in sorted(layout):
+        if any(child in layout for child in children.get(code, [])):
+            continue
+        participation, amount, elasticity = profiles[code]
+        spends = rng.random(n) < participation
+        values[code] = np.where(spends, rng.lognormal(np.log(amount), 0.9, n) * relative_income ** elasticity, 0.0)
+
+    def total(code):
+        if code not in values:
+            values[code] = sum((total(child) for child in children[code] if child in layout), np.zeros(n))
+        return values[code]
+
+    for code in sorted(layout):
+        total(code)
+
+    for code, suffixes in layout.items():
+        value = values[code].round(2)
+        if '_C' in suffixes and '_D' in suffixes:
+            share = np.where(rng.random(n) < 0.3, rng.random(n), 0.0)
+            part_d = (value * share).round(2)
+            data[code + '_C'], data[code + '_D'] = value - part_d, part_d
+        else:
+            for suffix in suffixes:
+                data[code + suffix] = value
+    if missing_rate > 0:
+        for name in data:
+            if SPENDING_COLUMN.match(name):
+                data[name] = np.where(rng.random(n) < missing_rate, np.nan, data[name])
+
+    # Bootstrap weights: Poisson(1) resampling multiplicities, so about 37% are zero
+    bsw = data['WeightD'][:, None] * rng.poisson(1.0, (n, n_replicates))
+    return pd.DataFrame(data), bsw
+
+
+def iter_chunks(scale=1.0, seed=2019, n_replicates=N_REPLICATES, missing_rate=0.0, chunk_records=20000):
+    """Yield (main DataFrame, BSW matrix) chunks covering round(7930 * scale) records"""
+    n_records = int(round(REAL_RECORD_COUNT * scale))
+    layout = spending_layout()
+    children = load_children()
+    profiles = _code_profiles(sorted(layout), seed)
+    for start in range(0, n_records, chunk_records):
+        n = min(chunk_records, n_records - start)
+        yield generate_chunk(start, n, scale, seed, n_replicates, missing_rate, layout, children, profiles)
+
+
+def generate_synthetic_pumf(scale=1.0, seed=2019, n_replicates=N_REPLICATES, missing_rate=0.0):
+    """In-memory (main DataFrame, bootstrap weight DataFrame), shaped like the two sas7bdat files"""
+    frames, matrices = zip(*iter_chunks(scale, seed, n_replicates, missing_rate))
+    df = pd.concat(frames, ignore_index=True)
+    bootstrap_cols = [f'BSW{b}' for b in range(1, n_replicates + 1)]
+    df_bsw = pd.DataFrame(np.vstack(matrices), columns=bootstrap_cols)
+    df_bsw.insert(0, 'caseid', df['CaseID'].to_numpy())
+    return df, df_bsw
+
+
+def write_cache(out_dir, scale=1.0, seed=2019, n_replicates=N_REPLICATES, missing_rate=0.0,
+                chunk_records=20000, bsw_dtype=np.float32):
+    """Stream a synthetic PUMF into a columnar cache (see columnar_cache.py) chunk by chunk"""
+    from columnar_cache import column_array, create_bsw_matrix, create_column_files, write_manifest
+    from shs_engine import compact_frame
+
+    n_records = int(round(REAL_RECORD_COUNT * scale))
+    files = matrix = None
+    position = 0
+    for df, bsw in iter_chunks(scale, seed, n_replicates, missing_rate, chunk_records):
+        df = compact_frame(df)
+        if files is None:
+            dtypes = {name: column_array(df[name]).dtype for name in df.columns}
+            files = create_column_files(out_dir, dtypes, n_records)
+            matrix = create_bsw_matrix(out_dir, n_records, n_replicates, bsw_dtype)
+        end = position + len(df)
+        for name, column in files.items():
+            column[position:end] = column_array(df[name])
+        matrix[position:end] = bsw
+        position = end
+    for column in files.values():
+        column.flush()
+    matrix.flush()
+    bootstrap_cols = [f'BSW{b}' for b in range(1, n_replicates + 1)]
+    return write_manifest(out_dir, n_records, files, bootstrap_cols,
+                          source=f"synthetic scale={scale} seed={seed}")
+
+
+def write_xport(out_dir, scale=1.0, seed=2019, n_replicates=N_REPLICATES, missing_rate=0.0):
+    """Write the main and bootstrap files as SAS transport files (readable with pyreadstat.read_xport)"""
+    import pyreadstat
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    df, df_bsw = generate_synthetic_pumf(scale, seed, n_replicates, missing_rate)
+    pyreadstat.write_xport(df, str(out_dir / "pumf_shs2019.xpt"), file_format_version=8)
+    pyreadstat.write_xport(df_bsw, str(out_dir / "pumf_shs2019_bsw.xpt"), file_format_version=8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SHS 2019 PUMF")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiple of the real record count (7,930)")
+    parser.add_argument('--seed', type=int, default=2019)
+    parser.add_argument('--replicates', type=int, default=N_REPLICATES)
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="share of spending values set to missing")
+    parser.add_argument('--format', choices=['cache', 'xport'], default='cache')
+    parser.add_argument('--out', required=True, help="output directory")
+    args = parser.parse_args()
+
+    if args.format == 'cache':
+        manifest = write_cache(args.out, args.scale, args.seed, args.replicates, args.missing_rate)
+        print(f"Wrote columnar cache with {manifest['n_records']:,} records to {args.out}")
+    else:
+        write_xport(args.out, args.scale, args.seed, args.replicates, args.missing_rate)
+        print(f"Wrote SAS transport files to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
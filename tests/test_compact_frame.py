@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+
+from shs_engine import compact_frame
+
+
+def test_compact_frame_leaves_its_input_unchanged():
+    df = pd.DataFrame({'Prov': ['35', '24'], 'FD001': [1.5, 2.5], 'BSW1': [100.0, 200.0], 'WeightD': [1.0, 2.0]})
+    original = df.copy()
+    compact = compact_frame(df, spending_dtype='float32', bsw_dtype='float32')
+    pd.testing.assert_frame_equal(df, original)
+    assert compact['Prov'].dtype == np.int8 and compact['Prov'].tolist() == [35, 24]
+    assert compact['FD001'].dtype == np.float32 and compact['BSW1'].dtype == np.float32
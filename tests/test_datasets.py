@@ -0,0 +1,113 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from columnar_cache import MANIFEST, source_fingerprints
+from datasets import DatasetRegistry, DatasetSpec
+from synthetic_pumf import write_cache
+
+
+@pytest.fixture
+def spec(tmp_path):
+    """A year whose cache was built from two (stand-in) sas7bdat files"""
+    main_file, bsw_file = tmp_path / 'main.sas7bdat', tmp_path / 'bsw.sas7bdat'
+    main_file.write_bytes(b'main')
+    bsw_file.write_bytes(b'bsw')
+    cache_dir = tmp_path / 'cache'
+    write_cache(cache_dir, scale=0.01, n_replicates=4)
+    manifest_path = cache_dir / MANIFEST
+    manifest = json.loads(manifest_path.read_text())
+    manifest['source_files'] = source_fingerprints([main_file, bsw_file])
+    manifest_path.write_text(json.dumps(manifest))
+    return DatasetSpec(2019, main_file, bsw_file, cache_dir, tmp_path / 'hierarchy.json')
+
+
+def test_main_frame_is_mapped_once(spec):
+    registry = DatasetRegistry({2019: spec})
+    assert spec.cached
+    assert registry.main_frame(2019) is registry.main_frame(2019)
+
+
+def test_replaced_source_file_makes_the_cache_stale(spec, monkeypatch):
+    registry = DatasetRegistry({2019: spec})
+    registry.main_frame(2019)
+    spec.main_file.write_bytes(b'a newer main file')
+    os.utime(spec.main_file, ns=(1, 1))
+    assert not spec.cached
+    parsed = pd.DataFrame({'CaseID': [1]})
+    monkeypatch.setattr(registry, '_parsed_main_file', lambda spec: parsed)
+    assert registry.main_frame(2019) is parsed
+
+
+def test_cache_without_its_source_files_is_current(spec):
+    spec.main_file.unlink()
+    spec.bsw_file.unlink()
+    assert spec.cached
+
+
+def test_main_file_is_parsed_once_by_concurrent_callers(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    import pyreadstat
+
+    calls = []
+
+    def slow_read(path):
+        calls.append(path)
+        time.sleep(0.2)
+        return pd.DataFrame({'CaseID': [1.0, 2.0], 'Prov': ['35', '24']}), None
+
+    monkeypatch.setattr(pyreadstat, 'read_sas7bdat', slow_read)
+    spec = DatasetSpec(2019, tmp_path / 'main.sas7bdat', tmp_path / 'bsw.sas7bdat', tmp_path / 'cache',
+                       tmp_path / 'hierarchy.json')
+    registry = DatasetRegistry({2019: spec})
+    frames = []
+    threads = [threading.Thread(target=lambda: frames.append(registry.main_frame(2019))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(frame is frames[0] for frame in frames)
+
+
+def test_concurrent_registries_build_the_cache_once(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    import datasets
+    from columnar_cache import write_manifest
+
+    main_file, bsw_file = tmp_path / 'main.sas7bdat', tmp_path / 'bsw.sas7bdat'
+    main_file.write_bytes(b'main')
+    bsw_file.write_bytes(b'bsw')
+    spec = DatasetSpec(2019, main_file, bsw_file, tmp_path / 'cache' / 'shs2019', tmp_path / 'hierarchy.json')
+    builds = []
+
+    def fake_write_sas_cache(cache_dir, df, bsw_file, source=None, source_files=None):
+        builds.append(cache_dir)
+        manifest = write_cache(cache_dir, scale=0.01, n_replicates=4)
+        time.sleep(0.2)
+        write_manifest(cache_dir, manifest['n_records'], manifest['columns'], manifest['bootstrap_cols'],
+                       source, source_files)
+
+    monkeypatch.setattr(datasets, 'write_sas_cache', fake_write_sas_cache)
+    monkeypatch.setattr(DatasetRegistry, '_parsed_main_file', lambda self, spec: None)
+    # Separate registries share no in-process locks, like the app and the estimation service
+    threads = [threading.Thread(target=DatasetRegistry({2019: spec})._build_cache, args=(spec,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert spec.cached and (spec.cache_dir / 'replicate_weights.npy').exists()
+    assert sorted(p.name for p in spec.cache_dir.parent.iterdir()) == ['shs2019', 'shs2019.lock']
+    # A replaced source file: the stale cache is rebuilt aside and swapped in
+    main_file.write_bytes(b'a newer main file')
+    assert not spec.cached
+    DatasetRegistry({2019: spec})._build_cache(spec)
+    assert len(builds) == 2 and spec.cached
+    assert sorted(p.name for p in spec.cache_dir.parent.iterdir()) == ['shs2019', 'shs2019.lock']
@@ -0,0 +1,82 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from estimation_service import EstimationService, make_handler
+from shs_engine import ReplicateEngine
+
+
+class BrokenRegistry:
+    def open(self, year):
+        raise OSError("cache directory unreadable")
+
+
+@pytest.fixture
+def post():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'WeightD': rng.uniform(50, 150, 100), 'FD001': rng.uniform(0, 100, 100),
+                       'Prov': rng.choice([24, 35], 100).astype(np.int8), 'HH_TotInc': rng.uniform(0, 1e5, 100)})
+    for b in range(1, 5):
+        df[f'BSW{b}'] = rng.uniform(50, 150, 100)
+    services = {'ok': EstimationService(ReplicateEngine(df, [f'BSW{b}' for b in range(1, 5)])),
+                'broken': EstimationService(registry=BrokenRegistry())}
+    servers = {name: ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service)) for name, service in services.items()}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def send(body=None, service='ok', path='/estimate'):
+        """POST body to path, or GET path without a body"""
+        request = Request(f"http://127.0.0.1:{servers[service].server_port}{path}",
+                          data=body.encode('utf-8') if body is not None else None)
+        try:
+            with urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    yield send
+    for server in servers.values():
+        server.shutdown()
+
+
+def test_estimate(post):
+    status, body = post(json.dumps({'filters': {'Prov': ['35']}, 'codes': ['FD001']}))
+    assert status == 200 and body['results'][0]['code'] == 'FD001'
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"text"', '{"filters": ["Prov"], "codes": ["FD001"]}', 'not json',
+                                  '{"codes": "FD001"}', '{"codes": [1, 2]}'])
+def test_malformed_request_is_400(post, body):
+    status, response = post(body)
+    assert status == 400 and response['error']
+
+
+def test_unknown_filter_column_is_400(post):
+    status, response = post(json.dumps({'filters': {'Provnce': ['35']}, 'codes': ['FD001']}))
+    assert status == 400 and 'Provnce' in response['error']
+
+
+def test_unknown_codes_are_listed_in_a_400(post):
+    status, response = post(json.dumps({'codes': ['FD001', 'FD0O1', 'XX999']}))
+    assert status == 400 and 'FD0O1, XX999' in response['error'] and 'FD001,' not in response['error']
+
+
+def test_health(post):
+    status, response = post(path='/health')
+    assert status == 200 and response['records'] == 100
+
+
+def test_health_failure_is_500(post):
+    status, response = post(path='/health', service='broken')
+    assert status == 500 and 'OSError' in response['error']
+
+
+def test_service_failure_is_500(post):
+    status, response = post(json.dumps({'codes': ['FD001']}), service='broken')
+    assert status == 500 and 'OSError' in response['error']
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import reference_estimators as ref
+from shs_engine import ReplicateEngine
+
+BOOTSTRAP_COLS = ['BSW1', 'BSW2']
+
+
+def tiny_frame():
+    """Four households with equal main weights; BSW1 drops the first one"""
+    return pd.DataFrame({
+        'WeightD': [1.0, 1.0, 1.0, 1.0],
+        'BSW1': [0.0, 1.0, 1.0, 1.0],
+        'BSW2': [1.0, 1.0, 1.0, 1.0],
+        'FD001': [0.0, 10.0, 20.0, np.nan],
+        'SH001': [1.0, 2.0, 3.0, 4.0],
+        'HHSize': [1, 2, 4, 2],
+    })
+
+
+def random_frame(n=300, n_replicates=20, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'WeightD': rng.uniform(50, 150, n),
+        'FD001': np.where(rng.random(n) < 0.3, 0.0, rng.gamma(2.0, 500.0, n)),
+        'HHSize': rng.integers(1, 5, n).astype(float),
+    })
+    df.loc[rng.random(n) < 0.05, 'FD001'] = np.nan
+    df.loc[rng.random(n) < 0.05, 'HHSize'] = np.nan
+    cols = [f'BSW{b}' for b in range(1, n_replicates + 1)]
+    for col in cols:
+        df[col] = df['WeightD'] * rng.exponential(1.0, n)
+    return df, cols
+
+
+def test_weighted_median_with_bootstrap_variance():
+    engine = ReplicateEngine(tiny_frame(), BOOTSTRAP_COLS)
+    result = engine.estimate_quantiles(['SH001'], [0.5])
+    # Main weight: cumulative 1, 2 reaches half of 4 at value 2; BSW1 reaches 1.5 of 3 at value 3
+    assert result['quantile'][0, 0] == 2.0
+    assert result['variance'][0, 0] == pytest.approx(0.5)
+    expected = ref.estimate_quantiles(tiny_frame(), 'SH001', [0.5], BOOTSTRAP_COLS)[0]
+    assert expected['mean'] == 2.0 and expected['variance'] == pytest.approx(0.5)
+
+
+def test_participation_rate_and_reporter_mean():
+    engine = ReplicateEngine(tiny_frame(), BOOTSTRAP_COLS)
+    result = engine.estimate(['FD001'], participation=True)
+    # Two of the three households with a value report spending; BSW1 leaves only reporters
+    assert result['participation'][0] == pytest.approx(2 / 3)
+    assert result['participation_se'][0] == pytest.approx(np.sqrt((1 - 2 / 3) ** 2 / 2))
+    assert result['reporter_mean'][0] == pytest.approx(15.0)
+    assert result['reporter_mean_se'][0] == pytest.approx(0.0)
+
+
+def test_spending_per_person():
+    engine = ReplicateEngine(tiny_frame(), BOOTSTRAP_COLS)
+    result = engine.estimate(['FD001'], denominators={'per_person': engine.household_size()})
+    # The household without FD001 is left out of the persons too: 30 / 7, and 30 / 6 under BSW1
+    assert result['per_person'][0] == pytest.approx(30 / 7)
+    assert result['per_person_se'][0] == pytest.approx(np.sqrt((5 - 30 / 7) ** 2 / 2))
+
+
+def test_engine_matches_the_reference_estimators():
+    df, cols = random_frame()
+    engine = ReplicateEngine(df, cols)
+    probabilities = [0.1, 0.5, 0.9]
+    quantiles = engine.estimate_quantiles(['FD001'], probabilities)
+    for k, expected in enumerate(ref.estimate_quantiles(df, 'FD001', probabilities, cols)):
+        assert quantiles['quantile'][0, k] == expected['mean']
+        assert quantiles['std_error'][0, k] == pytest.approx(expected['std_error'], rel=1e-9)
+
+    result = engine.estimate(['FD001'], participation=True,
+                             denominators={'per_person': engine.household_size()})
+    rate, reporters = ref.estimate_participation(df, 'FD001', cols)
+    assert result['participation'][0] == pytest.approx(rate['mean'], rel=1e-9)
+    assert result['participation_se'][0] == pytest.approx(rate['std_error'], rel=1e-7)
+    assert result['reporter_mean'][0] == pytest.approx(reporters['mean'], rel=1e-9)
+    assert result['reporter_mean_se'][0] == pytest.approx(reporters['std_error'], rel=1e-7)
+    per_person = ref.estimate_ratio(df, 'FD001', ref.household_size(df), cols)
+    assert result['per_person'][0] == pytest.approx(per_person['mean'], rel=1e-9)
+    assert result['per_person_se'][0] == pytest.approx(per_person['std_error'], rel=1e-7)
@@ -0,0 +1,20 @@
+import pytest
+import streamlit.logger
+
+streamlit.logger.set_log_level('ERROR')
+
+from app import parse_income_bands  # noqa: E402
+
+
+def test_thousands_separators_are_not_limit_separators():
+    assert parse_income_bands("25,000, 50,000, 1,000,000") == [25000.0, 50000.0, 1000000.0]
+
+
+def test_plain_and_shorthand_limits():
+    assert parse_income_bands("25000,50000; $75k 100000") == [25000.0, 50000.0, 75000.0, 100000.0]
+
+
+@pytest.mark.parametrize('text', ["-5000, 10000", "0, 10000", "50000, 25000", "25000, 25000", "abc", ""])
+def test_invalid_limits_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_income_bands(text)
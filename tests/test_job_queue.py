@@ -0,0 +1,27 @@
+import threading
+import time
+
+from job_queue import CANCELLED, DONE, JobManager
+
+
+def wait(manager, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while not manager.get(job_id).finished and time.time() < deadline:
+        time.sleep(0.01)
+    return manager.get(job_id)
+
+
+def test_cancelled_job_does_not_wait_for_a_heavy_slot():
+    manager = JobManager(max_workers=2, max_heavy_jobs=1)
+    release = threading.Event()
+    ran = []
+    blocker = manager.submit('blocker', lambda job: release.wait(5))
+    queued = manager.submit('queued', lambda job: ran.append(job.id))
+    time.sleep(0.2)
+    manager.cancel(queued)
+    try:
+        assert wait(manager, queued, timeout=2).status == CANCELLED
+        assert not ran
+    finally:
+        release.set()
+    assert wait(manager, blocker).status == DONE
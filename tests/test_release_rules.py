@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from release_rules import flag_table, parent_positions
+
+CODES = ['TE001', 'TC001', 'TX010', 'EP011', 'MG001']
+
+
+def balance_table():
+    """TE001 and its four children; TX010 rests on too few records"""
+    return pd.DataFrame({
+        'Spending Code': CODES,
+        'Average ($)': [1000.0, 700.0, 200.0, 60.0, 40.0],
+        'CV (%)': [2.0, 3.0, 4.0, 6.0, 8.0],
+        'Records': [500, 500, 10, 500, 500],
+    })
+
+
+def test_te001_children_have_a_parent_without_hierarchy():
+    assert parent_positions(CODES, {}).tolist() == [-1, 0, 0, 0, 0]
+
+
+def test_lone_suppressed_te001_child_gets_a_complement():
+    table = balance_table()
+    flagged = flag_table(table, [('Quality', 'CV (%)', ['Average ($)'], 'Records')], suppress=True,
+                         parents=parent_positions(CODES, {}))
+    # MG001, the smallest sibling, is suppressed so TX010 cannot be derived from TE001
+    assert flagged['Quality'].tolist() == ['A', 'A', 'x', 'B', 'x']
+    assert flagged['Average ($)'].isna().tolist() == [False, False, True, False, True]
+
+
+def test_no_complementary_flags_without_suppression():
+    table = balance_table()
+    flagged = flag_table(table, [('Quality', 'CV (%)', ['Average ($)'], 'Records')], suppress=False,
+                         parents=parent_positions(CODES, {}))
+    assert flagged['Quality'].tolist() == ['A', 'A', 'x', 'B', 'B']
+    np.testing.assert_array_equal(flagged['Average ($)'], table['Average ($)'])
+
+
+def test_lone_suppressed_group_gets_a_complement_across_the_row():
+    table = pd.DataFrame({'Spending Code': ['TE001']})
+    for name, average, records in [('Q1', 500.0, 500), ('Q2', 800.0, 10), ('Q3', 1200.0, 500), ('Total', 833.3, 1510)]:
+        table[f'{name} Avg ($)'] = [average]
+        table[f'{name} CV (%)'] = [3.0]
+        table[f'{name} Records'] = [records]
+    specs = [(f'{name} Quality', f'{name} CV (%)', [f'{name} Avg ($)'], f'{name} Records')
+             for name in ('Q1', 'Q2', 'Q3', 'Total')]
+    flagged = flag_table(table, specs, suppress=True, parents=parent_positions(['TE001'], {}), total=3)
+    # Q2 could otherwise be derived from the Total and Q1 and Q3, so Q1 (the smaller) goes too
+    assert [flagged[f'{name} Quality'][0] for name in ('Q1', 'Q2', 'Q3', 'Total')] == ['x', 'x', 'A', 'A']
+
+
+def test_crosstab_cell_is_protected_along_both_margins():
+    # 2 x 2 cells with row margins (r, All), column margins (All, c) and the grand total
+    cells = [(1, 1), (1, 2), (1, 'All'), (2, 1), (2, 2), (2, 'All'), ('All', 1), ('All', 2), ('All', 'All')]
+    table = pd.DataFrame({'Average ($)': [100.0, 200.0, 150.0, 300.0, 400.0, 350.0, 200.0, 300.0, 250.0],
+                          'CV (%)': 2.0, 'Records': [10] + [500] * 8})
+    across = np.array([2, 2, -1, 5, 5, -1, 8, 8, -1])
+    down = np.array([6, 7, 8, 6, 7, 8, -1, -1, -1])
+    flagged = flag_table(table, [('Quality', 'CV (%)', ['Average ($)'], 'Records')], suppress=True,
+                         parents=[across, down])
+    # The four inner cells are suppressed together and every margin stays published
+    suppressed = [cell for cell, flag in zip(cells, flagged['Quality']) if flag == 'x']
+    assert suppressed == [(1, 1), (1, 2), (2, 1), (2, 2)]
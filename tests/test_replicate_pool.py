@@ -0,0 +1,45 @@
+import glob
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from shs_engine import ReplicateEngine
+
+
+def small_engine(workers):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'WeightD': rng.uniform(50, 150, 200), 'FD001': rng.uniform(0, 100, 200)})
+    for b in range(1, 9):
+        df[f'BSW{b}'] = rng.uniform(50, 150, 200)
+    return ReplicateEngine(df, [f'BSW{b}' for b in range(1, 9)], workers=workers)
+
+
+def shared_dirs():
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return set(glob.glob(os.path.join(root, 'shs-engine-*')))
+
+
+def test_concurrent_callers_start_one_pool():
+    engine = small_engine(workers=2)
+    before = shared_dirs()
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def start():
+        barrier.wait()
+        pools.append(engine._ensure_pool())
+
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert len({id(pool) for pool, _, _ in pools}) == 1
+        assert len(shared_dirs() - before) == 1
+    finally:
+        engine.close()
+    assert shared_dirs() == before